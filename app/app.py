@@ -1,15 +1,34 @@
-from flask import Flask, request, render_template
-from migration_scripts import get_access_token, execute_fetchxml_query, read_fetchxml, load_data_to_target, transform_data, setup_logging, load_config
+import os
+import sys
+import json
+import time
+from flask import Flask, Response, jsonify, request, render_template, url_for
+from migration_scripts import get_client, execute_fetchxml_query, read_fetchxml, load_data_to_target, transform_data, setup_logging, load_config
 import logging
 from migration_scripts.utilities import inspect_temp_data
+from migration_scripts.change_detection import detect_changes
+from migration_scripts.dead_letters import DeadLetterFile, replay_dead_letters
+from migration_scripts.jobs import STATUS_RUNNING, JobAlreadyRunning, get_job, start_job
+from migration_scripts.load_journal import LoadJournal
+from migration_scripts.load_schedule import plan_load_schedule
+from migration_scripts.lookups import LookupResolver, LookupRule, resolve_lookups
+from migration_scripts.metadata import get_metadata
+from migration_scripts.metrics import HTTP_BYTES, render_metrics
+from migration_scripts.retry import RetryPolicy
+from migration_scripts.transform_plan import compile_transform_plan
+from migration_scripts.validation import validate_data
+from migration_scripts.watermarks import apply_watermark, collect_watermarks, load_watermarks, save_watermarks
 
 # Import the inspection function
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Configure logging
-setup_logging()
+# Configure logging from the "logging" section of config.json, when present, and whether
+# request and response bytes are measured
+startup_config = load_config('config.json') if os.path.exists('config.json') else {}
+setup_logging(startup_config.get('logging'))
+HTTP_BYTES.enabled = startup_config.get('http_bytes_metric', True)
 logger = logging.getLogger(__name__)
 
 @app.route('/')
@@ -20,58 +39,298 @@ def index():
     logger.debug(f"FetchXML files from config: {fetchxml_files}")
     return render_template('index.html', fetchxml_files=fetchxml_files)
 
+def get_client_options(config):
+    """
+    Read the connection, timeout, retry and rate limit options of the Dataverse clients from the configuration.
+
+    Args:
+        config (dict): The loaded configuration.
+
+    Returns:
+        dict: Keyword arguments of get_client.
+    """
+    # A list in the configuration gives separate connect and read timeouts
+    timeout = config.get('request_timeout', 120)
+    return {
+        'pool_maxsize': config.get('http_pool_maxsize', 32),
+        'authority_host': config.get('authority_host', 'https://login.microsoftonline.com'),
+        'retry_policy': RetryPolicy(config.get('retry_max_attempts', 5), config.get('retry_base_delay', 1.0), config.get('retry_max_delay', 60.0)),
+        'rate_limit': config.get('rate_limit'),
+        'concurrency_limit': config.get('concurrency_limit', 52),
+        'timeout': tuple(timeout) if isinstance(timeout, list) else timeout,
+    }
+
+def run_migration(config, job=None):
+    """
+    Run the extract, transform and load pipeline for a configuration.
+
+    Args:
+        config (dict): The loaded configuration.
+        job (MigrationJob): Job receiving progress and cancellation requests.
+
+    Returns:
+        dict: Record counts of the extract, transform and, when enabled, validate and change detection stages,
+            and the number of records that failed to load and were written to the dead-letter file, if any.
+    """
+    # Extract required values from the configuration
+    tenant_id = config['tenant_id']
+    client_id = config['client_id']
+    client_secret = config['client_secret']
+    source_base_url = config['source_base_url']
+    target_base_url = config['target_base_url']
+    fetchxml_files = config['fetchxml_files']
+    user_mapping = config['user_mapping']
+    date_field = config['date_field']
+    date_value = config['date_value']
+    batch_config = config['batch_config']
+    target_db_type = config['target_db_type']
+    extract_workers = config.get('extract_workers', 4)
+    extract_prefetch_pages = config.get('extract_prefetch_pages', 0)
+    extract_partitions = config.get('extract_partitions', 1)
+    extract_partition_strategy = config.get('extract_partition_strategy', 'guid')
+    extract_partition_field = config.get('extract_partition_field')
+    extract_stream = config.get('extract_stream', False)
+    extract_page_size = config.get('extract_page_size')
+    extract_lean = config.get('extract_lean', False)
+    store_compress = config.get('store_compress', False)
+    store_segment_records = config.get('store_segment_records', 100000)
+    load_batch_size = config.get('load_batch_size', 0)
+    load_changeset_size = config.get('load_changeset_size', 0)
+    load_workers = config.get('load_workers', 4)
+    load_order = config.get('load_order', 'batch_config')
+    incremental = config.get('incremental', False)
+    watermark_file = config.get('watermark_file', 'watermarks.json')
+    load_journal_file = config.get('load_journal_file')
+    upsert = config.get('upsert', False)
+    upsert_keys = config.get('upsert_keys', {})
+    resume = config.get('resume', False)
+    transform_plan = config.get('transform_plan')
+    transform_chunk_size = config.get('transform_chunk_size', 10000)
+    transform_workers = config.get('transform_workers', 0)
+    validate_records = config.get('validate_records', False)
+    rejects_file = config.get('rejects_file', 'rejects.ndjson')
+    change_detection = config.get('change_detection')
+    metadata_cache_dir = config.get('metadata_cache_dir', 'metadata_cache')
+    metadata_ttl = config.get('metadata_ttl', 86400)
+    lookup_rules = config.get('lookups', {})
+    lookup_cache_dir = config.get('lookup_cache_dir', 'lookup_cache')
+    lookup_ttl = config.get('lookup_ttl', 3600)
+    dead_letter_file = config.get('dead_letter_file')
+    client_options = get_client_options(config)
+    
+    # Define record store directories for temporary and transformed data
+    temp_storage_file = 'temp_data'
+    transformed_storage_file = 'transformed_data'
+    validated_storage_file = 'validated_data'
+    changed_storage_file = 'changed_data'
+
+    # Get pooled clients for source and target Dataverse; tokens are cached and refreshed by the clients,
+    # and every stage sending requests to an instance shares the rate limits of its client
+    source_client = get_client(client_id, client_secret, tenant_id, source_base_url, **client_options)
+    target_client = get_client(client_id, client_secret, tenant_id, target_base_url, **client_options)
+
+    # Entity set names, primary keys and attribute types come from cached EntityDefinitions metadata
+    source_metadata = get_metadata(source_base_url, metadata_cache_dir, metadata_ttl)
+    target_metadata = get_metadata(target_base_url, metadata_cache_dir, metadata_ttl)
+    
+    # Read FetchXML queries from files
+    fetchxml_queries = [read_fetchxml(file) for file in fetchxml_files]
+
+    # Restrict each query to rows changed since its last successful load
+    if incremental:
+        watermarks = load_watermarks(watermark_file)
+        fetchxml_queries = [apply_watermark(query, watermarks.get(file)) for file, query in zip(fetchxml_files, fetchxml_queries)]
+    
+    # In lean mode only the annotations the transform plan reads are requested
+    annotations = None
+    if extract_lean:
+        annotations = compile_transform_plan(transform_plan, user_mapping, date_field, date_value, target_db_type).required_annotations()
+
+    # Extract data from source using FetchXML queries
+    raw_data = execute_fetchxml_query(source_client, fetchxml_queries, source_base_url, temp_storage_file, extract_workers, extract_prefetch_pages, store_compress, store_segment_records, job=job,
+                                      metadata=source_metadata, partitions=extract_partitions,
+                                      partition_strategy=extract_partition_strategy, partition_field=extract_partition_field,
+                                      stream=extract_stream, page_size=extract_page_size, annotations=annotations)
+    logger.debug("Extracted raw data: %s", raw_data)
+    if incremental:
+        new_watermarks = collect_watermarks(raw_data, fetchxml_files, watermarks)
+    
+    # Resolve referenced users, teams and records in bulk so the transform can bind them
+    lookups = None
+    if lookup_rules:
+        rules = [LookupRule.from_config(field, rule) for field, rule in lookup_rules.items()]
+        lookups = resolve_lookups(rules, LookupResolver(target_client, target_metadata, lookup_cache_dir, lookup_ttl),
+                                  LookupResolver(source_client, source_metadata, lookup_cache_dir, lookup_ttl))
+
+    # Transform the raw data
+    transformed_data = transform_data(temp_storage_file, transformed_storage_file, user_mapping, date_field, date_value, target_db_type, store_compress, store_segment_records, transform_plan, transform_chunk_size, job=job,
+                                      lookups=lookups, workers=transform_workers)
+    logger.info("Transformed data: %s", transformed_data)
+
+    # Check every record against the cached target metadata so invalid rows are rejected before any write
+    load_input = transformed_data
+    rejected = 0
+    if validate_records:
+        load_input = validated_data = validate_data(transformed_storage_file, validated_storage_file, target_client, target_metadata, batch_config, rejects_file,
+                                                    upsert, upsert_keys, store_compress, store_segment_records, transform_chunk_size, job=job)
+        partitions = transformed_data.partitions()
+        rejected = sum(len(partitions[table]) for table in batch_config if table in partitions) - len(validated_data)
+    
+    # Load transformed data to target, journaling every record so a failed run can resume
+    # and keeping the records that still fail after retries for a later replay
+    journal = LoadJournal(load_journal_file) if load_journal_file else None
+    dead_letters = DeadLetterFile(dead_letter_file) if dead_letter_file else None
+    try:
+        # Drop the records the target already holds unchanged, by the journal of previous loads or a projection query
+        if change_detection:
+            load_input = detect_changes(load_input.path, changed_storage_file, target_client, target_metadata, batch_config, change_detection,
+                                        journal, upsert_keys, store_compress, store_segment_records, transform_chunk_size, job=job)
+
+        # Derive the load order from the query relationships and record references instead of batch_config numbers
+        schedule = None
+        if load_order == 'dependencies':
+            partitions = load_input.partitions()
+            tables = [table for table in batch_config if table in partitions]
+            schedule = plan_load_schedule(partitions, tables, fetchxml_queries, target_metadata, target_client)
+
+        load_failed = load_data_to_target(load_input, target_base_url, batch_config, target_client, load_batch_size, load_changeset_size, load_workers,
+                                          journal, upsert, upsert_keys, resume, job=job, metadata=target_metadata,
+                                          schedule=schedule, dead_letters=dead_letters)
+    finally:
+        if journal is not None:
+            journal.close()
+        if dead_letters is not None:
+            dead_letters.close()
+
+    # Only move the high-water marks once every record was loaded, so the next incremental
+    # run extracts the rejected and failed rows again
+    if incremental:
+        if load_failed or rejected:
+            logger.warning(f"Keeping the previous watermarks in {watermark_file}, {rejected} records were rejected and {load_failed} failed to load.")
+        else:
+            save_watermarks(new_watermarks, watermark_file)
+
+    result = {'extracted': len(raw_data), 'transformed': len(transformed_data)}
+    if validate_records:
+        result['validated'] = len(validated_data)
+    if change_detection:
+        result['changed'] = len(load_input)
+    if load_failed:
+        result['failed'] = load_failed
+    if dead_letters:
+        result['dead_letters'] = len(dead_letters)
+        logger.warning(f"{len(dead_letters)} records failed to load and were written to {dead_letter_file}, replay them with 'python app.py replay'.")
+    return result
+
+def run_replay(config, job=None):
+    """
+    Retry the records of the dead-letter file against the target.
+
+    Args:
+        config (dict): The loaded configuration.
+        job (MigrationJob): Job receiving progress and cancellation requests.
+
+    Returns:
+        dict: The number of dead letters replayed, recovered and still failing.
+    """
+    target_base_url = config['target_base_url']
+    target_client = get_client(config['client_id'], config['client_secret'], config['tenant_id'], target_base_url,
+                               **get_client_options(config))
+    target_metadata = get_metadata(target_base_url, config.get('metadata_cache_dir', 'metadata_cache'), config.get('metadata_ttl', 86400))
+    load_journal_file = config.get('load_journal_file')
+    journal = LoadJournal(load_journal_file) if load_journal_file else None
+    try:
+        return replay_dead_letters(config.get('dead_letter_file') or 'dead_letters.ndjson', target_client, target_metadata,
+                                   config['batch_config'], config.get('load_batch_size', 0), config.get('load_changeset_size', 0),
+                                   config.get('upsert', False), config.get('upsert_keys', {}), journal, job=job)
+    finally:
+        if journal is not None:
+            journal.close()
+
+def job_conflict(job):
+    # Jobs share their work files, so a second one is refused while the first runs
+    logger.warning(f"Refused to start a job while job {job.id} is running.")
+    return jsonify({'error': f"Job {job.id} is still running.", 'job_id': job.id,
+                    'status_url': url_for('job_status', job_id=job.id)}), 409
+
 @app.route('/migrate', methods=['POST'])
 def migrate_data():
     try:
         # Load configuration from 'config.json'
         config = load_config('config.json')
-        
-        # Extract required values from the configuration
-        tenant_id = config['tenant_id']
-        client_id = config['client_id']
-        client_secret = config['client_secret']
-        source_base_url = config['source_base_url']
-        target_base_url = config['target_base_url']
-        fetchxml_files = config['fetchxml_files']
-        user_mapping = config['user_mapping']
-        date_field = config['date_field']
-        date_value = config['date_value']
-        batch_config = config['batch_config']
-        target_db_type = config['target_db_type']
-        
-        # Define file names for temporary and transformed data
-        temp_storage_file = 'temp_data.json'
-        transformed_storage_file = 'transformed_data.json'
-
-        # Authenticate to source Dataverse
-        source_access_token = get_access_token(client_id, client_secret, tenant_id, source_base_url)
-        # Authenticate to target Dataverse
-        target_access_token = get_access_token(client_id, client_secret, tenant_id, target_base_url)
-        
-        # Read FetchXML queries from files
-        fetchxml_queries = [read_fetchxml(file) for file in fetchxml_files]
-        
-        # Extract data from source using FetchXML queries
-        raw_data = execute_fetchxml_query(source_access_token, fetchxml_queries, source_base_url, temp_storage_file)
-        logger.debug(f"Extracted raw data: {raw_data}")
-        
-        # Transform the raw data
-        transformed_data = transform_data(temp_storage_file, transformed_storage_file, user_mapping, date_field, date_value, target_db_type)
-        logger.debug(f"Transformed data: {transformed_data}")
-        
-        # Inspect the transformed data
-        logger.info(f"Transformed data: {transformed_data}")
-        
-        # Load transformed data to target
-        load_data_to_target(transformed_data, target_base_url, batch_config, target_access_token)
-        
-        return "Migration completed successfully!"
+
+        # Run the migration in the background and return the job id immediately
+        job = start_job(run_migration, config)
+        logger.info(f"Started migration job {job.id}.")
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    except JobAlreadyRunning as e:
+        return job_conflict(e.job)
     except Exception as e:
         logger.error(f"Migration failed: {e}", exc_info=True)
         return "Migration failed. Check logs for details.", 500
 
+@app.route('/dead-letters/replay', methods=['POST'])
+def replay():
+    try:
+        config = load_config('config.json')
+
+        # Replay in the background like a migration, reporting through the same job endpoints
+        job = start_job(run_replay, config)
+        logger.info(f"Started dead-letter replay job {job.id}.")
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    except JobAlreadyRunning as e:
+        return job_conflict(e.job)
+    except Exception as e:
+        logger.error(f"Replay failed: {e}", exc_info=True)
+        return "Replay failed. Check logs for details.", 500
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job {job_id}"}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job {job_id}"}), 404
+
+    def stream():
+        # Send a Server-Sent Event whenever the job changes, at most twice per second
+        version = None
+        while True:
+            snapshot = job.snapshot()
+            if snapshot['version'] != version:
+                version = snapshot['version']
+                yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot['status'] != STATUS_RUNNING:
+                break
+            time.sleep(0.5)
+            job.wait_for_change(version, 15)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job {job_id}"}), 404
+    job.cancel()
+    return jsonify(job.snapshot()), 202
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    # "python app.py replay" retries the dead-letter file once and exits
+    if sys.argv[1:2] == ['replay']:
+        print(json.dumps(run_replay(load_config('config.json'))))
+        sys.exit(0)
+
     # Run the inspection to see the raw data structure
-    inspect_temp_data('temp_data.json')
+    inspect_temp_data('temp_data')
     
     app.run(debug=True)
@@ -0,0 +1,97 @@
+"""
+Throttling and throughput of concurrent requests with and without the request governor.
+
+Worker threads share one client and send Web API requests to a local mock Dataverse
+that enforces a request limit per sliding window, like the service protection limits.
+Without a governor the workers run into the limit and wait out Retry-After; with one
+the rate adapts to the x-ms-ratelimit-* headers and throttled responses. Run from the
+app directory:
+
+    python -m benchmarks.governor_benchmark --requests 900 --request-limit 300 --limit-window 10
+"""
+import time
+import logging
+import argparse
+import threading
+
+import requests
+
+from migration_scripts.dataverse_client import DataverseClient
+from migration_scripts.governor import RequestGovernor
+from migration_scripts.retry import RetryPolicy
+from benchmarks.mock_dataverse import start_in_process
+
+QUERY = "api/data/v9.1/crmk_plants?$select=crmk_plantid"
+
+
+def run(base_url, total, workers, governor):
+    """
+    Send `total` requests from `workers` threads through one client.
+
+    Returns:
+        dict: Elapsed seconds, requests that succeeded and that failed after retries, and throttled responses.
+    """
+    client = DataverseClient(base_url, access_token="token", pool_maxsize=workers, retry_policy=RetryPolicy(max_attempts=5),
+                             governor=governor)
+    counts = {"succeeded": 0, "failed": 0, "throttled": 0}
+    lock = threading.Lock()
+    remaining = iter(range(total))
+    original_send = client._send
+
+    def send(*args):
+        response = original_send(*args)
+        if response.status_code == 429:
+            with lock:
+                counts["throttled"] += 1
+        return response
+
+    client._send = send
+
+    def work():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            try:
+                client.get(QUERY).raise_for_status()
+                outcome = "succeeded"
+            except requests.RequestException:
+                outcome = "failed"
+            with lock:
+                counts[outcome] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+    return dict(counts, seconds=round(time.perf_counter() - started, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=900)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--request-limit", type=int, default=300)
+    parser.add_argument("--limit-window", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--max-rate", type=float, default=100, help="Highest rate of the governor, above the limit of the mock.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    for name in ("ungoverned", "governed"):
+        process, base_url = start_in_process(rows=10, latency=args.latency, request_limit=args.request_limit,
+                                             limit_window=args.limit_window, retry_after=1)
+        try:
+            governor = RequestGovernor(base_url, args.max_rate, args.workers) if name == "governed" else None
+            result = run(base_url, args.requests, args.workers, governor)
+        finally:
+            process.terminate()
+        print(f"{name:>10}: {result['seconds']:7.2f} s, {result['succeeded']} succeeded, {result['failed']} failed, "
+              f"{result['throttled']} throttled responses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of per-record logging cost before and after lazy, sampled logging.
+
+Run from the app directory:
+
+    python -m benchmarks.logging_benchmark --rows 1000000
+"""
+import os
+import time
+import logging
+import argparse
+
+from migration_scripts.log_utils import Payload, RecordSampler, configure_logging, stop_logging
+from benchmarks.transform_benchmark import synthetic_rows
+
+logger = logging.getLogger("benchmarks.logging")
+
+
+def run_baseline(rows):
+    started = time.perf_counter()
+    for item in rows:
+        pass
+    return time.perf_counter() - started
+
+
+def run_before(rows):
+    started = time.perf_counter()
+    for item in rows:
+        logger.debug(f"Data to be sent: {item}")
+        logger.info(f"Successfully loaded record with ID {item.get('crmk_plantid', 'unknown')} into table crmk_plant. Status: 204")
+    return time.perf_counter() - started
+
+
+def run_after(rows):
+    sampler = RecordSampler("load crmk_plant")
+    started = time.perf_counter()
+    for item in rows:
+        if sampler.sample():
+            logger.debug("Data to be sent: %s", Payload(item))
+            logger.info("Successfully loaded record with ID %s into table crmk_plant. Status: %s (logging 1 of every %d records)",
+                        item.get("crmk_plantid"), 204, sampler.every)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--sample-every", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Log lines are written to the null device from the queue listener, so only
+    # the cost paid by the pipeline thread is measured
+    configure_logging(level="INFO", log_file=os.devnull, sample_every=args.sample_every, console=False)
+    try:
+        baseline = run_baseline(synthetic_rows(args.rows))
+        before = run_before(synthetic_rows(args.rows)) - baseline
+        after = run_after(synthetic_rows(args.rows)) - baseline
+    finally:
+        stop_logging()
+
+    print(f"rows: {args.rows}")
+    print(f"before (per-record f-strings): {before:.2f} s, {before / args.rows * 1e9:.0f} ns/record")
+    print(f"after (lazy, sampled):         {after:.2f} s, {after / args.rows * 1e9:.0f} ns/record")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
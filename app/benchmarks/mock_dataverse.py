@@ -0,0 +1,579 @@
+"""
+Local stand-in for the Azure AD token endpoint and the Dataverse Web API.
+
+Serves FetchXML and $select queries page by page with @odata.nextLink, accepts POST, PATCH
+and $batch writes, and can inject latency, 429 throttling and server errors. A request
+limit per sliding window can be enforced like the service protection limits, reported
+in x-ms-ratelimit-burst-remaining-xrm-requests headers.
+Records carry the annotations requested with Prefer: odata.include-annotations,
+and responses can be gzip or deflate encoded.
+Run from the app directory:
+
+    python -m benchmarks.mock_dataverse --rows 100000 --port 8080 --latency 0.02
+"""
+import json
+import math
+import time
+import uuid
+import re
+import gzip
+import zlib
+import bisect
+import fnmatch
+import random
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+from datetime import datetime, timedelta
+
+from migration_scripts.query_partitions import DATE_FORMAT, sql_guid_key
+
+logger = logging.getLogger(__name__)
+
+API_PATH = "/api/data/v9.1/"
+
+# Page size used when a FetchXML query does not set a count
+DEFAULT_PAGE_SIZE = 5000
+
+OWNER_IDS = ("old_user_id_1", "old_user_id_2")
+
+CREATED_START = datetime(2024, 1, 1)
+
+# Natural key columns of reference tables, with the format of their values
+NATURAL_KEYS = {
+    "systemuser": ("domainname", "user{}@contoso.com"),
+    "team": ("name", "Team {}"),
+}
+
+FORMATTED_VALUE = "OData.Community.Display.V1.FormattedValue"
+LOOKUP_LOGICAL_NAME = "Microsoft.Dynamics.CRM.lookuplogicalname"
+ASSOCIATED_NAVIGATION_PROPERTY = "Microsoft.Dynamics.CRM.associatednavigationproperty"
+
+
+def make_record(entity, index):
+    """
+    Build the deterministic source row with a given index.
+
+    Args:
+        entity (str): The logical name of the queried entity.
+        index (int): The 0-based row number.
+
+    Returns:
+        dict: The row, shaped like a Dataverse FetchXML result.
+    """
+    record = {
+        "@odata.etag": f'W/"{index}"',
+        f"{entity}id": str(uuid.UUID(int=index + 1)),
+        "crmk_primaryname": f"{entity} {index}",
+        "crmk_projectshortname": f"{index % 1000:03d}",
+        "owner_id": OWNER_IDS[index % len(OWNER_IDS)],
+        "modifiedon": f"2024-01-01T00:00:{index % 60:02d}Z",
+        "createdon": (CREATED_START + timedelta(seconds=index)).strftime(DATE_FORMAT),
+    }
+    if entity in NATURAL_KEYS:
+        key, value_format = NATURAL_KEYS[entity]
+        record[key] = value_format.format(index)
+    return record
+
+
+def annotate_record(record, annotations):
+    """
+    Add the annotations Dataverse returns for a row when they are requested.
+
+    Args:
+        record (dict): A row built by make_record.
+        annotations (list): The requested annotation names, which may use * wildcards.
+
+    Returns:
+        dict: The row with the matching annotations added.
+    """
+    if not annotations:
+        return record
+    created = datetime.strptime(record["createdon"], DATE_FORMAT)
+    candidates = {
+        f"owner_id@{FORMATTED_VALUE}": f"Migration User {record['owner_id'][-1]}",
+        f"owner_id@{ASSOCIATED_NAVIGATION_PROPERTY}": "ownerid",
+        f"owner_id@{LOOKUP_LOGICAL_NAME}": "systemuser",
+        f"createdon@{FORMATTED_VALUE}": f"{created.month}/{created.day}/{created.year} {created:%I:%M %p}",
+        f"modifiedon@{FORMATTED_VALUE}": "1/1/2024 12:00 AM",
+        f"crmk_projectshortname@{FORMATTED_VALUE}": f"Project {record['crmk_projectshortname']}",
+    }
+    for key, value in candidates.items():
+        name = key.split("@", 1)[1]
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in annotations):
+            record[key] = value
+    return record
+
+
+def _sort_key(entity, field):
+    """
+    Comparison key of a column the rows are sorted by, None for other columns.
+    """
+    if field == f"{entity}id":
+        return sql_guid_key
+    if field == "createdon":
+        return str
+    return None
+
+
+def entity_definition(entity):
+    """
+    Build the EntityDefinitions entry served for an entity.
+
+    Args:
+        entity (str): The logical name of the entity.
+
+    Returns:
+        dict: The definition, with the entity set name, keys and attribute types.
+    """
+    attributes = {
+        f"{entity}id": "Uniqueidentifier",
+        "crmk_primaryname": "String",
+        "crmk_projectshortname": "String",
+        "ownerid": "Owner",
+        "modifiedon": "DateTime",
+        "createdon": "DateTime",
+        "statecode": "State",
+    }
+    if entity in NATURAL_KEYS:
+        attributes[NATURAL_KEYS[entity][0]] = "String"
+    return {
+        "LogicalName": entity,
+        "EntitySetName": f"{entity}s",
+        "PrimaryIdAttribute": f"{entity}id",
+        "PrimaryNameAttribute": "crmk_primaryname",
+        "Attributes": [{"LogicalName": name, "AttributeType": attribute_type} for name, attribute_type in attributes.items()],
+    }
+
+
+def attribute_definitions(entity, cast=""):
+    """
+    Build the Attributes entries served for an entity, optionally cast to one metadata type.
+
+    Args:
+        entity (str): The logical name of the entity.
+        cast (str): The metadata type, e.g. "StringAttributeMetadata". Empty for every attribute.
+
+    Returns:
+        list: The attribute definitions, with required levels, maximum lengths, options and lookup targets.
+    """
+    attributes = {attribute["LogicalName"]: attribute["AttributeType"] for attribute in entity_definition(entity)["Attributes"]}
+    if not cast:
+        return [{
+            "LogicalName": name,
+            "RequiredLevel": {"Value": "ApplicationRequired" if name == "crmk_primaryname" else
+                              "SystemRequired" if attribute_type in ("Owner", "State") else "None"},
+            "IsValidForCreate": name not in ("createdon", "modifiedon"),
+            "IsValidForUpdate": name not in ("createdon", "modifiedon", f"{entity}id"),
+        } for name, attribute_type in attributes.items()]
+    if cast == "StringAttributeMetadata":
+        return [{"LogicalName": name, "MaxLength": 10 if name == "crmk_projectshortname" else 100}
+                for name, attribute_type in attributes.items() if attribute_type == "String"]
+    if cast == "StateAttributeMetadata":
+        return [{"LogicalName": "statecode", "OptionSet": {"Options": [{"Value": 0}, {"Value": 1}]}}]
+    if cast == "LookupAttributeMetadata":
+        return [{"LogicalName": "ownerid", "Targets": ["systemuser", "team"]}]
+    return []
+
+
+def _boundary(content_type):
+    for parameter in content_type.split(";")[1:]:
+        name, _, value = parameter.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    return None
+
+
+def _parts(body, boundary):
+    parts = []
+    for chunk in body.split(f"--{boundary}")[1:]:
+        if chunk.startswith("--"):
+            break
+        parts.append(chunk.strip("\r\n"))
+    return parts
+
+
+def _part_headers(part):
+    head, _, payload = part.partition("\r\n\r\n")
+    headers = {}
+    for line in head.split("\r\n"):
+        name, _, value = line.partition(":")
+        if value:
+            headers[name.strip().lower()] = value.strip()
+    return headers, payload
+
+
+class MockDataverse:
+    """
+    Threaded HTTP server emulating the token endpoint and the Dataverse Web API.
+
+    Every entity set holds `rows` deterministic rows built by make_record, so any
+    FetchXML query returns the same data on every run. Write requests are counted
+    but not stored.
+
+    Args:
+        rows (int): Number of rows returned for every queried entity.
+        latency (float): Seconds added to every request.
+        throttle_rate (float): Fraction of Web API requests rejected with 429.
+        error_rate (float): Fraction of Web API requests failing with 500.
+        retry_after (int): Seconds sent in the Retry-After header of throttled responses.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free port.
+        seed (int): Seed of the random generator deciding injected failures.
+        compress (bool): Whether to gzip or deflate encode responses for clients accepting it.
+        request_limit (int): Web API requests allowed per `limit_window`, None for no limit.
+        limit_window (float): Seconds of the sliding window of request_limit.
+    """
+
+    def __init__(self, rows=1000, latency=0.0, throttle_rate=0.0, error_rate=0.0, retry_after=1,
+                 host="127.0.0.1", port=0, seed=0, compress=False, request_limit=None, limit_window=300):
+        self.rows = rows
+        self.request_limit = request_limit
+        self.limit_window = limit_window
+        self._window = deque()
+        self.compress = compress
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.stats = {"token": 0, "metadata": 0, "pages": 0, "records_read": 0, "writes": 0, "batches": 0, "throttled": 0, "errors": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _take_request(self):
+        # Returns the requests left in the window, or minus the seconds until one is allowed again
+        now = time.monotonic()
+        with self._lock:
+            while self._window and self._window[0] <= now - self.limit_window:
+                self._window.popleft()
+            if len(self._window) >= self.request_limit:
+                return -(self._window[0] + self.limit_window - now)
+            self._window.append(now)
+            return self.request_limit - len(self._window)
+
+    def _inject_failure(self):
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            self._count("throttled")
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            self._count("errors")
+            return 500
+        return None
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            limit_headers = {}
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status, body=b"", content_type="application/json; odata.metadata=minimal", headers=None):
+                accepted = self.headers.get("Accept-Encoding", "") if mock.compress and body else ""
+                if "gzip" in accepted:
+                    body = gzip.compress(body, compresslevel=6)
+                    headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+                elif "deflate" in accepted:
+                    body = zlib.compress(body, 6)
+                    headers = dict(headers or {}, **{"Content-Encoding": "deflate"})
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("OData-Version", "4.0")
+                for name, value in dict(self.limit_headers, **(headers or {})).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status, payload, headers=None):
+                self._send(status, json.dumps(payload).encode("utf-8"), headers=headers)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length).decode("utf-8") if length else ""
+
+            def _handle(self, method):
+                self.limit_headers = {}
+                if mock.latency:
+                    time.sleep(mock.latency)
+                path = urlsplit(self.path).path
+                body = self._read_body() if method in ("POST", "PATCH") else ""
+                if path.endswith("/oauth2/v2.0/token"):
+                    mock._count("token")
+                    return self._send_json(200, {"token_type": "Bearer", "expires_in": 3600, "access_token": "mock-access-token"})
+                if not path.startswith(API_PATH):
+                    return self._send_json(404, {"error": {"code": "0x80060888", "message": f"Resource not found: {path}"}})
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    return self._send_json(401, {"error": {"code": "0x80072560", "message": "Missing access token."}})
+                if mock.request_limit is not None:
+                    remaining = mock._take_request()
+                    if remaining < 0:
+                        mock._count("throttled")
+                        return self._send_json(429, {"error": {"code": "0x80072322", "message": "Number of requests exceeded the limit."}},
+                                               headers={"Retry-After": str(math.ceil(-remaining))})
+                    self.limit_headers = {"x-ms-ratelimit-burst-remaining-xrm-requests": f"{remaining:,}"}
+                failure = mock._inject_failure()
+                if failure == 429:
+                    return self._send_json(429, {"error": {"code": "0x80072322", "message": "Number of requests exceeded the limit."}},
+                                           headers={"Retry-After": str(mock.retry_after)})
+                if failure == 500:
+                    return self._send_json(500, {"error": {"code": "0x80040216", "message": "An unexpected error occurred."}})
+                resource = path[len(API_PATH):]
+                if method == "GET" and resource == "EntityDefinitions":
+                    return self._get_definitions()
+                if method == "GET" and resource.startswith("EntityDefinitions("):
+                    return self._get_attributes(resource)
+                if method == "GET":
+                    return self._get_page(resource)
+                if resource == "$batch":
+                    return self._post_batch(body)
+                return self._write(method, resource, body)
+
+            def _get_definitions(self):
+                name_filter = parse_qs(urlsplit(self.path).query).get("$filter", [""])[0]
+                entities = re.findall(r"LogicalName eq '([^']+)'", name_filter)
+                mock._count("metadata")
+                return self._send_json(200, {"value": [entity_definition(entity) for entity in entities]})
+
+            def _get_attributes(self, resource):
+                # EntityDefinitions(LogicalName='<entity>')/Attributes[/Microsoft.Dynamics.CRM.<type>]
+                match = re.match(r"EntityDefinitions\(LogicalName='([^']+)'\)/Attributes(?:/Microsoft\.Dynamics\.CRM\.(\w+))?$", resource)
+                if match is None:
+                    return self._send_json(404, {"error": {"code": "0x80060888", "message": f"Resource not found: {resource}"}})
+                mock._count("metadata")
+                return self._send_json(200, {"value": attribute_definitions(match.group(1), match.group(2) or "")})
+
+            def _get_page(self, entity_set):
+                query = parse_qs(urlsplit(self.path).query)
+                fetchxml_query = query.get("fetchXml", [None])[0]
+                if fetchxml_query is None:
+                    return self._get_collection(entity_set, query)
+                root = ET.fromstring(fetchxml_query)
+                entity = root.find("entity").attrib["name"]
+                preference = re.search(r'odata\.include-annotations="([^"]*)"', self.headers.get("Prefer", ""))
+                annotations = preference.group(1).split(",") if preference else []
+                lowest, highest = self._row_range(entity, root)
+                rows = range(lowest, highest)
+                order = root.find("entity/order")
+                if order is not None and order.attrib.get("descending") == "true":
+                    rows = rows[::-1]
+                if "top" in root.attrib:
+                    rows = rows[:int(root.attrib["top"])]
+                page_size = int(root.attrib.get("count", DEFAULT_PAGE_SIZE))
+                page = int(root.attrib.get("page", 1))
+                start = (page - 1) * page_size
+                stop = min(start + page_size, len(rows))
+                more_records = stop < len(rows)
+                payload = {
+                    "@odata.context": f"{mock.base_url}{API_PATH}$metadata#{entity_set}",
+                    "value": [annotate_record(make_record(entity, index), annotations) for index in rows[start:stop]],
+                    "@Microsoft.Dynamics.CRM.morerecords": more_records,
+                }
+                if more_records:
+                    root.set("page", str(page + 1))
+                    next_query = ET.tostring(root, encoding="unicode")
+                    payload["@odata.nextLink"] = f"{mock.base_url}{API_PATH}{entity_set}?fetchXml={quote(next_query)}"
+                mock._count("pages")
+                mock._count("records_read", max(stop - start, 0))
+                return self._send_json(200, payload)
+
+            def _get_collection(self, entity_set, query):
+                # OData queries page with odata.maxpagesize and a $skiptoken holding the next row
+                if "$select" not in query:
+                    return self._send_json(400, {"error": {"code": "0x80040203", "message": "Queries without $select are not supported."}})
+                entity = entity_set[:-1]
+                columns = query["$select"][0].split(",")
+                preference = re.search(r"odata\.maxpagesize=(\d+)", self.headers.get("Prefer", ""))
+                page_size = int(preference.group(1)) if preference else DEFAULT_PAGE_SIZE
+                start = int(query.get("$skiptoken", [0])[0])
+                stop = min(start + page_size, mock.rows)
+                payload = {
+                    "@odata.context": f"{mock.base_url}{API_PATH}$metadata#{entity_set}",
+                    "value": [{column: record.get(column) for column in columns}
+                              for record in (make_record(entity, index) for index in range(start, stop))],
+                }
+                if stop < mock.rows:
+                    select = quote(query["$select"][0], safe=",")
+                    payload["@odata.nextLink"] = f"{mock.base_url}{API_PATH}{entity_set}?$select={select}&$skiptoken={stop}"
+                mock._count("pages")
+                mock._count("records_read", stop - start)
+                return self._send_json(200, payload)
+
+            def _row_range(self, entity, root):
+                # Rows are sorted by their id and createdon, so range conditions on
+                # those columns select a contiguous slice; other conditions are ignored.
+                lowest, highest = 0, mock.rows
+                for condition in root.findall("entity/filter/condition"):
+                    field, operator = condition.attrib.get("attribute"), condition.attrib.get("operator")
+                    key = _sort_key(entity, field)
+                    if key is None:
+                        continue
+                    if operator == "null":
+                        highest = lowest
+                        continue
+                    if operator not in ("ge", "lt"):
+                        continue
+                    index = bisect.bisect_left(range(mock.rows), key(condition.attrib["value"]),
+                                               key=lambda row: key(make_record(entity, row)[field]))
+                    if operator == "ge":
+                        lowest = max(lowest, index)
+                    else:
+                        highest = min(highest, index)
+                return lowest, max(lowest, highest)
+
+            def _write(self, method, resource, body):
+                try:
+                    json.loads(body or "{}")
+                except ValueError:
+                    return self._send_json(400, {"error": {"code": "0x80040201", "message": "Invalid JSON payload."}})
+                mock._count("writes")
+                entity_set = resource.split("(")[0]
+                record_id = resource[len(entity_set) + 1:-1] if method == "PATCH" else str(uuid.uuid4())
+                return self._send(204, headers={"OData-EntityId": f"{mock.base_url}{API_PATH}{entity_set}({record_id})"})
+
+            def _post_batch(self, body):
+                boundary = _boundary(self.headers.get("Content-Type", ""))
+                if boundary is None:
+                    return self._send_json(400, {"error": {"code": "0x80040203", "message": "Missing batch boundary."}})
+                response_boundary = f"batchresponse_{uuid.uuid4()}"
+                lines = []
+                for part in _parts(body, boundary):
+                    headers, payload = _part_headers(part)
+                    changeset_boundary = _boundary(headers.get("content-type", ""))
+                    if changeset_boundary:
+                        changeset_response = f"changesetresponse_{uuid.uuid4()}"
+                        lines.extend([f"--{response_boundary}", f"Content-Type: multipart/mixed; boundary={changeset_response}", ""])
+                        for operation in _parts(payload, changeset_boundary):
+                            lines.append(f"--{changeset_response}")
+                            lines.extend(self._batch_operation(operation))
+                        lines.append(f"--{changeset_response}--")
+                    else:
+                        lines.append(f"--{response_boundary}")
+                        lines.extend(self._batch_operation(part))
+                lines.extend([f"--{response_boundary}--", ""])
+                mock._count("batches")
+                return self._send(200, "\r\n".join(lines).encode("utf-8"), content_type=f"multipart/mixed; boundary={response_boundary}")
+
+            def _batch_operation(self, operation):
+                headers, http_message = _part_headers(operation)
+                request_line = http_message.split("\r\n", 1)[0]
+                entity_set = request_line.split(" ")[1].rsplit("/", 1)[-1].split("(")[0]
+                mock._count("writes")
+                return [
+                    "Content-Type: application/http",
+                    "Content-Transfer-Encoding: binary",
+                    f"Content-ID: {headers.get('content-id', '')}",
+                    "",
+                    "HTTP/1.1 204 No Content",
+                    f"OData-EntityId: {mock.base_url}{API_PATH}{entity_set}({uuid.uuid4()})",
+                    "",
+                ]
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+        return Handler
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+
+        Returns:
+            MockDataverse: The started server.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-dataverse", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock Dataverse serving {self.rows} rows per entity at {self.base_url}.")
+        return self
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def _serve(options, ready):
+    mock = MockDataverse(**options)
+    ready.put(mock.base_url)
+    mock.server.serve_forever()
+
+
+def start_in_process(**options):
+    """
+    Run a mock server in a separate process, so it does not compete with the
+    pipeline under test for the interpreter lock.
+
+    Args:
+        **options: Passed on to MockDataverse.
+
+    Returns:
+        tuple: The server process and its base URL.
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=_serve, args=(options, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--compress", action="store_true", help="Encode responses with gzip or deflate.")
+    parser.add_argument("--request-limit", type=int, default=None, help="Web API requests allowed per --limit-window seconds.")
+    parser.add_argument("--limit-window", type=float, default=300)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    mock = MockDataverse(args.rows, args.latency, args.throttle_rate, args.error_rate, args.retry_after, args.host, args.port,
+                         compress=args.compress, request_limit=args.request_limit, limit_window=args.limit_window)
+    print(f"Serving {mock.base_url}; use it as source_base_url, target_base_url and authority_host.")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+End-to-end throughput and peak memory of the extract, transform and load stages.
+
+Runs the migration_scripts pipeline against a local mock Dataverse in a separate
+process. Run from the app directory:
+
+    python -m benchmarks.pipeline_benchmark --rows 10000 100000 1000000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from migration_scripts import execute_fetchxml_query, get_client, load_data_to_target, transform_data
+from benchmarks.mock_dataverse import start_in_process
+
+ENTITY = "crmk_plant"
+USER_MAPPING = {"old_user_id_1": "new_generic_user_id", "default": "new_generic_user_id"}
+DATE_FIELD = "last_updated"
+DATE_VALUE = "2024-01-01"
+
+
+def benchmark_query(page_size):
+    return (
+        f'<fetch count="{page_size}"><entity name="{ENTITY}">'
+        '<attribute name="crmk_plantid" /><attribute name="crmk_primaryname" />'
+        '<attribute name="crmk_projectshortname" /></entity></fetch>'
+    )
+
+
+def measure(stage, rows, function, *args, **kwargs):
+    """
+    Run one stage and report its wall time, throughput and peak traced memory.
+    """
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    return result, {
+        "rows": rows,
+        "stage": stage,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "peak_mib": round(peak / 2 ** 20, 1),
+    }
+
+
+def run_pipeline(base_url, rows, work_dir, args):
+    """
+    Run extract, transform and load once and return the measurements of every stage.
+    """
+    client = get_client("benchmark", "secret", "tenant", base_url, pool_maxsize=args.pool_maxsize, authority_host=base_url)
+    raw_path = os.path.join(work_dir, f"raw-{rows}")
+    transformed_path = os.path.join(work_dir, f"transformed-{rows}")
+
+    tracemalloc.start()
+    try:
+        raw, extract = measure("extract", rows, execute_fetchxml_query, client, [benchmark_query(args.page_size)], base_url,
+                               raw_path, 1, args.prefetch_pages, args.compress, stream=args.stream,
+                               annotations=[] if args.lean else None)
+        if len(raw) != rows:
+            raise RuntimeError(f"Extracted {len(raw)} of {rows} rows.")
+        transformed, transform = measure("transform", rows, transform_data, raw_path, transformed_path, USER_MAPPING,
+                                         DATE_FIELD, DATE_VALUE, "dynamics365", args.compress)
+        _, load = measure("load", rows, load_data_to_target, transformed, base_url, {ENTITY: 1}, client,
+                          args.batch_size, 0, args.load_workers)
+    finally:
+        tracemalloc.stop()
+    return [extract, transform, load]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--prefetch-pages", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--load-workers", type=int, default=4)
+    parser.add_argument("--pool-maxsize", type=int, default=32)
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--stream", action="store_true", help="Decode response pages incrementally.")
+    parser.add_argument("--lean", action="store_true", help="Request no annotations beyond paging.")
+    parser.add_argument("--gzip", action="store_true", help="Let the mock encode responses with gzip.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every mock request.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the measurements to this JSON file.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>9} {'stage':<10} {'seconds':>9} {'records/s':>11} {'peak MiB':>9}")
+    for rows in args.rows:
+        process, base_url = start_in_process(rows=rows, latency=args.latency, throttle_rate=args.throttle_rate,
+                                             error_rate=args.error_rate, compress=args.gzip)
+        try:
+            with tempfile.TemporaryDirectory() as work_dir:
+                for result in run_pipeline(base_url, rows, work_dir, args):
+                    results.append(result)
+                    print(f"{result['rows']:>9} {result['stage']:<10} {result['seconds']:>9.2f} "
+                          f"{result['records_per_second']:>11.0f} {result['peak_mib']:>9.1f}")
+        finally:
+            process.terminate()
+            process.join()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Memory held by a table of records as plain dicts and as a compact RecordTable.
+
+Records are decoded one JSON line at a time, as they are read back from a record
+store, so every dict holds its own copy of the column names. Run from the app
+directory:
+
+    python -m benchmarks.record_memory_benchmark --rows 100000 1000000
+"""
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+from migration_scripts.compact_records import RecordTable
+from benchmarks.transform_benchmark import synthetic_rows
+
+
+def decoded_rows(count):
+    for row in synthetic_rows(count):
+        yield json.loads(json.dumps(row))
+
+
+def measure(build, rows):
+    """
+    Build a table and report the memory it holds and the time it took.
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    table = build(decoded_rows(rows))
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return table, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'container':<12} {'MiB':>9} {'bytes/row':>10} {'seconds':>9}")
+    for rows in args.rows:
+        for name, build in (("dicts", list), ("RecordTable", RecordTable)):
+            table, size, elapsed = measure(build, rows)
+            print(f"{rows:>9} {name:<12} {size / 2 ** 20:>9.1f} {size / rows:>10.0f} {elapsed:>9.2f}")
+            del table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Micro-benchmark of the per-record transform cost before and after compiled transform plans.
+
+Run from the app directory:
+
+    python -m benchmarks.transform_benchmark --rows 1000000
+
+With --workers, the rows are also transformed from a record store, in this
+process and in a pool of worker processes:
+
+    python -m benchmarks.transform_benchmark --rows 1000000 --workers 4
+"""
+import os
+import time
+import uuid
+import logging
+import argparse
+import tempfile
+from itertools import islice
+
+from migration_scripts.log_utils import Payload
+from migration_scripts.record_store import RecordStore
+from migration_scripts.transform_data import transform_data
+from migration_scripts.transform_plan import compile_transform_plan
+
+logger = logging.getLogger(__name__)
+
+USER_MAPPING = {"old_user_id_1": "new_generic_user_id", "default": "new_generic_user_id"}
+DATE_FIELD = "last_updated"
+DATE_VALUE = "2024-01-01"
+
+
+# The per-record transforms the compiled plans replaced, kept as the "before" case and
+# as the reference transform_plan.DEFAULT_PLANS is tested against
+def transform_for_dynamics365(item, user_mapping, date_field, date_value):
+    """
+    Transform data for Dynamics 365.
+
+    Args:
+        item (dict): The raw data item.
+        user_mapping (dict): Mapping of old user IDs to new user IDs.
+        date_field (str): The field name for date.
+        date_value (str): The value to set for the date field.
+
+    Returns:
+        dict: The transformed data item.
+    """
+    item = item.copy()
+    
+    logical_name = item.get('Item.crmk_itemid') and 'crmk_item' or \
+                   item.get('LandObject.crmk_denominationname') and 'crmk_landobject' or 'crmk_unknown'
+    
+    # Remove properties not applicable to Dynamics 365
+    item.pop('@odata.etag', None)
+    item.pop('Item.crmk_itemid@OData.Community.Display.V1.AttributeName', None)
+    item.pop('LandObject.crmk_denominationname@OData.Community.Display.V1.AttributeName', None)
+    
+    # Add or update necessary fields
+    item["OwnerId"] = user_mapping.get(item.get("owner_id"), user_mapping["default"])
+    
+    if logical_name == 'crmk_plant':
+        item[date_field] = date_value
+        item[date_field] = 'crmk_MigratedOn'
+
+    # Remove invalid properties
+    item.pop('logical_name', None)
+    item.pop('address1_latitude', None)
+    item.pop('description', None)
+    item.pop('revenue', None)
+    item.pop('modifiedon', None)  # Read-only system column, only extracted for incremental runs
+
+    logger.debug("Transformed item for Dynamics 365: %s", Payload(item))
+    return item
+
+
+def transform_for_other_db(item, user_mapping, date_field, date_value):
+    """
+    Transform data for other target database types.
+
+    Args:
+        item (dict): The raw data item.
+        user_mapping (dict): Mapping of old user IDs to new user IDs.
+        date_field (str): The field name for date.
+        date_value (str): The value to set for the date field.
+
+    Returns:
+        dict: The transformed data item.
+    """
+    transformed_item = item.copy()  # Create a copy of the raw data item
+    transformed_item["owner"] = user_mapping.get(item.get("owner_id"), user_mapping["default"])  # Add owner field
+    transformed_item[date_field] = date_value  # Add date field
+    return transformed_item
+
+
+def synthetic_rows(count):
+    """
+    Yield rows shaped like the extracted plant, item and land object rows.
+    """
+    plant_id = str(uuid.uuid4())
+    for index in range(count):
+        row = {
+            "@odata.etag": f'W/"{index}"',
+            "crmk_projectshortname": "123",
+            "crmk_plantid": plant_id,
+            "crmk_primaryname": "123 testilitest",
+        }
+        if index % 2:
+            row["Item.crmk_itemid@OData.Community.Display.V1.AttributeName"] = "crmk_itemid"
+            row["Item.crmk_itemid"] = str(uuid.UUID(int=index))
+        else:
+            row["LandObject.crmk_denominationname@OData.Community.Display.V1.AttributeName"] = "crmk_denominationname"
+            row["LandObject.crmk_denominationname"] = f"LAND {index}"
+        yield row
+
+
+def chunks(rows, chunk_size):
+    rows = iter(rows)
+    return iter(lambda: list(islice(rows, chunk_size)), [])
+
+
+def run_before(rows, chunk_size):
+    elapsed = 0.0
+    for chunk in chunks(rows, chunk_size):
+        started = time.perf_counter()
+        for item in chunk:
+            target_db_type = "dynamics365"
+            if target_db_type == "dynamics365":
+                transform_for_dynamics365(item, USER_MAPPING, DATE_FIELD, DATE_VALUE)
+        elapsed += time.perf_counter() - started
+    return elapsed
+
+
+def run_after(rows, chunk_size):
+    elapsed = 0.0
+    plan = compile_transform_plan(None, USER_MAPPING, DATE_FIELD, DATE_VALUE, "dynamics365")
+    for chunk in chunks(rows, chunk_size):
+        started = time.perf_counter()
+        plan.apply_batch(chunk)
+        elapsed += time.perf_counter() - started
+    return elapsed
+
+
+def run_store(rows, chunk_size, workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        raw_path = os.path.join(temp_dir, "raw")
+        with RecordStore.create(raw_path).writer(0, "crmk_plant") as writer:
+            writer.write_many(rows)
+        started = time.perf_counter()
+        transform_data(raw_path, os.path.join(temp_dir, "transformed"), USER_MAPPING, DATE_FIELD, DATE_VALUE,
+                       "dynamics365", chunk_size=chunk_size, workers=workers)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=0, help="Also time the store transform with this many processes")
+    args = parser.parse_args()
+
+    before = run_before(synthetic_rows(args.rows), args.chunk_size)
+    after = run_after(synthetic_rows(args.rows), args.chunk_size)
+    print(f"rows: {args.rows}")
+    print(f"before (transform_for_dynamics365): {before:.2f} s, {before / args.rows * 1e9:.0f} ns/record")
+    print(f"after (compiled transform plan):    {after:.2f} s, {after / args.rows * 1e9:.0f} ns/record")
+    print(f"speedup: {before / after:.1f}x")
+
+    if args.workers > 1:
+        serial = run_store(synthetic_rows(args.rows), args.chunk_size, 0)
+        parallel = run_store(synthetic_rows(args.rows), args.chunk_size, args.workers)
+        print(f"store transform in process:      {serial:.2f} s, {args.rows / serial:.0f} records/s")
+        print(f"store transform with {args.workers} workers: {parallel:.2f} s, {args.rows / parallel:.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
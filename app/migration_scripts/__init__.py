@@ -3,5 +3,6 @@ from .load_data import load_data_to_target
 from .transform_data import transform_data
 from .utilities import setup_logging, load_config
 from .authenticate import get_access_token
+from .dataverse_client import DataverseClient, get_client
 
 # Importing necessary modules and functions from other files in the same package
@@ -1,10 +1,14 @@
+import time  # Importing the time module for measuring request latency
 import requests  # Importing the requests library for making HTTP requests
 import logging  # Importing the logging module for logging messages
+from . import metrics  # Importing the metrics registry for instrumentation
 
 logger = logging.getLogger(__name__)  # Creating a logger object for logging messages
 
-def get_access_token(client_id, client_secret, tenant_id, resource):
-    url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"  # Constructing the URL for token endpoint
+AUTHORITY_HOST = "https://login.microsoftonline.com"  # Azure AD authority used unless a config overrides it
+
+def request_access_token(client_id, client_secret, tenant_id, resource, authority_host=AUTHORITY_HOST):
+    url = f"{authority_host.rstrip('/')}/{tenant_id}/oauth2/v2.0/token"  # Constructing the URL for token endpoint
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}  # Setting the headers for the request
     body = {
         'grant_type': 'client_credentials',  # Grant type for client credentials flow
@@ -18,13 +22,23 @@ def get_access_token(client_id, client_secret, tenant_id, resource):
     logger.debug(f"Request body: {body}")  # Logging the request body
     
     try:
-        response = requests.post(url, headers=headers, data=body)  # Sending the POST request to get the access token
+        with metrics.track_stage('authenticate'):  # Measuring the wall time of authentication
+            started = time.perf_counter()  # Starting the latency timer
+            try:
+                response = requests.post(url, headers=headers, data=body)  # Sending the POST request to get the access token
+            except requests.exceptions.RequestException:
+                metrics.observe_request('POST', url, 'error', time.perf_counter() - started)  # Recording the failed request
+                raise
+            metrics.observe_request('POST', url, response.status_code, time.perf_counter() - started, received=len(response.content or b''))  # Recording the request latency and size
         response.raise_for_status()  # Raising an exception if the response status code is not successful
-        access_token = response.json().get('access_token')  # Extracting the access token from the response
-        if not access_token:
+        token_response = response.json()  # Decoding the token response, including access_token and expires_in
+        if not token_response.get('access_token'):
             raise ValueError("No access token found in the response.")  # Raising an exception if access token is not found
         logger.info("Authentication successful.")  # Logging a success message
-        return access_token  # Returning the access token
+        return token_response  # Returning the full token response
     except requests.exceptions.RequestException as e:
         logger.error(f"Authentication failed: {e}", exc_info=True)  # Logging an error message with exception details
         raise  # Raising the exception again to propagate it to the caller
+
+def get_access_token(client_id, client_secret, tenant_id, resource, authority_host=AUTHORITY_HOST):
+    return request_access_token(client_id, client_secret, tenant_id, resource, authority_host)['access_token']  # Returning only the access token
@@ -0,0 +1,159 @@
+import logging
+from itertools import islice
+from . import metrics
+from .load_data import get_record_id
+from .metadata import LOOKUP_TYPES
+from .record_hash import comparable_values, digest_values, lookup_columns, normalize_value
+from .record_store import RecordStore
+
+logger = logging.getLogger(__name__)
+
+# Where the hashes of the target's current rows come from
+CHANGES_FROM_JOURNAL = 'journal'
+CHANGES_FROM_TARGET = 'target'
+
+# Rows requested per page of the target projection query
+TARGET_PAGE_SIZE = 5000
+
+
+class TargetSnapshot:
+    """
+    The current values of some columns of every row of a target table.
+
+    Read with one paged $select projection query, so comparing any number of records
+    costs a few requests. Rows are matched by the upsert key columns of the table, or
+    by the primary key.
+
+    Args:
+        client (DataverseClient): The client for the target instance.
+        entity (EntityMetadata): The definition of the target table.
+        columns (iterable): The columns to read.
+        key_columns (list): The columns identifying a row.
+        page_size (int): Rows requested per page.
+    """
+
+    def __init__(self, client, entity, columns, key_columns, page_size=TARGET_PAGE_SIZE):
+        self.entity = entity
+        self.key_columns = list(key_columns)
+        self.columns = tuple(dict.fromkeys(self.key_columns + [column for column in columns if column in entity.attributes]))
+        self.rows = {}
+        self._fetch(client, page_size)
+
+    def _select(self, column):
+        # Lookups are returned as _<column>_value holding the id of the referenced row
+        return f"_{column}_value" if self.entity.attributes.get(column) in LOOKUP_TYPES else column
+
+    def _fetch(self, client, page_size):
+        url = f"api/data/v9.1/{self.entity.entity_set}?$select={','.join(map(self._select, self.columns))}"
+        headers = {"Prefer": f"odata.maxpagesize={page_size}"}
+        selects = [(self._select(column), self.entity.attributes.get(column)) for column in self.columns]
+        key_positions = [self.columns.index(column) for column in self.key_columns]
+        pages = 0
+        while url:
+            response = client.get(url, headers=headers)
+            response.raise_for_status()
+            payload = response.json()
+            for row in payload.get('value', []):
+                values = tuple(normalize_value(row.get(select), attribute_type) for select, attribute_type in selects)
+                self.rows[tuple(values[position] for position in key_positions)] = values
+            url = payload.get('@odata.nextLink')
+            pages += 1
+        logger.info(f"Read {len(self.rows)} {self.entity.logical_name} rows of {client.base_url} in {pages} pages.")
+
+    def content_hash(self, values):
+        """
+        Hash the current values of the row matching a record, over the columns the record writes.
+
+        Args:
+            values (dict): The comparable values of the record, see comparable_values.
+
+        Returns:
+            str or None: The hex digest, None when no row matches or the record writes a column that was not read.
+        """
+        row = self.rows.get(tuple(values.get(column) for column in self.key_columns))
+        if row is None or not all(column in self.columns for column in values):
+            return None
+        current = dict(zip(self.columns, row))
+        return digest_values({column: current[column] for column in values})
+
+
+def detect_changes(transformed_storage_file, changed_storage_file, client, metadata, tables, source=CHANGES_FROM_JOURNAL,
+                   journal=None, upsert_keys=None, compress=False, segment_records=100000, chunk_size=10000, job=None,
+                   page_size=TARGET_PAGE_SIZE):
+    """
+    Drop the records the target already holds an identical copy of.
+
+    The content hash of every record is compared with the hash of the target's
+    current row, taken from the content hashes the load journal kept for committed
+    records, or computed from a projection query of the columns the records write.
+    Records without a matching row or hash are kept, so only proven duplicates are skipped.
+
+    Args:
+        transformed_storage_file (str): Path to the record store with the records to load.
+        changed_storage_file (str): Path to the record store where the changed records will be saved.
+        client (DataverseClient): The client for the target instance.
+        metadata (MetadataCache): Entity definitions of the target instance.
+        tables (iterable): The logical names of the tables to load.
+        source (str): CHANGES_FROM_JOURNAL or CHANGES_FROM_TARGET.
+        journal (LoadJournal): The load journal of previous runs, required for CHANGES_FROM_JOURNAL.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns identifying target rows.
+        compress (bool): Whether the changed record store segments are gzip compressed.
+        segment_records (int): Maximum number of records per record store segment.
+        chunk_size (int): Number of records compared per batch.
+        job (MigrationJob): Job receiving progress, checked for cancellation after every batch.
+        page_size (int): Rows requested per page of the target projection query.
+
+    Returns:
+        RecordStore: The record store holding the new and changed records.
+    """
+    if source not in (CHANGES_FROM_JOURNAL, CHANGES_FROM_TARGET):
+        raise ValueError(f"Unknown change detection source {source!r}, expected '{CHANGES_FROM_JOURNAL}' or '{CHANGES_FROM_TARGET}'.")
+    if source == CHANGES_FROM_JOURNAL and journal is None:
+        raise ValueError("Change detection from the journal requires a load journal.")
+
+    input_data = RecordStore(transformed_storage_file)
+    partitions = input_data.partitions()
+    tables = [table for table in tables if table in partitions]
+    metadata.prefetch(client, tables)
+    changed_data = RecordStore.create(changed_storage_file, compress, segment_records)
+    if job is not None:
+        job.start_stage('detect_changes', sum(len(partitions[table]) for table in tables))
+    unchanged = 0
+    with metrics.track_stage('detect_changes') as stage:
+        for part, table in enumerate(tables):
+            entity = metadata.entity(client, table)
+            lookups = lookup_columns(entity.attributes)
+            if source == CHANGES_FROM_JOURNAL:
+                hashes = journal.committed_hashes(table)
+
+                def current_hash(record, values):
+                    return hashes.get(str(get_record_id(record, entity.primary_id)))
+            else:
+                columns = set()
+                for record in partitions[table]:
+                    columns.update(comparable_values(record, entity.attributes, lookups))
+                snapshot = TargetSnapshot(client, entity, columns, (upsert_keys or {}).get(table) or [entity.primary_id], page_size)
+
+                def current_hash(record, values):
+                    return snapshot.content_hash(values)
+
+            records = iter(partitions[table])
+            total = 0
+            with changed_data.writer(part, table) as writer:
+                for chunk in iter(lambda: list(islice(records, chunk_size)), []):
+                    for record in chunk:
+                        values = comparable_values(record, entity.attributes, lookups)
+                        if current_hash(record, values) != digest_values(values):
+                            writer.write(record)
+                    total += len(chunk)
+                    stage.records += len(chunk)
+                    if job is not None:
+                        job.advance(len(chunk))
+                        job.check_cancelled()
+            table_unchanged = total - writer.count
+            unchanged += table_unchanged
+            logger.info(f"Skipping {table_unchanged} of {total} {table} records, unchanged in the target since the last load.")
+            metrics.UNCHANGED_RECORDS.inc(table_unchanged, table=table)
+
+    logger.info(f"Detected {len(changed_data)} new or changed records, skipped {unchanged} unchanged records.")
+    return changed_data
@@ -0,0 +1,173 @@
+import sys
+import logging
+from collections.abc import Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class RecordSchema:
+    """
+    The interned column names shared by every record with the same columns.
+
+    Args:
+        keys (tuple): The column names, in record order.
+    """
+
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = tuple(sys.intern(key) if isinstance(key, str) else key for key in keys)
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+
+    def __repr__(self):
+        return f"RecordSchema({', '.join(map(str, self.keys))})"
+
+
+class CompactRecord(Mapping):
+    """
+    Read-only record holding a shared schema and a tuple of values.
+
+    Behaves like the dict it was built from for reading; to_dict converts it back
+    when a plain dict is needed, e.g. at the JSON serialization boundary.
+
+    Args:
+        schema (RecordSchema): The columns of the record.
+        values (tuple): The values, in schema order.
+    """
+
+    __slots__ = ('schema', '_values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self.schema.positions[key]]
+
+    def get(self, key, default=None):
+        position = self.schema.positions.get(key)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, key):
+        return key in self.schema.positions
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def to_dict(self):
+        return dict(zip(self.schema.keys, self._values))
+
+    def __repr__(self):
+        return f"CompactRecord({self.to_dict()!r})"
+
+
+class RecordTable(Sequence):
+    """
+    Compact list of the records of one entity.
+
+    Records are stored as CompactRecord objects sharing one RecordSchema per
+    distinct set of columns, so the column names are held once per table instead
+    of once per record. Supports len, indexing, slicing, iteration and comparison
+    with lists like the list of dicts it replaces.
+
+    Args:
+        records (iterable): Initial records, dicts or other mappings.
+        entity (str): The logical name of the entity the records belong to.
+    """
+
+    def __init__(self, records=(), entity=None):
+        self.entity = entity
+        self._schemas = {}
+        self._rows = []
+        self.extend(records)
+
+    def _schema(self, keys):
+        schema = self._schemas.get(keys)
+        if schema is None:
+            schema = self._schemas[keys] = RecordSchema(keys)
+        return schema
+
+    def compact(self, record):
+        """
+        Convert a record to a CompactRecord using the schemas of this table.
+
+        Args:
+            record (Mapping): The record.
+
+        Returns:
+            CompactRecord: The compact record.
+        """
+        if isinstance(record, CompactRecord) and self._schemas.get(record.schema.keys) is record.schema:
+            return record
+        keys = tuple(record)
+        if isinstance(record, dict):
+            return CompactRecord(self._schema(keys), tuple(record.values()))
+        return CompactRecord(self._schema(keys), tuple(record[key] for key in keys))
+
+    def append(self, record):
+        self._rows.append(self.compact(record))
+
+    def extend(self, records):
+        compact = self.compact
+        self._rows.extend(compact(record) for record in records)
+
+    @property
+    def schemas(self):
+        """
+        The distinct column layouts of the records.
+        """
+        return list(self._schemas.values())
+
+    def __getitem__(self, index):
+        # A slice is a plain list of the compact records
+        return self._rows[index]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __eq__(self, other):
+        if isinstance(other, (RecordTable, list, tuple)):
+            return len(self) == len(other) and all(row == record for row, record in zip(self._rows, other))
+        return NotImplemented
+
+    def to_dicts(self):
+        """
+        Yield every record as a plain dict.
+        """
+        for row in self._rows:
+            yield row.to_dict()
+
+    def __repr__(self):
+        return f"RecordTable({self.entity!r}, {len(self._rows)} records, {len(self._schemas)} schemas)"
+
+
+def as_dict(record):
+    """
+    Return a record as a plain dict, converting compact records.
+
+    Args:
+        record (Mapping): The record.
+
+    Returns:
+        dict: The record itself if it already is a dict.
+    """
+    if isinstance(record, dict):
+        return record
+    if isinstance(record, CompactRecord):
+        return record.to_dict()
+    return dict(record)
+
+
+def json_default(value):
+    """
+    The default hook of json.dumps serializing compact records like dicts.
+    """
+    if isinstance(value, Mapping):
+        return as_dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,346 @@
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .authenticate import AUTHORITY_HOST, request_access_token
+from .governor import LIMIT_CONCURRENT_REQUESTS, RequestGovernor
+from .retry import RETRY_STATUSES, CircuitBreaker, RetryPolicy, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Default OData headers sent with every Dataverse Web API request
+ODATA_HEADERS = {
+    "Accept": "application/json",
+    "Content-Type": "application/json",
+    "OData-MaxVersion": "4.0",
+    "OData-Version": "4.0",
+}
+
+# Methods safe to resend after a gateway error or a broken connection, when the
+# service may have processed the first attempt
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE')
+
+# Seconds to wait for a connection and for each read of a response. Dataverse ends
+# requests running for longer than two minutes, so a read waiting past that hangs.
+DEFAULT_TIMEOUT = 120
+
+_clients = {}
+_token_caches = {}
+_registry_lock = threading.Lock()
+
+
+class TokenCache:
+    """
+    Cache access tokens per resource and refresh them shortly before they expire.
+
+    Args:
+        client_id (str): The client ID of the Azure AD application.
+        client_secret (str): The client secret of the Azure AD application.
+        tenant_id (str): The tenant ID of the Azure AD tenant.
+        refresh_margin (int): Seconds before expires_in at which a token is refreshed.
+        authority_host (str): The Azure AD authority that issues the tokens.
+    """
+
+    def __init__(self, client_id, client_secret, tenant_id, refresh_margin=300, authority_host=AUTHORITY_HOST):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.tenant_id = tenant_id
+        self.refresh_margin = refresh_margin
+        self.authority_host = authority_host
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, resource):
+        """
+        Return a valid access token for a resource, authenticating only when needed.
+
+        Args:
+            resource (str): The resource (Dataverse URL) to access.
+
+        Returns:
+            str: Access token for the resource.
+        """
+        with self._lock:
+            cached = self._tokens.get(resource)
+            if cached and cached[1] - self.refresh_margin > time.monotonic():
+                return cached[0]
+            logger.debug(f"Requesting a new access token for {resource}.")
+            token_response = request_access_token(self.client_id, self.client_secret, self.tenant_id, resource, self.authority_host)
+            expires_at = time.monotonic() + int(token_response.get('expires_in', 3600))
+            self._tokens[resource] = (token_response['access_token'], expires_at)
+            return token_response['access_token']
+
+    def invalidate(self, resource):
+        """
+        Drop the cached token of a resource so the next call authenticates again.
+
+        Args:
+            resource (str): The resource (Dataverse URL) to access.
+        """
+        with self._lock:
+            self._tokens.pop(resource, None)
+
+
+def _release_on_close(response, governor):
+    # Closing a response more than once, e.g. on retry and again in a finally block, releases its slot once
+    close = response.close
+    released = threading.Event()
+
+    def release_and_close():
+        if not released.is_set():
+            released.set()
+            governor.release(response)
+        close()
+
+    return release_and_close
+
+
+class DataverseClient:
+    """
+    Pooled HTTP client for a single Dataverse instance.
+
+    Requests go through one keep-alive requests.Session with default OData headers,
+    and the Authorization header is filled in from the token cache on every request.
+    Failed requests are retried by the retry policy, and throttled ones pause every
+    thread sharing the client through its circuit breaker. With a governor, every
+    request also waits for its rate and concurrency limits.
+
+    Args:
+        base_url (str): The base URL of the Dataverse instance.
+        token_cache (TokenCache): Cache used to obtain access tokens for base_url.
+        access_token (str): A fixed access token, used when no token cache is given.
+        pool_connections (int): Number of connection pools kept by the session.
+        pool_maxsize (int): Maximum number of connections kept per pool.
+        retry_policy (RetryPolicy): How failed requests are retried. None uses the default policy.
+        governor (RequestGovernor): Rate and concurrency limits of the instance. None sends requests unlimited.
+        timeout (float or tuple): Default timeout of every request, in seconds or as (connect, read).
+    """
+
+    def __init__(self, base_url, token_cache=None, access_token=None, pool_connections=10, pool_maxsize=32, retry_policy=None,
+                 governor=None, timeout=DEFAULT_TIMEOUT):
+        if token_cache is None and access_token is None:
+            raise ValueError("Either a token cache or an access token is required.")
+        self.base_url = base_url.rstrip('/')
+        self.token_cache = token_cache
+        self.access_token = access_token
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = CircuitBreaker(self.base_url)
+        self.governor = governor
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.resize_pool(pool_connections, pool_maxsize)
+        self.session.headers.update(ODATA_HEADERS)
+
+    def resize_pool(self, pool_connections, pool_maxsize):
+        """
+        Mount a connection pool of the given size on the session.
+
+        Requests in flight finish on the previous pool, whose connections are dropped
+        once they are returned.
+
+        Args:
+            pool_connections (int): Number of connection pools kept by the session.
+            pool_maxsize (int): Maximum number of connections kept per pool.
+        """
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_size = (pool_connections, pool_maxsize)
+
+    def get_token(self):
+        """
+        Return the access token for this instance.
+
+        Returns:
+            str: Access token for base_url.
+        """
+        if self.token_cache is not None:
+            return self.token_cache.get_token(self.base_url)
+        return self.access_token
+
+    def url(self, path):
+        """
+        Build an absolute URL from a path relative to the instance, e.g. "api/data/v9.1/accounts".
+
+        Args:
+            path (str): A relative path, or an absolute URL which is returned unchanged.
+
+        Returns:
+            str: The absolute URL.
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, headers=None, **kwargs):
+        """
+        Send a request through the pooled session.
+
+        A 401 response is retried once with a freshly requested token. 429 and 503
+        responses are retried after the Retry-After wait, or an exponential backoff
+        without it, and pause every request of the client meanwhile. Gateway errors and
+        broken connections are retried with backoff for idempotent methods only, since
+        the service may have processed the first attempt. The last response is returned
+        once the retry policy runs out of attempts. Requests time out after the client's
+        timeout unless a timeout is passed. A streamed response keeps its governor slot
+        until it is closed, so it must be closed once its body has been read.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): A path relative to base_url or an absolute URL.
+            headers (dict): Extra headers merged over the session defaults.
+            **kwargs: Passed on to requests.Session.request.
+
+        Returns:
+            requests.Response: The response.
+        """
+        url = self.url(path)
+        kwargs.setdefault('timeout', self.timeout)
+        request_headers = dict(headers or {})
+        refreshed = False
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            request_headers["Authorization"] = f"Bearer {self.get_token()}"
+            retryable = attempt + 1 < self.retry_policy.max_attempts
+            try:
+                response = self._send(method, url, request_headers, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not retryable or method.upper() not in IDEMPOTENT_METHODS:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                logger.warning(f"{method} {url} failed ({e.__class__.__name__}), retrying in {delay:.1f} seconds.")
+                time.sleep(delay)
+            else:
+                status = response.status_code
+                if status == 401 and self.token_cache is not None and not refreshed:
+                    logger.info(f"Access token for {self.base_url} was rejected, refreshing it.")
+                    self.token_cache.invalidate(self.base_url)
+                    refreshed = True
+                    response.close()
+                    metrics.count_retry(url)
+                    continue
+                if status not in RETRY_STATUSES:
+                    return response
+                throttled = status in metrics.THROTTLE_STATUSES
+                delay = self.retry_policy.delay(attempt, parse_retry_after(response.headers.get('Retry-After')))
+                if throttled:
+                    self.breaker.trip(delay)
+                if not retryable or not (throttled or method.upper() in IDEMPOTENT_METHODS):
+                    return response
+                logger.warning(f"{method} {url} returned {status}, retrying in {delay:.1f} seconds.")
+                response.close()
+                if not throttled:
+                    time.sleep(delay)
+            attempt += 1
+            metrics.count_retry(url)
+
+    def _send(self, method, url, headers, kwargs):
+        governor = self.governor
+        if governor is not None:
+            governor.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        except requests.exceptions.RequestException as e:
+            metrics.observe_request(method, url, 'error', time.perf_counter() - started, metrics.request_size(e.request))
+            if governor is not None:
+                governor.release()
+            raise
+        if governor is not None:
+            if kwargs.get('stream'):
+                # The body is still to be read, so the slot is held until the response is closed
+                response.close = _release_on_close(response, governor)
+            else:
+                governor.release(response)
+        elapsed = time.perf_counter() - started
+        # The body is measured as sent, so json payloads are not serialized a second time
+        sent = metrics.request_size(getattr(response, 'request', None))
+        received = 0 if kwargs.get('stream') else len(response.content or b'')
+        metrics.observe_request(method, url, response.status_code, elapsed, sent, received)
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def close(self):
+        """
+        Close the pooled session.
+        """
+        self.session.close()
+
+
+def get_client(client_id, client_secret, tenant_id, base_url, pool_connections=10, pool_maxsize=32, authority_host=AUTHORITY_HOST,
+               retry_policy=None, rate_limit=None, concurrency_limit=LIMIT_CONCURRENT_REQUESTS, timeout=None):
+    """
+    Return the shared client for a Dataverse instance, creating it on first use.
+
+    Clients of the same application and tenant share one token cache, so source and
+    target on the same instance authenticate once and repeated runs reuse tokens
+    and connections. Every stage using the client of an instance also shares its
+    governor, so extract and load together stay within the service protection limits.
+
+    Args:
+        client_id (str): The client ID of the Azure AD application.
+        client_secret (str): The client secret of the Azure AD application.
+        tenant_id (str): The tenant ID of the Azure AD tenant.
+        base_url (str): The base URL of the Dataverse instance.
+        pool_connections (int): Number of connection pools kept by the session.
+        pool_maxsize (int): Maximum number of connections kept per pool. The pool of an existing
+            client is replaced when its size differs.
+        authority_host (str): The Azure AD authority that issues the tokens.
+        retry_policy (RetryPolicy): How failed requests are retried. Replaces the policy of an
+            existing client when given.
+        rate_limit (float): Highest requests per second of the client's governor. None leaves the
+            client without a new governor, otherwise the limits of an existing one are updated.
+        concurrency_limit (int): Highest number of requests in flight of the client's governor.
+        timeout (float or tuple): Default timeout of the client's requests, in seconds or as (connect, read).
+            Replaces the timeout of an existing client when given.
+
+    Returns:
+        DataverseClient: The shared client.
+    """
+    with _registry_lock:
+        cache_key = (authority_host, tenant_id, client_id, client_secret)
+        if cache_key not in _token_caches:
+            _token_caches[cache_key] = TokenCache(client_id, client_secret, tenant_id, authority_host=authority_host)
+        client_key = cache_key + (base_url.rstrip('/'),)
+        if client_key not in _clients:
+            _clients[client_key] = DataverseClient(base_url, _token_caches[cache_key], pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        client = _clients[client_key]
+        if client.pool_size != (pool_connections, pool_maxsize):
+            client.resize_pool(pool_connections, pool_maxsize)
+        if retry_policy is not None:
+            client.retry_policy = retry_policy
+        if timeout is not None:
+            client.timeout = timeout
+        if rate_limit is not None:
+            if client.governor is None:
+                client.governor = RequestGovernor(client.base_url, rate_limit, concurrency_limit)
+            else:
+                client.governor.configure(rate_limit, concurrency_limit)
+        return client
+
+
+def ensure_client(client, base_url):
+    """
+    Accept either a DataverseClient or a bare access token.
+
+    Args:
+        client (DataverseClient or str): A client, or an access token for base_url.
+        base_url (str): The base URL of the Dataverse instance.
+
+    Returns:
+        DataverseClient: The client, or a new client wrapping the access token.
+    """
+    if isinstance(client, DataverseClient):
+        return client
+    return DataverseClient(base_url, access_token=client)
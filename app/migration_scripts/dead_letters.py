@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from . import metrics
+from .compact_records import json_default
+from .load_data import load_table, patch_deferred_lookups
+from .load_journal import MAX_RESPONSE_LENGTH
+from .metadata import get_metadata
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterFile:
+    """
+    NDJSON file collecting the records that failed to load, to be replayed later.
+
+    Each line holds the target table, the record as it was sent, the status code and
+    error of the last attempt and, for records whose deferred lookups could not be
+    set, those lookups. Lines are appended and flushed one by one under a lock, so the
+    load workers can share one file and a crash loses at most the line being written.
+    The file is only created once a record fails.
+
+    Args:
+        path (str): Path to the NDJSON file. Existing entries are kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def add(self, table, record, status=None, error=None, lookups=None):
+        """
+        Append a failed record.
+
+        Args:
+            table (str): The logical name of the target table.
+            record (dict): The record, without logical_name.
+            status (int): The status code of the failed request, None if no response was received.
+            error (str): The response body or the exception message.
+            lookups (dict): The deferred @odata.bind properties that could not be set.
+                None when the record itself failed to load.
+        """
+        entry = {'table': table, 'record': record, 'status': status, 'error': (error or '')[:MAX_RESPONSE_LENGTH],
+                 'failed_at': datetime.now(timezone.utc).isoformat()}
+        if lookups is not None:
+            entry['lookups'] = lookups
+        line = json.dumps(entry, default=json_default) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+        metrics.DEAD_LETTERS.inc(table=table)
+
+    def entries(self):
+        """
+        Read the entries of the file.
+
+        Returns:
+            list: The entries as dicts, empty when the file does not exist.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def replay_dead_letters(path, client, metadata=None, batch_config=None, batch_size=0, changeset_size=0, upsert=False,
+                        upsert_keys=None, journal=None, job=None):
+    """
+    Retry every record of a dead-letter file in bulk.
+
+    Records are loaded again per table, in batch_config order when given, and the
+    lookups that could not be set are patched once every record is loaded. Records
+    failing again are written to a new dead-letter file that replaces the old one, or
+    the file is removed when every record succeeds. The old file is only replaced at
+    the end, so an interrupted replay can be run again, and must not run while a load
+    adds to the same file.
+
+    Args:
+        path (str): Path to the dead-letter file.
+        client (DataverseClient): The client for the target Dataverse instance.
+        metadata (MetadataCache): Entity definitions of the target instance. None uses the
+            shared in-memory cache of the client's instance.
+        batch_config (dict): Mapping of table logical names to their load order.
+        batch_size (int): Number of records sent per $batch request. 0 posts every record individually.
+        changeset_size (int): Number of records per atomic changeset inside a $batch request.
+        upsert (bool): Whether to upsert instead of create, see load_data.record_request.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+        journal (LoadJournal): Journal recording the outcome of every record.
+        job (MigrationJob): Job receiving progress, checked for cancellation between batches.
+
+    Returns:
+        dict: The number of entries replayed, recovered and still failing.
+    """
+    entries = DeadLetterFile(path).entries()
+    if not entries:
+        logger.info(f"No dead letters to replay in {path}.")
+        return {'replayed': 0, 'recovered': 0, 'failed': 0}
+
+    metadata = metadata or get_metadata(client.base_url)
+    records = {}
+    lookups = {}
+    for entry in entries:
+        if 'lookups' in entry:
+            lookups.setdefault(entry['table'], []).append((entry['record'], entry['lookups']))
+        else:
+            records.setdefault(entry['table'], []).append(entry['record'])
+    order = batch_config or {}
+    tables = sorted(records, key=lambda table: (table not in order, order.get(table, 0)))
+    metadata.prefetch(client, list(dict.fromkeys(tables + list(lookups))))
+    if job is not None:
+        job.start_stage('replay', len(entries))
+
+    retry_path = f"{path}.replaying"
+    if os.path.exists(retry_path):
+        os.remove(retry_path)
+    failed_keys = {}
+    with metrics.track_stage('replay') as stage, DeadLetterFile(retry_path) as dead_letters:
+        for table in tables:
+            logger.info(f"Replaying {len(records[table])} dead letters of table {table}.")
+            load_table(client, table, records[table], batch_size, changeset_size, journal, upsert, upsert_keys, job=job,
+                       metadata=metadata, dead_letters=dead_letters, failed_keys=failed_keys.setdefault(table, set()))
+        for table, deferred in lookups.items():
+            logger.info(f"Replaying {len(deferred)} deferred lookups of table {table}.")
+            patch_deferred_lookups(client, metadata.entity(client, table), deferred, batch_size, changeset_size, upsert_keys,
+                                   dead_letters=dead_letters, failed_keys=failed_keys.get(table))
+            if job is not None:
+                job.advance(len(deferred))
+        stage.records = len(entries)
+        failed = len(dead_letters)
+
+    if failed:
+        os.replace(retry_path, path)
+    else:
+        os.remove(path)
+    logger.info(f"Replayed {len(entries)} dead letters from {path}: {len(entries) - failed} recovered, {failed} still failing.")
+    return {'replayed': len(entries), 'recovered': len(entries) - failed, 'failed': failed}
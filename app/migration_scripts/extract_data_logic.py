@@ -1,14 +1,73 @@
 import json
 import os
 import logging
+import threading
 import requests
 from urllib.parse import quote
-from .utilities import save_to_temp_storage
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+from .record_store import RecordStore
+from .dataverse_client import ensure_client
+from .metadata import get_metadata
+from .query_partitions import PARTITION_BY_GUID, partition_query
+from .json_stream import DEFAULT_CHUNK_SIZE, PageStream
 
 import xml.etree.ElementTree as ET
 
 logger = logging.getLogger(__name__)
 
+# Response annotations the paging of FetchXML queries relies on, always requested
+PAGING_ANNOTATIONS = ['Microsoft.Dynamics.CRM.morerecords', 'Microsoft.Dynamics.CRM.fetchxmlpagingcookie']
+
+class TransferStats:
+    """
+    Pages and response bytes of one query, as sent on the wire and after decoding.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, response, body_bytes):
+        """
+        Count one response page.
+
+        Args:
+            response (requests.Response): The response, read to the end.
+            body_bytes (int): Bytes of the decoded response body.
+        """
+        try:
+            # urllib3 counts the bytes read from the socket, before gzip or deflate decoding
+            wire_bytes = int(response.raw.tell())
+        except (AttributeError, TypeError, ValueError):
+            wire_bytes = body_bytes
+        with self._lock:
+            self.pages += 1
+            self.wire_bytes += wire_bytes
+            self.body_bytes += body_bytes
+
+def extract_headers(annotations=None):
+    """
+    Build the request headers of extract queries.
+
+    Args:
+        annotations (list): Names of the OData annotations to include in the records,
+            e.g. the required_annotations of the transform plan. None includes all of them.
+
+    Returns:
+        dict: The request headers, accepting gzip or deflate encoded responses.
+    """
+    if annotations is None:
+        annotations = ['*']
+    else:
+        annotations = PAGING_ANNOTATIONS + [annotation for annotation in annotations if annotation not in PAGING_ANNOTATIONS]
+    return {
+        "Prefer": f"odata.include-annotations=\"{','.join(annotations)}\"",
+        "Accept-Encoding": "gzip, deflate",
+    }
+
 def load_fetchxml_queries():
     """
     Load FetchXML queries from XML files in the 'xml_queries' directory.
@@ -62,67 +121,299 @@ def extract_entity_name(fetchxml_query):
         logger.error(f"Error finding entity name in FetchXML query: {e}", exc_info=True)
         raise
 
-def pluralize_entity_name(entity_name):
+def set_fetchxml_page(fetchxml_query, page):
     """
-    Pluralize the entity name to match Dataverse entity set naming conventions.
+    Return a copy of a FetchXML query with the page attribute set.
 
     Args:
-        entity_name (str): The singular entity name.
+        fetchxml_query (str): The FetchXML query as a string.
+        page (int): The 1-based page number to request.
 
     Returns:
-        str: The pluralized entity set name.
+        str: The FetchXML query requesting the given page.
     """
-    if entity_name.endswith('y'):
-        return entity_name[:-1] + 'ies'
-    elif entity_name.endswith('s'):
-        return entity_name + 'es'
-    else:
-        return entity_name + 's'
+    root = ET.fromstring(fetchxml_query)
+    root.set('page', str(page))
+    return ET.tostring(root, encoding='unicode')
 
-def execute_fetchxml_query(access_token, fetchxml_queries, base_url, temp_storage_file):
+def set_fetchxml_page_size(fetchxml_query, page_size):
     """
-    Fetch data from Dataverse using the FetchXML queries.
+    Return a copy of a FetchXML query returning pages of a given size.
+
+    Queries that already set a count, or limit their rows with top, are returned unchanged.
 
     Args:
-        access_token (str): The access token for authenticating API requests.
-        fetchxml_queries (list): List of FetchXML queries as strings.
-        base_url (str): The base URL of the Dataverse instance.
-        temp_storage_file (str): Path to the file where the raw data will be temporarily stored.
+        fetchxml_query (str): The FetchXML query as a string.
+        page_size (int): The number of records per page.
 
     Returns:
-        list: A list of dictionaries containing the fetched data.
-    """
-    all_data = []
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "OData-MaxVersion": "4.0",
-        "OData-Version": "4.0",
-        "Prefer": "odata.include-annotations=\"*\""
-    }
+        str: The FetchXML query with the count attribute set.
+    """
+    root = ET.fromstring(fetchxml_query)
+    if 'count' in root.attrib or 'top' in root.attrib:
+        return fetchxml_query
+    root.set('count', str(page_size))
+    return ET.tostring(root, encoding='unicode')
+
+def prefer_page_size(headers, page_size):
+    """
+    Return a copy of request headers with odata.maxpagesize added to the Prefer header.
+
+    Args:
+        headers (dict): The request headers, may be None.
+        page_size (int): The maximum number of records per page.
+
+    Returns:
+        dict: The request headers.
+    """
+    headers = dict(headers or {})
+    preferences = [headers['Prefer']] if headers.get('Prefer') else []
+    headers['Prefer'] = ','.join(preferences + [f"odata.maxpagesize={page_size}"])
+    return headers
+
+def get_fetchxml_page_size(fetchxml_query):
+    """
+    Get the page size of a FetchXML query that can be paged by page number.
+
+    Pages can only be requested out of order when the query sets an explicit
+    count and does not rely on a paging cookie from the previous page.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+
+    Returns:
+        int or None: The page size, or None if the query cannot be prefetched.
+    """
+    root = ET.fromstring(fetchxml_query)
+    count = root.attrib.get('count')
+    if count is None or 'paging-cookie' in root.attrib:
+        return None
+    return int(count)
+
+def fetch_page(client, url, headers=None, stats=None):
+    """
+    Fetch a single page of results from the Dataverse Web API.
+
+    Args:
+        client (DataverseClient): The client for the source Dataverse instance.
+        url (str): The request URL.
+        headers (dict): Extra request headers.
+        stats (TransferStats): Receives the size of the response.
+
+    Returns:
+        dict: The decoded JSON response body.
+    """
+    response = client.get(url, headers=headers)
+    response.raise_for_status()
+    if stats is not None:
+        stats.add(response, len(response.content))
+    return response.json()
+
+def _iter_streamed_pages(client, url, headers, stats=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the pages of a query following @odata.nextLink, decoding every response body incrementally.
+
+    Each page must be read to the end before the next one is requested, since the
+    next link is only known once the records have been read.
+    """
+    while url:
+        response = client.get(url, headers=headers, stream=True)
+        try:
+            response.raise_for_status()
+            page = PageStream(response.iter_content(chunk_size))
+            yield page
+            if not page.finished:
+                raise RuntimeError("A streamed page must be read to the end before the next page is requested.")
+            metrics.count_received(url, page.bytes_read)
+            if stats is not None:
+                stats.add(response, page.bytes_read)
+        finally:
+            response.close()
+        url = page.next_link
+
+def _fetchxml_url(base_url, entity_set, fetchxml_query):
+    return f"{base_url}/api/data/v9.1/{entity_set}?fetchXml={quote(fetchxml_query)}"
+
+def _iter_pages_by_number(client, fetchxml_query, entity_set, headers, page_size, prefetch_pages, stats=None):
+    """
+    Yield the pages of a query by page number, requesting a window of pages at a time.
+
+    Pages inside a window are fetched concurrently and yielded in page order.
+    Fetching stops at the first short page or when the service reports no more records.
+    """
+    page = int(ET.fromstring(fetchxml_query).attrib.get('page', 1))
+    with ThreadPoolExecutor(max_workers=prefetch_pages) as executor:
+        while True:
+            futures = [
+                executor.submit(fetch_page, client, _fetchxml_url(client.base_url, entity_set, set_fetchxml_page(fetchxml_query, number)), headers, stats)
+                for number in range(page, page + prefetch_pages)
+            ]
+            for future in futures:
+                payload = future.result()
+                records = payload.get('value', [])
+                yield records
+                if len(records) < page_size or payload.get('@Microsoft.Dynamics.CRM.morerecords') is False:
+                    for pending in futures:
+                        pending.cancel()
+                    return
+            page += prefetch_pages
+
+def iter_query_pages(client, fetchxml_query, headers=None, prefetch_pages=0, metadata=None, stream=False, page_size=None,
+                     stats=None):
+    """
+    Yield the records matched by a single FetchXML query one page at a time.
+
+    In stream mode, pages following @odata.nextLink are not decoded as a whole;
+    every page is a PageStream decoding its records while the response arrives.
+
+    Args:
+        client (DataverseClient): The client for the source Dataverse instance.
+        fetchxml_query (str): The FetchXML query as a string.
+        headers (dict): Extra request headers.
+        prefetch_pages (int): Number of pages to fetch concurrently when the query
+            can be paged by page number. Values below 2 follow @odata.nextLink serially.
+        metadata (MetadataCache): Entity definitions of the source instance, used to
+            resolve the entity set name. None uses the shared in-memory cache.
+        stream (bool): Whether to decode the pages incrementally.
+        page_size (int): Records per page, sent as Prefer: odata.maxpagesize and as the
+            count of queries that do not set one. None keeps the service default.
+        stats (TransferStats): Receives the size of every page.
+
+    Yields:
+        list or PageStream: The records of the next page, in page order.
+    """
+    if page_size:
+        # FetchXML pages are sized by count, odata.maxpagesize covers the other queries
+        fetchxml_query = set_fetchxml_page_size(fetchxml_query, page_size)
+        headers = prefer_page_size(headers, page_size)
+    # Extract the entity name from the FetchXML query
+    entity_name = extract_entity_name(fetchxml_query)
+    # Resolve the entity set name from the entity definition
+    metadata = metadata or get_metadata(client.base_url)
+    entity_set = metadata.entity(client, entity_name).entity_set
+
+    try:
+        page_size = get_fetchxml_page_size(fetchxml_query)
+        if prefetch_pages > 1 and page_size:
+            logger.debug(f"Prefetching {prefetch_pages} pages of {page_size} records for {entity_set}.")
+            yield from _iter_pages_by_number(client, fetchxml_query, entity_set, headers, page_size, prefetch_pages, stats)
+            return
 
-    for fetchxml_query in fetchxml_queries:
-        # Extract the entity name from the FetchXML query
-        entity_name = extract_entity_name(fetchxml_query)
-        # Pluralize the entity name to get the entity set name
-        entity_set = pluralize_entity_name(entity_name)
         # Construct the correct URL using the entity set name
-        url = f"{base_url}/api/data/v9.1/{entity_set}?fetchXml={quote(fetchxml_query)}"
+        url = _fetchxml_url(client.base_url, entity_set, fetchxml_query)
         logger.debug(f"FetchXML Query URL: {url}")
 
+        if stream:
+            yield from _iter_streamed_pages(client, url, headers, stats)
+            return
         while url:
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
-                data = response.json().get('value', [])
-                all_data.extend(data)
-                url = response.json().get('@odata.nextLink', None)
-            except requests.RequestException as e:
-                logger.error(f"Error fetching data: {e}", exc_info=True)
-                raise
-
-    save_to_temp_storage(all_data, temp_storage_file)
-    return all_data
+            payload = fetch_page(client, url, headers, stats)
+            yield payload.get('value', [])
+            url = payload.get('@odata.nextLink', None)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching data: {e}", exc_info=True)
+        raise
+
+def _extract_query_to_store(client, fetchxml_query, headers, prefetch_pages, writer, metadata, job=None, stream=False,
+                            page_size=None, stats=None):
+    with writer:
+        for records in iter_query_pages(client, fetchxml_query, headers, prefetch_pages, metadata, stream, page_size, stats):
+            written = writer.count
+            writer.write_many(records)
+            if job is not None:
+                job.advance(writer.count - written)
+                job.check_cancelled()
+    return writer.count
+
+def _partition_query(client, fetchxml_query, entity, headers, partitions, strategy, field):
+    if field is None and strategy == PARTITION_BY_GUID:
+        field = entity.primary_id
+
+    def fetch_bounds(bounds_query):
+        records = fetch_page(client, _fetchxml_url(client.base_url, entity.entity_set, bounds_query), headers).get('value', [])
+        return records[0].get(field) if records else None
+
+    queries = partition_query(fetchxml_query, partitions, strategy, field, fetch_bounds)
+    if len(queries) > 1:
+        logger.info(f"Split the {entity.logical_name} query into {len(queries)} {strategy} partitions.")
+    return queries
+
+def execute_fetchxml_query(client, fetchxml_queries, base_url, temp_storage_file, max_workers=4, prefetch_pages=0,
+                           compress=False, segment_records=100000, job=None, metadata=None, partitions=1,
+                           partition_strategy=PARTITION_BY_GUID, partition_field=None, stream=False, page_size=None,
+                           annotations=None):
+    """
+    Fetch data from Dataverse using the FetchXML queries.
+
+    Queries are fetched concurrently and every page is streamed straight into a
+    record store, so the full dataset is never held in memory. The stored records
+    are always grouped per query in the order the queries were given, and are
+    partitioned by the root entity of their query.
+
+    With partitions above 1, every query is split into disjoint ranges of one column,
+    see query_partitions.partition_query. The ranges are fetched concurrently and
+    stored as shards of the query's part, in range order.
+
+    With stream, each page is decoded record by record while it is written to the
+    record store, so not even a single page is held in memory.
+
+    Args:
+        client (DataverseClient or str): The client for the source Dataverse instance,
+            or an access token for authenticating API requests.
+        fetchxml_queries (list): List of FetchXML queries as strings.
+        base_url (str): The base URL of the Dataverse instance.
+        temp_storage_file (str): Path to the record store directory for the raw data.
+        max_workers (int): Maximum number of queries fetched at the same time.
+        prefetch_pages (int): Number of pages fetched concurrently per query, see iter_query_pages.
+        compress (bool): Whether the record store segments are gzip compressed.
+        segment_records (int): Maximum number of records per record store segment.
+        job (MigrationJob): Job receiving progress, checked for cancellation after every page.
+        metadata (MetadataCache): Entity definitions of the source instance. None uses the
+            shared in-memory cache of base_url.
+        partitions (int): Number of range partitions fetched concurrently per query.
+        partition_strategy (str): "guid" to split the primary key range or "date" to split a date column.
+        partition_field (str): The column to split on, the primary key or createdon by default.
+        stream (bool): Whether to decode the pages incrementally, see iter_query_pages.
+        page_size (int): Records per page, trading memory per page against round trips.
+        annotations (list): OData annotations to request, see extract_headers. None requests all
+            annotations, a list such as the transform plan's required_annotations keeps the payload lean.
+
+    Returns:
+        RecordStore: The record store holding the fetched data.
+    """
+    client = ensure_client(client, base_url)
+    entity_names = [extract_entity_name(fetchxml_query) for fetchxml_query in fetchxml_queries]
+    # Resolve every entity set up front with a single metadata request
+    metadata = metadata or get_metadata(client.base_url)
+    metadata.prefetch(client, entity_names)
+    headers = extract_headers(annotations)
+    transfers = [TransferStats() for _ in fetchxml_queries]
+    store = RecordStore.create(temp_storage_file, compress, segment_records)
+    if job is not None:
+        job.start_stage('extract')
+
+    with metrics.track_stage('extract') as stage, ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = []
+        for part, (fetchxml_query, entity_name) in enumerate(zip(fetchxml_queries, entity_names)):
+            shard_queries = [fetchxml_query]
+            if partitions > 1:
+                shard_queries = _partition_query(client, fetchxml_query, metadata.entity(client, entity_name), headers,
+                                                 partitions, partition_strategy, partition_field)
+            for shard, shard_query in enumerate(shard_queries):
+                futures.append(executor.submit(_extract_query_to_store, client, shard_query, headers, prefetch_pages,
+                                               store.writer(part, entity_name, shard), metadata, job, stream, page_size,
+                                               transfers[part]))
+        counts = [future.result() for future in futures]
+        stage.records = sum(counts)
+
+    for entity_name, stats in zip(entity_names, transfers):
+        metrics.EXTRACT_BYTES.inc(stats.wire_bytes, entity=entity_name, encoding='wire')
+        metrics.EXTRACT_BYTES.inc(stats.body_bytes, entity=entity_name, encoding='decoded')
+        logger.info(f"Query for {entity_name} read {stats.pages} pages, {stats.wire_bytes} bytes on the wire "
+                    f"and {stats.body_bytes} bytes decoded.")
+
+    logger.info(f"Fetched {sum(counts)} records from {len(fetchxml_queries)} queries into {temp_storage_file}.")
+    return store
 
 # Additional functions can be added here as needed
 def read_fetchxml(file_path):
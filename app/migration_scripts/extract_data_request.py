@@ -5,6 +5,9 @@ import xml.etree.ElementTree as ET
 import requests
 from urllib.parse import quote
 from .authenticate import get_access_token
+from .dataverse_client import ensure_client
+from .extract_data_logic import extract_entity_name
+from .metadata import get_metadata
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -45,39 +48,34 @@ def load_fetchxml_queries():
         logger.error(f"Error parsing XML file: {filepath}: {e}")
         raise
 
-def fetch_all_data(access_token, base_url, save_to_file=False):
+def fetch_all_data(client, base_url, save_to_file=False):
     """
     Fetch data from Dataverse using the loaded FetchXML queries.
 
     Args:
-        access_token (str): The access token for authenticating API requests.
+        client (DataverseClient or str): The client for the Dataverse instance,
+            or an access token for authenticating API requests.
         base_url (str): The base URL of the Dataverse instance.
         save_to_file (bool): Whether to save the fetched data to JSON files.
 
     Returns:
         dict: A dictionary where the key is the query name, and the value is the fetched data.
     """
+    client = ensure_client(client, base_url)
+    metadata = get_metadata(client.base_url)
     queries = load_fetchxml_queries()
     all_data = {}
 
     for key, query in queries.items():
         logger.info(f"Fetching {key} data using FetchXML.")
         try:
-            # Correctly construct the URL with the entity set name based on the key
-            entity_set = f"{key}s"  # Assuming the entity set name follows this pattern
+            # Resolve the entity set name of the queried entity from its metadata
+            entity_set = metadata.entity(client, extract_entity_name(query)).entity_set
             url = f"{base_url}/api/data/v9.1/{entity_set}?fetchXml={quote(query)}"
             logger.debug(f"FetchXML Query URL: {url}")
             
             # Make the API request to fetch data using the FetchXML query
-            response = requests.get(
-                url,
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json",
-                    "OData-MaxVersion": "4.0",
-                    "OData-Version": "4.0"
-                }
-            )
+            response = client.get(url)
             response.raise_for_status()
 
             data = response.json()
@@ -111,4 +109,4 @@ if __name__ == "__main__":
 
     # Fetch all data using the loaded FetchXML queries and save to files
     all_data = fetch_all_data(token, base_url, save_to_file=True)
-    logger.info(f"All Data: {all_data}")
+    logger.info(f"Fetched data for {len(all_data)} queries.")
@@ -0,0 +1,202 @@
+import time
+import logging
+import threading
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Service protection limits of Dataverse, per user and web server over a sliding window
+LIMIT_WINDOW_SECONDS = 300
+LIMIT_REQUESTS = 6000
+LIMIT_CONCURRENT_REQUESTS = 52
+
+# Headers reporting what is left of the requests and execution time of the current window
+REMAINING_HEADERS = ('x-ms-ratelimit-burst-remaining-xrm-requests', 'x-ms-ratelimit-time-remaining-xrm-requests')
+
+# Error code of 429 responses to too many concurrent requests, as opposed to too many
+# requests or too much execution time in the window
+CONCURRENCY_LIMIT_CODE = '0x80072326'
+
+
+def _header_number(headers, name):
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        # Sent with thousands separators, e.g. "5,999" or "1,199.9"
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def _error_code(response):
+    try:
+        return response.json().get('error', {}).get('code')
+    except (ValueError, AttributeError):
+        return None
+
+
+class RequestGovernor:
+    """
+    Token bucket and concurrency limit shared by every request to a Dataverse instance.
+
+    Requests take a slot among `concurrency` in flight and a token of a bucket
+    refilled at `rate` per second. The rate adapts like TCP congestion control: it
+    halves on a throttled response the headers did not warn of, at most once per second
+    so concurrent rejections count once, and grows by `increase` requests per second for each second of
+    responses without throttling, up to `max_rate`. Throttling for too many concurrent
+    requests halves the concurrency instead, which then grows back by one for every
+    `concurrency` responses.
+
+    When the x-ms-ratelimit-* headers show less than `low_watermark` of the requests or
+    execution time of the window remaining, the rate is capped in proportion, so the
+    remainder lasts instead of running into a penalty. The cap lifts as soon as the
+    window frees up again. The limits of the window are taken as the most the headers
+    ever showed remaining, since they differ between environments.
+
+    Args:
+        name (str): The instance the governor protects, used in logs and metrics.
+        max_rate (float): Highest rate in requests per second. The governor starts at it.
+        max_concurrency (int): Highest number of requests in flight.
+        min_rate (float): Lowest rate in requests per second.
+        increase (float): Requests per second added to the rate per second without throttling.
+        low_watermark (float): Fraction of the window's limits below which the rate is capped.
+    """
+
+    def __init__(self, name, max_rate=LIMIT_REQUESTS / LIMIT_WINDOW_SECONDS, max_concurrency=LIMIT_CONCURRENT_REQUESTS,
+                 min_rate=0.5, increase=1.0, low_watermark=0.2):
+        self.name = name
+        self.min_rate = min_rate
+        self.increase = increase
+        self.low_watermark = low_watermark
+        self.throttled = 0
+        self.ceiling = None
+        self._limits = {}
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+        self._active = 0
+        self._updated = time.monotonic()
+        self._set_limits(max_rate, max_concurrency)
+        self.rate = self.max_rate
+        self.concurrency = float(self.max_concurrency)
+        self._tokens = self.capacity
+        self._report()
+
+    def _set_limits(self, max_rate, max_concurrency):
+        self.max_rate = max(float(max_rate), self.min_rate)
+        self.max_concurrency = max(1, int(max_concurrency))
+        # One second of requests may go out at once
+        self.capacity = max(1.0, self.max_rate)
+
+    def configure(self, max_rate, max_concurrency):
+        """
+        Change the limits, keeping the rate learnt so far when it is below them.
+
+        Args:
+            max_rate (float): Highest rate in requests per second.
+            max_concurrency (int): Highest number of requests in flight.
+        """
+        with self._condition:
+            self._set_limits(max_rate, max_concurrency)
+            self.rate = min(self.rate, self.max_rate)
+            self.concurrency = min(self.concurrency, float(self.max_concurrency))
+            self._tokens = min(self._tokens, self.capacity)
+            self._condition.notify_all()
+        self._report()
+
+    @property
+    def current_rate(self):
+        """
+        The rate requests are sent at, the adaptive rate capped by the remaining limits of the window.
+        """
+        return self.rate if self.ceiling is None else min(self.rate, self.ceiling)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.current_rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Block until a request may be sent, and take its slot and token.
+
+        Returns:
+            float: Seconds waited.
+        """
+        started = time.monotonic()
+        with self._condition:
+            while self._active >= int(self.concurrency):
+                self._condition.wait()
+            self._active += 1
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                self._condition.wait((1 - self._tokens) / self.current_rate)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            metrics.GOVERNOR_WAIT_SECONDS.inc(waited, instance=self.name)
+        return waited
+
+    def release(self, response=None):
+        """
+        Give back the slot of a finished request and adapt to its response.
+
+        Args:
+            response (requests.Response): The response, None when no response was received.
+        """
+        status = getattr(response, 'status_code', None)
+        headers = getattr(response, 'headers', None)
+        concurrency_limited = status == 429 and _error_code(response) == CONCURRENCY_LIMIT_CODE
+        with self._condition:
+            now = time.monotonic()
+            self._active -= 1
+            self._refill(now)
+            decreased = False
+            if status in metrics.THROTTLE_STATUSES:
+                self.throttled += 1
+                # While the headers cap the rate the rejection only means the window ran out,
+                # and the cap already slows down until it frees up
+                if self.ceiling is None and now - self._decreased_at >= 1:
+                    self._decreased_at = now
+                    decreased = True
+                    if concurrency_limited:
+                        self.concurrency = max(1.0, float(int(self.concurrency) // 2))
+                    else:
+                        self.rate = max(self.min_rate, self.rate / 2)
+                        self._tokens = min(self._tokens, 0.0)
+            elif status is not None and status < 500:
+                # Additive increase: `increase` per second of requests sent at the current rate
+                self.rate = min(self.max_rate, self.rate + self.increase / self.current_rate)
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            self._update_ceiling(headers)
+            self._condition.notify_all()
+            rate, concurrency = self.current_rate, int(self.concurrency)
+        if decreased:
+            logger.info(f"{self.name} throttled a request, governing at {rate:.2f} requests per second and {concurrency} concurrent requests.")
+        self._report()
+
+    def _update_ceiling(self, headers):
+        # Responses without the headers, like throttled ones, keep the last ceiling
+        fractions = []
+        for header in REMAINING_HEADERS:
+            remaining = _header_number(headers, header)
+            if remaining is None:
+                continue
+            limit = self._limits[header] = max(self._limits.get(header, 0.0), remaining)
+            if limit > 0:
+                fractions.append(remaining / limit)
+        if not fractions:
+            return
+        if min(fractions) >= self.low_watermark:
+            self.ceiling = None
+        else:
+            self.ceiling = max(self.min_rate, self.max_rate * min(fractions) / self.low_watermark)
+
+    def _report(self):
+        metrics.GOVERNOR_RATE.set(round(self.current_rate, 3), instance=self.name)
+        metrics.GOVERNOR_CONCURRENCY.set(int(self.concurrency), instance=self.name)
+
+    def __repr__(self):
+        return f"RequestGovernor({self.name}, {self.current_rate:.2f}/{self.max_rate:.2f} requests per second, {int(self.concurrency)}/{self.max_concurrency} concurrent)"
@@ -0,0 +1,226 @@
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+# Finished jobs are kept for status requests until they are this old, or until there are more of them
+FINISHED_JOB_TTL = 24 * 3600
+MAX_FINISHED_JOBS = 100
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class MigrationCancelled(Exception):
+    """
+    Raised inside a pipeline stage when its job has been cancelled.
+    """
+
+
+class JobAlreadyRunning(Exception):
+    """
+    Raised by start_job while another job is running.
+
+    Args:
+        job (MigrationJob): The running job.
+    """
+
+    def __init__(self, job):
+        super().__init__(f"Job {job.id} is still running.")
+        self.job = job
+
+
+class MigrationJob:
+    """
+    Progress and lifecycle of one migration running in a background thread.
+
+    Pipeline stages report through start_stage() and advance(), and call
+    check_cancelled() between batches so a cancel request stops the job cleanly.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = STATUS_RUNNING
+        self.error = None
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.stage = None
+        self.stages = {}
+        self._cancel_event = threading.Event()
+        self._changed = threading.Condition()
+        self._version = 0
+
+    def _notify(self):
+        self._version += 1
+        self._changed.notify_all()
+
+    def start_stage(self, stage, total=None):
+        """
+        Mark the start of a pipeline stage.
+
+        Args:
+            stage (str): The stage name, e.g. "extract".
+            total (int): Number of records the stage will process, if known.
+        """
+        with self._changed:
+            self.stage = stage
+            self.stages[stage] = {'processed': 0, 'total': total, 'started': time.time(), 'finished': None}
+            self._notify()
+        logger.info(f"Job {self.id} started stage {stage}.")
+
+    def advance(self, count):
+        """
+        Add processed records to the current stage.
+
+        Args:
+            count (int): Number of records processed since the last call.
+        """
+        with self._changed:
+            if self.stage is not None:
+                self.stages[self.stage]['processed'] += count
+                self._notify()
+
+    def check_cancelled(self):
+        """
+        Raise MigrationCancelled if the job has been cancelled.
+        """
+        if self._cancel_event.is_set():
+            raise MigrationCancelled(f"Job {self.id} was cancelled.")
+
+    def cancel(self):
+        """
+        Ask the job to stop at the next batch boundary.
+        """
+        self._cancel_event.set()
+        logger.info(f"Cancellation requested for job {self.id}.")
+
+    def finish(self, status, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            if self.stage is not None:
+                self.stages[self.stage]['finished'] = self.finished
+            self._notify()
+
+    def snapshot(self):
+        """
+        Describe the job state, including throughput and ETA of every stage.
+
+        Returns:
+            dict: JSON serializable job state.
+        """
+        with self._changed:
+            now = self.finished or time.time()
+            stages = {}
+            for name, stage in self.stages.items():
+                elapsed = (stage['finished'] or now) - stage['started']
+                throughput = stage['processed'] / elapsed if elapsed > 0 else 0.0
+                eta = None
+                if stage['total'] is not None and throughput > 0:
+                    eta = max(stage['total'] - stage['processed'], 0) / throughput
+                stages[name] = {
+                    'processed': stage['processed'],
+                    'total': stage['total'],
+                    'elapsed': round(elapsed, 3),
+                    'throughput': round(throughput, 1),
+                    'eta': round(eta, 1) if eta is not None else None,
+                }
+            return {
+                'id': self.id,
+                'status': self.status,
+                'stage': self.stage,
+                'stages': stages,
+                'elapsed': round(now - self.started, 3),
+                'error': self.error,
+                'result': self.result,
+                'version': self._version,
+            }
+
+    def wait_for_change(self, version, timeout):
+        """
+        Block until the job state changes after a snapshot version, or the timeout passes.
+
+        Args:
+            version (int): The version of the last snapshot seen.
+            timeout (float): Maximum number of seconds to wait.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+
+    @property
+    def done(self):
+        return self.status != STATUS_RUNNING
+
+
+def _prune_jobs(now):
+    # Called with _jobs_lock held. Jobs are kept in start order, so the oldest go first.
+    finished = [job for job in _jobs.values() if job.done]
+    for position, job in enumerate(finished):
+        if now - job.finished > FINISHED_JOB_TTL or len(finished) - position > MAX_FINISHED_JOBS:
+            del _jobs[job.id]
+
+
+def start_job(target, *args):
+    """
+    Run a migration function in a background thread.
+
+    The function is called as target(*args, job=job) and its return value becomes
+    the job result. Only one job runs at a time, since migrations and replays share
+    their record stores, load journal, watermarks and dead-letter file.
+
+    Args:
+        target (callable): The migration function.
+        *args: Positional arguments for the function.
+
+    Returns:
+        MigrationJob: The started job.
+
+    Raises:
+        JobAlreadyRunning: When another job has not finished yet.
+    """
+    job = MigrationJob()
+
+    def run():
+        try:
+            result = target(*args, job=job)
+            job.finish(STATUS_COMPLETED, result=result)
+            logger.info(f"Job {job.id} completed.")
+        except MigrationCancelled:
+            job.finish(STATUS_CANCELLED)
+            logger.info(f"Job {job.id} cancelled.")
+        except Exception as e:
+            job.finish(STATUS_FAILED, error=str(e))
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+
+    with _jobs_lock:
+        running = next((other for other in _jobs.values() if not other.done), None)
+        if running is not None:
+            raise JobAlreadyRunning(running)
+        _prune_jobs(time.time())
+        _jobs[job.id] = job
+    threading.Thread(target=run, name=f"migration-{job.id}", daemon=True).start()
+    return job
+
+
+def get_job(job_id):
+    """
+    Look up a job by id.
+
+    Args:
+        job_id (str): The job id.
+
+    Returns:
+        MigrationJob or None: The job, if it exists.
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
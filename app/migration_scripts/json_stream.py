@@ -0,0 +1,126 @@
+import json
+import codecs
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the socket at a time when streaming a response body
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class PageStream:
+    """
+    Incremental reader of a Dataverse collection response.
+
+    The records of the top-level "value" array are decoded one at a time while
+    the response body arrives, and the other top-level members such as
+    @odata.nextLink are kept in `properties`. Only the record being decoded and
+    the current chunk are held in memory, never the whole page.
+
+    A page stream can be iterated once. Members that follow the records, which is
+    where Dataverse puts @odata.nextLink, are only known after the iteration ended.
+
+    Args:
+        chunks (iterable): The response body as byte or text chunks.
+        array (str): The top-level member holding the records.
+    """
+
+    def __init__(self, chunks, array='value'):
+        self.array = array
+        self.properties = {}
+        self.count = 0
+        self.bytes_read = 0
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self.finished = False
+
+    @property
+    def next_link(self):
+        return self.properties.get('@odata.nextLink')
+
+    def _fill(self):
+        # Append the next chunk to the unread part of the buffer, False at the end of the body
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                self.bytes_read += len(chunk)
+                chunk = self._text.decode(chunk)
+            if chunk:
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                return True
+        if not self._eof:
+            self._buffer = self._buffer[self._pos:] + self._text.decode(b'', final=True)
+            self._pos = 0
+            self._eof = True
+        return False
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON response.")
+
+    def _expect(self, *characters):
+        character = self._peek()
+        if character not in characters:
+            raise ValueError(f"Expected {' or '.join(characters)} in JSON response, found {character!r}.")
+        self._pos += 1
+        return character
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # A number or literal at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            self._fill()
+
+    def _records(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            self.count += 1
+            if self._expect(',', ']') == ']':
+                return
+
+    def __iter__(self):
+        if self._started:
+            raise RuntimeError("A page stream can only be read once.")
+        self._started = True
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                self._expect(':')
+                if key == self.array:
+                    yield from self._records()
+                else:
+                    self.properties[key] = self._value()
+                if self._expect(',', '}') == '}':
+                    break
+        # Read the rest of the body so the connection can be reused
+        while self._fill():
+            pass
+        self.finished = True
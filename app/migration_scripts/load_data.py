@@ -1,38 +1,686 @@
 # load_data.py
 
+import json
+import time
+import uuid
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from . import metrics
+from .dataverse_client import ensure_client
+from .metadata import get_metadata
+from .load_journal import STATUS_COMMITTED, STATUS_FAILED
+from .log_utils import Payload, RecordSampler
+from .record_store import RecordStore
+from .compact_records import RecordTable, as_dict, json_default
+from .record_hash import content_hash
 
 logger = logging.getLogger(__name__)
 
-def load_data_to_target(data, target_base_url, batch_config, access_token):
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
+# Dataverse rejects $batch requests with more than 1000 operations
+MAX_BATCH_REQUESTS = 1000
+
+# Records skipped on resume between two progress updates of the job
+RESUME_PROGRESS_EVERY = 10000
+
+# A PATCH by key creates the record when it does not exist; If-Match: * makes it only
+# update an existing one and fail with 404 otherwise
+UPDATE_ONLY_HEADERS = {'If-Match': '*'}
+
+def get_record_id(item, primary_id):
+    """
+    Get the source id of a record, used to journal and upsert it.
+
+    Args:
+        item (dict): The record.
+        primary_id (str): The primary key column of the target table.
+
+    Returns:
+        str or None: The primary key column value, falling back to an "id" field.
+    """
+    return item.get(primary_id, item.get('id'))
+
+def _format_key_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def record_request(entity, item, upsert=False, upsert_keys=None):
+    """
+    Choose the HTTP method and path used to write a record.
+
+    In upsert mode the record is PATCHed by its alternate key when the table has one
+    in upsert_keys, otherwise by its primary key. Dataverse creates the row when it
+    does not exist yet, so retrying the same record is idempotent. Records without
+    the key values fall back to POST.
+
+    Args:
+        entity (EntityMetadata): The definition of the target table.
+        item (dict): The record.
+        upsert (bool): Whether to upsert instead of create.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+
+    Returns:
+        tuple: The HTTP method and the path relative to the instance URL.
+    """
+    entity_set = f"api/data/v9.1/{entity.entity_set}"
+    if upsert:
+        key_columns = (upsert_keys or {}).get(entity.logical_name)
+        if key_columns:
+            if all(item.get(column) is not None for column in key_columns):
+                key = ','.join(f"{column}={_format_key_value(item[column])}" for column in key_columns)
+                return 'PATCH', f"{entity_set}({key})"
+        elif item.get(entity.primary_id):
+            return 'PATCH', f"{entity_set}({item[entity.primary_id]})"
+        logger.debug("Record for table %s has no upsert key, creating it instead.", entity.logical_name)
+    return 'POST', entity_set
+
+def key_columns(entity, upsert_keys=None):
+    """
+    The columns a record is PATCHed by, see record_request.
+
+    Args:
+        entity (EntityMetadata): The definition of the target table.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+
+    Returns:
+        list: The alternate key columns of the table, or its primary key column.
+    """
+    return (upsert_keys or {}).get(entity.logical_name) or [entity.primary_id]
+
+def record_key(entity, item, upsert_keys=None):
+    """
+    The values of the key columns of a record.
+
+    Args:
+        entity (EntityMetadata): The definition of the target table.
+        item (dict): The record.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+
+    Returns:
+        tuple or None: The values in key_columns order, None when the record lacks any of them.
+    """
+    values = tuple(item.get(column) for column in key_columns(entity, upsert_keys))
+    return None if None in values else values
+
+def build_batch_request(operations, changeset_size=0, headers=None):
+    """
+    Build a Dataverse $batch multipart body.
+
+    Args:
+        operations (list): (method, absolute URL, record) tuples.
+        changeset_size (int): Number of operations per atomic changeset. Values below 2
+            send every operation as an independent request.
+        headers (dict): Extra headers sent with every operation.
+
+    Returns:
+        tuple: The batch boundary and the multipart body as bytes. The Content-ID of
+            each operation is its 1-based position in operations.
+    """
+    batch_boundary = f"batch_{uuid.uuid4()}"
+    operation_headers = [f"{name}: {value}" for name, value in (headers or {}).items()]
+    lines = []
+
+    def add_operation(content_id, operation):
+        method, url, item = operation
+        lines.extend([
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {content_id}",
+            "",
+            f"{method} {url} HTTP/1.1",
+            "Content-Type: application/json; type=entry",
+            *operation_headers,
+            "",
+            json.dumps(item, default=json_default),
+        ])
+
+    if changeset_size > 1:
+        for start in range(0, len(operations), changeset_size):
+            changeset_boundary = f"changeset_{uuid.uuid4()}"
+            lines.extend([f"--{batch_boundary}", f"Content-Type: multipart/mixed; boundary={changeset_boundary}", ""])
+            for content_id, operation in enumerate(operations[start:start + changeset_size], start + 1):
+                lines.append(f"--{changeset_boundary}")
+                add_operation(content_id, operation)
+            lines.append(f"--{changeset_boundary}--")
+    else:
+        for content_id, operation in enumerate(operations, 1):
+            lines.append(f"--{batch_boundary}")
+            add_operation(content_id, operation)
+    lines.append(f"--{batch_boundary}--")
+    lines.append("")
+    return batch_boundary, "\r\n".join(lines).encode('utf-8')
+
+def _get_boundary(content_type):
+    for parameter in content_type.split(';')[1:]:
+        name, _, value = parameter.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+    raise ValueError(f"No multipart boundary in content type: {content_type}")
+
+def _split_headers(text):
+    head, _, body = text.partition('\r\n\r\n')
+    headers = {}
+    for line in head.split('\r\n'):
+        name, _, value = line.partition(':')
+        if value:
+            headers[name.strip().lower()] = value.strip()
+    return head, headers, body
+
+def _split_multipart(body, boundary):
+    delimiter = f"--{boundary}"
+    parts = []
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith('--'):
+            break
+        parts.append(chunk.strip('\r\n'))
+    return parts
+
+def parse_batch_response(body, content_type):
+    """
+    Parse a Dataverse $batch multipart response.
+
+    Args:
+        body (str): The response body.
+        content_type (str): The Content-Type header of the response, holding the boundary.
+
+    Returns:
+        list: One list per top-level batch part, in request order. Each holds one
+            dict per HTTP response with the keys content_id, status and body. A
+            changeset that was rolled back contains only the response of the failing
+            operation.
+    """
+    groups = []
+    for part in _split_multipart(body, _get_boundary(content_type)):
+        _, headers, payload = _split_headers(part)
+        if headers.get('content-type', '').startswith('multipart/mixed'):
+            inner_parts = _split_multipart(payload, _get_boundary(headers['content-type']))
+        else:
+            inner_parts = [part]
+        responses = []
+        for inner_part in inner_parts:
+            _, inner_headers, http_message = _split_headers(inner_part)
+            status_line, _, response_body = _split_headers(http_message)
+            status = int(status_line.split('\r\n')[0].split(' ')[1])
+            content_id = inner_headers.get('content-id')
+            responses.append({
+                'content_id': int(content_id) if content_id else None,
+                'status': status,
+                'body': response_body.strip(),
+            })
+        groups.append(responses)
+    return groups
+
+def _match_batch_results(items, groups, changeset_size):
+    """
+    Map the responses of a parsed $batch response back to the records that were sent.
+
+    Returns:
+        list: One (status, body) tuple per record, in the order of items.
+    """
+    group_size = changeset_size if changeset_size > 1 else 1
+    results = [(None, "No response returned for this operation.")] * len(items)
+    for group_index, responses in enumerate(groups):
+        start = group_index * group_size
+        size = min(group_size, len(items) - start)
+        if len(responses) == 1 and size > 1 and responses[0]['status'] >= 400:
+            # The changeset was rolled back; only the failing operation is reported
+            failure = responses[0]
+            for position in range(start, start + size):
+                results[position] = (failure['status'], f"Changeset rolled back: {failure['body']}")
+            if failure['content_id'] is not None:
+                results[failure['content_id'] - 1] = (failure['status'], failure['body'])
+            continue
+        for offset, response in enumerate(responses[:size]):
+            content_id = response['content_id']
+            position = content_id - 1 if content_id is not None and 0 < content_id <= len(items) else start + offset
+            results[position] = (response['status'], response['body'])
+    return results
+
+def post_batch(client, items, entity, changeset_size=0, upsert=False, upsert_keys=None):
+    """
+    Write records through a single Dataverse $batch request.
+
+    Args:
+        client (DataverseClient): The client for the target Dataverse instance.
+        items (list): The records to write, at most MAX_BATCH_REQUESTS.
+        entity (EntityMetadata): The definition of the target table.
+        changeset_size (int): Number of records per atomic changeset, see build_batch_request.
+        upsert (bool): Whether to upsert instead of create, see record_request.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+
+    Returns:
+        list: One (status, body) tuple per record, in the order of items.
+    """
+    operations = []
+    for item in items:
+        method, path = record_request(entity, item, upsert, upsert_keys)
+        operations.append((method, client.url(path), item))
+    return send_batch(client, operations, changeset_size)
+
+def send_batch(client, operations, changeset_size=0, headers=None):
+    """
+    Send operations through a single Dataverse $batch request.
+
+    Args:
+        client (DataverseClient): The client for the target Dataverse instance.
+        operations (list): (method, absolute URL, record) tuples, at most MAX_BATCH_REQUESTS.
+        changeset_size (int): Number of operations per atomic changeset, see build_batch_request.
+        headers (dict): Extra headers sent with every operation.
+
+    Returns:
+        list: One (status, body) tuple per operation, in order.
+    """
+    boundary, body = build_batch_request(operations, changeset_size, headers)
+    batch_headers = {
+        "Content-Type": f"multipart/mixed; boundary={boundary}",
+        "Prefer": "odata.continue-on-error",
     }
+    response = client.post("api/data/v9.1/$batch", headers=batch_headers, data=body)
+    response.raise_for_status()
+    groups = parse_batch_response(response.text, response.headers.get('Content-Type', ''))
+    return _match_batch_results(operations, groups, changeset_size)
+
+def _payload(item):
+    # Records are sent as plain dicts without logical_name
+    if 'logical_name' in item:
+        return {key: value for key, value in item.items() if key != 'logical_name'}
+    return as_dict(item)
+
+def _add_failed_key(failed_keys, entity, item, upsert_keys):
+    if failed_keys is not None:
+        key = record_key(entity, item, upsert_keys)
+        if key is not None:
+            failed_keys.add(key)
 
-    for table, batch_order in sorted(batch_config.items(), key=lambda item: item[1]):
-        table_data = [item for item in data if item.get('logical_name') == table]
-        logger.info(f"Loading data for table {table} with batch order {batch_order}. Total records: {len(table_data)}")
+def _load_table_in_batches(client, entity, table_data, batch_size, changeset_size, journal, upsert, upsert_keys, job, dead_letters,
+                           failed_keys, deferred):
+    table = entity.logical_name
+    sampler = RecordSampler(f'load {table}')
+    records = iter(table_data)
+    table_failed = 0
+    # Only one batch of records is held at a time, so tables are streamed from the record store
+    for chunk in iter(lambda: list(islice(records, batch_size)), []):
+        if job is not None:
+            job.check_cancelled()
+        sources = [_payload(item) for item in chunk]
+        items = [deferred.strip(item) for item in sources] if deferred is not None else sources
+        try:
+            results = post_batch(client, items, entity, changeset_size, upsert, upsert_keys)
+        except requests.RequestException as e:
+            error_message = e.response.text if e.response is not None else str(e)
+            logger.error("Error loading batch of %d records into table %s: %s", len(items), table, Payload(error_message), exc_info=True)
+            if journal is not None:
+                status_code = e.response.status_code if e.response is not None else None
+                journal.record_many([(table, get_record_id(item, entity.primary_id), STATUS_FAILED, status_code, error_message) for item in items])
+            if dead_letters is not None:
+                for item in items:
+                    dead_letters.add(table, item, e.response.status_code if e.response is not None else None, error_message)
+            for item in items:
+                _add_failed_key(failed_keys, entity, item, upsert_keys)
+            # Failed records count as processed too, so the job's progress still reaches its total
+            if job is not None:
+                job.advance(len(items))
+            table_failed += len(items)
+            continue
 
-        for item in table_data:
+        failed = 0
+        journal_rows = []
+        for source, item, (status, body) in zip(sources, items, results):
+            if status is not None and status < 400:
+                # The whole record is hashed, deferred lookups included, as change detection does
+                journal_rows.append((table, get_record_id(item, entity.primary_id), STATUS_COMMITTED, status, body,
+                                     content_hash(source, entity.attributes) if journal is not None else None))
+                if sampler.sample():
+                    logger.debug("Successfully loaded record with ID %s into table %s. Status: %s", get_record_id(item, entity.primary_id), table, status)
+            else:
+                failed += 1
+                journal_rows.append((table, get_record_id(item, entity.primary_id), STATUS_FAILED, status, body))
+                if dead_letters is not None:
+                    dead_letters.add(table, item, status, body)
+                _add_failed_key(failed_keys, entity, item, upsert_keys)
+                logger.error("Error loading record with ID %s into table %s: %s %s", get_record_id(item, entity.primary_id), table, status, Payload(body))
+        if journal is not None:
+            journal.record_many(journal_rows)
+        if job is not None:
+            job.advance(len(items))
+        logger.info("Loaded batch of %d records into table %s. Failed: %d", len(items), table, failed)
+        table_failed += failed
+    return table_failed
+
+def _skip_committed(table_data, committed, primary_id, table, job):
+    # Filters while the records are read, instead of building the remaining records up front
+    skipped = 0
+    for item in table_data:
+        if get_record_id(item, primary_id) in committed:
+            skipped += 1
+            if job is not None and skipped % RESUME_PROGRESS_EVERY == 0:
+                job.advance(RESUME_PROGRESS_EVERY)
+            continue
+        yield item
+    logger.info(f"Resuming table {table}: skipped {skipped} committed records.")
+    if job is not None:
+        job.advance(skipped % RESUME_PROGRESS_EVERY)
+
+def load_table(client, table, table_data, batch_size=0, changeset_size=0, journal=None, upsert=False, upsert_keys=None, resume=False,
+               job=None, metadata=None, dead_letters=None, failed_keys=None, deferred=None):
+    """
+    Load the records of a single table into the target Dataverse instance.
+
+    Args:
+        client (DataverseClient): The client for the target Dataverse instance.
+        table (str): The logical name of the target table.
+        table_data (iterable): The records to load into the table, e.g. a list, RecordTable or RecordPartition.
+            It is read once, one batch at a time.
+        batch_size (int): Number of records sent per $batch request. 0 posts every record individually.
+        changeset_size (int): Number of records per atomic changeset inside a $batch request.
+        journal (LoadJournal): Journal recording the outcome of every record.
+        upsert (bool): Whether to upsert instead of create, see record_request.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+        resume (bool): Whether to skip records the journal already shows as committed.
+        job (MigrationJob): Job receiving progress, checked for cancellation between batches.
+        metadata (MetadataCache): Entity definitions of the target instance. None uses the
+            shared in-memory cache of the client's instance.
+        dead_letters (DeadLetterFile): File receiving the records that fail to load.
+        failed_keys (set): Receives the keys of the records that fail to load, see record_key.
+        deferred (DeferredLookups): Takes the deferred lookups off the records before they are sent.
+            The journal still hashes the whole records.
+
+    Returns:
+        int: The number of records that failed to load.
+    """
+    entity = (metadata or get_metadata(client.base_url)).entity(client, table)
+    if resume and journal is not None:
+        table_data = _skip_committed(table_data, journal.committed_ids(table), entity.primary_id, table, job)
+
+    if batch_size > 0:
+        return _load_table_in_batches(client, entity, table_data, batch_size, changeset_size, journal, upsert, upsert_keys, job, dead_letters,
+                                      failed_keys, deferred)
+
+    sampler = RecordSampler(f'load {table}')
+    failed = 0
+    for item in table_data:
+        if job is not None:
+            job.check_cancelled()
+            job.advance(1)
+        try:
+            source = _payload(item)  # Ensure logical_name is not in the payload
+            item = deferred.strip(source) if deferred is not None else source
+            method, url = record_request(entity, item, upsert, upsert_keys)
+            url = client.url(url)
+            sampled = sampler.sample()
+            if sampled:
+                logger.debug("Loading record into table %s with URL: %s", table, url)
+                logger.debug("Data to be sent: %s", Payload(item))
+            
+            response = client.request(method, url, json=item)
+            response.raise_for_status()
+            if journal is not None:
+                journal.record(table, get_record_id(item, entity.primary_id), STATUS_COMMITTED, response.status_code, response.text,
+                               content_hash(source, entity.attributes))
+            
+            if sampled:
+                logger.info("Successfully loaded record with ID %s into table %s. Status: %s (logging 1 of every %d records)",
+                            get_record_id(item, entity.primary_id), table, response.status_code, sampler.every)
+        except requests.RequestException as e:
+            error_message = e.response.text if e.response is not None else str(e)
+            logger.error("Error loading record with ID %s into table %s: %s", get_record_id(item, entity.primary_id), table, Payload(error_message), exc_info=True)
+            if journal is not None:
+                status_code = e.response.status_code if e.response is not None else None
+                journal.record(table, get_record_id(item, entity.primary_id), STATUS_FAILED, status_code, error_message)
+            if dead_letters is not None:
+                dead_letters.add(table, item, e.response.status_code if e.response is not None else None, error_message)
+            _add_failed_key(failed_keys, entity, item, upsert_keys)
+            failed += 1
+
+            if e.response is not None:
+                logger.error("Request URL: %s", url)
+                logger.error("Request Headers: %s", dict(client.session.headers))
+                logger.error("Request Payload: %s", Payload(item))
+                logger.error("Response Status Code: %s", e.response.status_code)
+                logger.error("Response Text: %s", Payload(e.response.text))
+    return failed
+
+class DeferredLookups:
+    """
+    The lookups of a table taken off its records while they load, to be set by
+    patch_deferred_lookups once every table is loaded.
+
+    Only the key columns and the deferred properties of the records are held, compactly
+    in a RecordTable since they share their columns. Iterating yields the (record, lookups)
+    tuples patch_deferred_lookups expects.
+
+    Args:
+        table (str): The logical name of the table.
+        properties (set): The @odata.bind properties to defer.
+        keys (list): The key columns kept to find the records again, see key_columns.
+    """
+
+    def __init__(self, table, properties, keys):
+        self.properties = set(properties)
+        self.keys = list(keys)
+        self.records = RecordTable(entity=table)
+        self.failed_keys = set()
+
+    def strip(self, item):
+        """
+        Take the deferred properties off a record.
+
+        Args:
+            item (dict): The record payload.
+
+        Returns:
+            dict: The record without the deferred properties.
+        """
+        lookups = {key: item[key] for key in self.properties if key in item}
+        if not lookups:
+            return item
+        self.records.append(dict({key: item[key] for key in self.keys if key in item}, **lookups))
+        return {key: value for key, value in item.items() if key not in lookups}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for record in self.records:
+            yield ({key: value for key, value in record.items() if key not in self.properties},
+                   {key: record[key] for key in self.properties if key in record})
+
+def patch_deferred_lookups(client, entity, deferred, batch_size=0, changeset_size=0, upsert_keys=None, dead_letters=None,
+                           failed_keys=None):
+    """
+    Set lookups that could not be written when the records were created.
+
+    Every record is PATCHed by its alternate key from upsert_keys or its primary key
+    with only its deferred @odata.bind properties, after every table has been loaded.
+    The PATCH only updates existing records, so a record that failed to load is not
+    created as a stub holding nothing but its lookups. Records in failed_keys are not
+    patched at all; their lookups go to the dead-letter file, where the replay sets
+    them once it has loaded the record.
+
+    Args:
+        client (DataverseClient): The client for the target Dataverse instance.
+        entity (EntityMetadata): The definition of the target table.
+        deferred (iterable): (record, lookups) tuples of the records and their deferred @odata.bind properties.
+        batch_size (int): Number of records sent per $batch request. 0 patches every record individually.
+        changeset_size (int): Number of records per atomic changeset inside a $batch request.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+        dead_letters (DeadLetterFile): File receiving the records whose lookups could not be set.
+        failed_keys (set): Keys of the records that failed to load, see record_key. They are
+            already counted as failed and not counted again.
+
+    Returns:
+        int: The number of records whose lookups could not be set.
+    """
+    table = entity.logical_name
+    patched = 0
+    failed = 0
+    skipped = 0
+
+    def fail(item, lookups, status, error):
+        if dead_letters is not None:
+            dead_letters.add(table, item, status, error, lookups)
+
+    def operations():
+        nonlocal failed, skipped
+        for item, lookups in deferred:
+            if failed_keys and record_key(entity, item, upsert_keys) in failed_keys:
+                skipped += 1
+                fail(item, lookups, None, 'Not set because the record failed to load.')
+                continue
+            method, path = record_request(entity, item, True, upsert_keys)
+            if method != 'PATCH':
+                failed += 1
+                logger.error("Cannot set deferred lookups %s of a %s record without a key.", ', '.join(lookups), table)
+                fail(item, lookups, None, 'The record has no key to patch it by.')
+                continue
+            yield item, client.url(path), lookups
+
+    pending = operations()
+    if batch_size > 0:
+        for chunk in iter(lambda: list(islice(pending, batch_size)), []):
             try:
-                item.pop('logical_name', None)  # Ensure logical_name is not in the payload
-                url = f"{target_base_url}/api/data/v9.1/{table}s"
-                logger.debug(f"Loading record into table {table} with URL: {url}")
-                logger.debug(f"Data to be sent: {item}")
-                
-                response = requests.post(url, headers=headers, json=item)
-                response.raise_for_status()
-                
-                logger.info(f"Successfully loaded record with ID {item.get('id', 'unknown')} into table {table}. Response: {response.json()}")
+                results = send_batch(client, [('PATCH', url, lookups) for _, url, lookups in chunk], changeset_size, UPDATE_ONLY_HEADERS)
             except requests.RequestException as e:
-                error_message = e.response.text if e.response else str(e)
-                logger.error(f"Error loading record with ID {item.get('id', 'unknown')} into table {table}: {error_message}", exc_info=True)
-
-                if e.response is not None:
-                    logger.error(f"Request URL: {url}")
-                    logger.error(f"Request Headers: {headers}")
-                    logger.error(f"Request Payload: {item}")
-                    logger.error(f"Response Status Code: {e.response.status_code}")
-                    logger.error(f"Response Text: {e.response.text}")
+                logger.error("Error setting deferred lookups of %d %s records: %s", len(chunk), table, e, exc_info=True)
+                failed += len(chunk)
+                for item, _, lookups in chunk:
+                    fail(item, lookups, e.response.status_code if e.response is not None else None, str(e))
+                continue
+            for (item, url, lookups), (status, body) in zip(chunk, results):
+                if status is None or status >= 400:
+                    failed += 1
+                    logger.error("Error setting deferred lookups with %s: %s %s", url, status, Payload(body))
+                    fail(item, lookups, status, body)
+                else:
+                    patched += 1
+    else:
+        for item, url, lookups in pending:
+            try:
+                client.patch(url, json=lookups, headers=UPDATE_ONLY_HEADERS).raise_for_status()
+                patched += 1
+            except requests.RequestException as e:
+                failed += 1
+                logger.error("Error setting deferred lookups with %s: %s", url, e, exc_info=True)
+                fail(item, lookups, e.response.status_code if e.response is not None else None, str(e))
+    if skipped:
+        logger.warning(f"Kept the deferred lookups of {skipped} {table} records that failed to load for the dead-letter replay.")
+    logger.info(f"Set deferred lookups of {patched} {table} records. Failed: {failed}")
+    return failed
+
+def partition_by_entity(data):
+    """
+    Group the records to load by target table.
+
+    Args:
+        data (RecordStore, dict or iterable): A record store partitioned by entity, a
+            mapping of table logical names to records, or records tagged with logical_name.
+
+    Returns:
+        dict: Mapping of table logical names to their records.
+    """
+    if isinstance(data, RecordStore):
+        return data.partitions()
+    if isinstance(data, dict):
+        return data
+    partitions = {}
+    for item in data:
+        partitions.setdefault(item.get('logical_name'), []).append(item)
+    return partitions
+
+def group_batch_tiers(batch_config):
+    """
+    Group the tables of batch_config into tiers of equal load order.
+
+    Args:
+        batch_config (dict): Mapping of table logical names to their load order.
+
+    Returns:
+        list: (order, tables) tuples sorted by order. Tables keep their batch_config order.
+    """
+    tiers = {}
+    for table, batch_order in batch_config.items():
+        tiers.setdefault(batch_order, []).append(table)
+    return sorted(tiers.items(), key=lambda item: item[0])
+
+def load_data_to_target(data, target_base_url, batch_config, client, batch_size=0, changeset_size=0, max_workers=4,
+                        journal=None, upsert=False, upsert_keys=None, resume=False, job=None, metadata=None, schedule=None,
+                        dead_letters=None):
+    """
+    Load the transformed data into the target Dataverse tables in batch_config order.
+
+    Tables that share a batch_config order value form a tier and are loaded
+    concurrently. A tier only starts once every table of the previous tier is done.
+    With a schedule, its dependency levels are the tiers instead, and the lookups it
+    defers are set in a second pass once every tier is loaded.
+
+    Args:
+        data (RecordStore, dict or iterable): The transformed records, see partition_by_entity.
+        target_base_url (str): The base URL of the target Dataverse instance.
+        batch_config (dict): Mapping of table logical names to their load order.
+        client (DataverseClient or str): The client for the target Dataverse instance,
+            or an access token for it.
+        batch_size (int): Number of records sent per $batch request. 0 posts every record individually.
+        changeset_size (int): Number of records per atomic changeset inside a $batch request.
+        max_workers (int): Maximum number of tables of one tier loaded at the same time.
+        journal (LoadJournal): Journal recording the outcome of every record.
+        upsert (bool): Whether to upsert by primary or alternate key instead of create.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+        resume (bool): Whether to skip records the journal already shows as committed.
+        job (MigrationJob): Job receiving progress, checked for cancellation between batches.
+        metadata (MetadataCache): Entity definitions of the target instance. None uses the
+            shared in-memory cache of target_base_url.
+        schedule (LoadSchedule): Dependency levels replacing the batch_config order, see
+            load_schedule.plan_load_schedule. batch_config still selects the tables to load.
+        dead_letters (DeadLetterFile): File receiving the records that fail to load, to be
+            retried with dead_letters.replay_dead_letters.
+
+    Returns:
+        int: The number of records that failed to load or whose deferred lookups could not be set.
+    """
+    client = ensure_client(client, target_base_url)
+    metadata = metadata or get_metadata(client.base_url)
+    if batch_size > MAX_BATCH_REQUESTS:
+        logger.warning(f"Batch size {batch_size} exceeds the service limit, using {MAX_BATCH_REQUESTS}.")
+        batch_size = MAX_BATCH_REQUESTS
+
+    partitions = partition_by_entity(data)
+    if job is not None:
+        job.start_stage('load', sum(len(partitions.get(table, [])) for table in batch_config))
+    for entity in partitions:
+        if entity not in batch_config:
+            logger.warning(f"Records for {entity} are not loaded because the table is missing from batch_config.")
+    # Resolve every target table up front with a single metadata request
+    metadata.prefetch(client, [table for table in batch_config if table in partitions])
+    tiers = schedule.tiers() if schedule is not None else group_batch_tiers(batch_config)
+    deferred = {}
+    failed = 0
+    with metrics.track_stage('load') as stage, ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for batch_order, tables in tiers:
+            started = time.perf_counter()
+            futures = []
+            for table in tables:
+                # Streamed batch by batch from the partition, so no table is held whole in memory
+                table_data = partitions.get(table, [])
+                total = len(table_data)
+                table_deferred = None
+                if schedule is not None and schedule.deferred.get(table):
+                    table_deferred = deferred[table] = DeferredLookups(table, schedule.deferred[table],
+                                                                       key_columns(metadata.entity(client, table), upsert_keys))
+                logger.info(f"Loading data for table {table} with batch order {batch_order}. Total records: {total}")
+                futures.append(executor.submit(load_table, client, table, table_data, batch_size, changeset_size, journal, upsert, upsert_keys, resume, job, metadata,
+                                               dead_letters, table_deferred.failed_keys if table_deferred is not None else None, table_deferred))
+                stage.records += total
+            for future in futures:
+                failed += future.result()
+            logger.info(f"Loaded tier {batch_order} ({', '.join(tables)}) in {time.perf_counter() - started:.2f} seconds.")
+
+        futures = [executor.submit(patch_deferred_lookups, client, metadata.entity(client, table), table_deferred, batch_size,
+                                   changeset_size, upsert_keys, dead_letters, table_deferred.failed_keys)
+                   for table, table_deferred in deferred.items() if table_deferred]
+        for future in futures:
+            failed += future.result()
+    return failed
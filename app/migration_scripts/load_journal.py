@@ -0,0 +1,148 @@
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+STATUS_COMMITTED = 'committed'
+STATUS_FAILED = 'failed'
+
+# Longest response body kept per record
+MAX_RESPONSE_LENGTH = 2000
+
+
+class LoadJournal:
+    """
+    Crash-safe SQLite journal of every record sent to the target.
+
+    Each record is keyed by target table and source id, so the latest attempt
+    replaces earlier ones. Writes are committed immediately in WAL mode, so the
+    journal survives a crash of the loader at any point. Committed records keep the
+    content hash of the payload that was written, see record_hash.content_hash.
+
+    Args:
+        path (str): Path to the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS load_journal ("
+            " target_table TEXT NOT NULL,"
+            " source_id TEXT,"
+            " status TEXT NOT NULL,"
+            " status_code INTEGER,"
+            " response TEXT,"
+            " updated_at TEXT NOT NULL,"
+            " content_hash TEXT,"
+            " UNIQUE (target_table, source_id))"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(load_journal)")}
+        if 'content_hash' not in columns:
+            # Journals written before content hashes were recorded
+            self._connection.execute("ALTER TABLE load_journal ADD COLUMN content_hash TEXT")
+        self._connection.commit()
+        logger.info(f"Load journal opened at {path}.")
+
+    def record_many(self, rows):
+        """
+        Record the outcome of several records in one transaction.
+
+        Args:
+            rows (list): (target_table, source_id, status, status_code, response) tuples, optionally
+                followed by the content hash of the written payload.
+        """
+        updated_at = datetime.now(timezone.utc).isoformat()
+        values = [
+            (table, source_id, status, status_code, (response or '')[:MAX_RESPONSE_LENGTH], updated_at, content_hash[0] if content_hash else None)
+            for table, source_id, status, status_code, response, *content_hash in rows
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO load_journal (target_table, source_id, status, status_code, response, updated_at, content_hash)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (target_table, source_id) DO UPDATE SET"
+                " status = excluded.status, status_code = excluded.status_code,"
+                " response = excluded.response, updated_at = excluded.updated_at, content_hash = excluded.content_hash",
+                values,
+            )
+            self._connection.commit()
+
+    def record(self, table, source_id, status, status_code=None, response=None, content_hash=None):
+        """
+        Record the outcome of a single record.
+
+        Args:
+            table (str): The logical name of the target table.
+            source_id (str): The id of the record in the source.
+            status (str): STATUS_COMMITTED or STATUS_FAILED.
+            status_code (int): The HTTP status returned by the target.
+            response (str): The response body returned by the target.
+            content_hash (str): The content hash of the written payload.
+        """
+        self.record_many([(table, source_id, status, status_code, response, content_hash)])
+
+    def committed_ids(self, table):
+        """
+        Get the source ids already committed to a table.
+
+        Args:
+            table (str): The logical name of the target table.
+
+        Returns:
+            set: The committed source ids.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT source_id FROM load_journal WHERE target_table = ? AND status = ? AND source_id IS NOT NULL",
+                (table, STATUS_COMMITTED),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def committed_hashes(self, table):
+        """
+        Get the content hashes of the records committed to a table.
+
+        Args:
+            table (str): The logical name of the target table.
+
+        Returns:
+            dict: Mapping of source ids to the content hash of their last committed payload.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT source_id, content_hash FROM load_journal"
+                " WHERE target_table = ? AND status = ? AND source_id IS NOT NULL AND content_hash IS NOT NULL",
+                (table, STATUS_COMMITTED),
+            ).fetchall()
+        return dict(rows)
+
+    def summary(self):
+        """
+        Count journal entries per table and status.
+
+        Returns:
+            dict: Mapping of (target_table, status) to record counts.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT target_table, status, COUNT(*) FROM load_journal GROUP BY target_table, status"
+            ).fetchall()
+        return {(table, status): count for table, status, count in rows}
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,206 @@
+import logging
+import xml.etree.ElementTree as ET
+from .metadata import BIND_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+
+class LoadSchedule:
+    """
+    Order in which tables are loaded, derived from the references between them.
+
+    Args:
+        levels (list): Lists of tables. Tables of a level only reference tables of earlier
+            levels, apart from deferred lookups, so a level can be loaded concurrently.
+        deferred (dict): Mapping of tables to the @odata.bind properties written in a second
+            pass, because they reference the table itself or close a cycle.
+    """
+
+    def __init__(self, levels, deferred=None):
+        self.levels = [list(level) for level in levels]
+        self.deferred = {table: set(properties) for table, properties in (deferred or {}).items()}
+
+    def tiers(self):
+        """
+        Return the levels as (order, tables) tuples, like load_data.group_batch_tiers.
+        """
+        return list(enumerate(self.levels, 1))
+
+    def __repr__(self):
+        levels = ' -> '.join('[' + ', '.join(level) + ']' for level in self.levels)
+        deferred = ', '.join(f"{table}: {', '.join(sorted(properties))}" for table, properties in sorted(self.deferred.items()))
+        return f"LoadSchedule({levels}{'; deferred ' + deferred if deferred else ''})"
+
+
+def link_entity_dependencies(fetchxml_query, primary_ids=None):
+    """
+    Derive table dependencies from the link-entity elements of a FetchXML query.
+
+    A link whose "to" column is the primary key of its parent means the linked
+    table holds a lookup to the parent. A link whose "from" column is the primary
+    key of the linked table means the parent holds a lookup to the linked table.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+        primary_ids (dict): Mapping of table logical names to their primary key column.
+            Tables missing from it use "<logical name>id".
+
+    Returns:
+        set: (table, referenced table) tuples.
+    """
+    primary_ids = primary_ids or {}
+    dependencies = set()
+
+    def primary_id(table):
+        return primary_ids.get(table, f"{table}id")
+
+    def walk(element, parent):
+        for link in element.findall('link-entity'):
+            linked = link.attrib.get('name')
+            if linked is None:
+                continue
+            if linked != parent:
+                if link.attrib.get('to') == primary_id(parent):
+                    dependencies.add((linked, parent))
+                elif link.attrib.get('from') == primary_id(linked):
+                    dependencies.add((parent, linked))
+            walk(link, linked)
+
+    entity = ET.fromstring(fetchxml_query).find('entity')
+    if entity is not None:
+        walk(entity, entity.attrib.get('name'))
+    return dependencies
+
+
+def record_dependencies(partitions, entity_sets):
+    """
+    Derive table dependencies from the @odata.bind references of the records to load.
+
+    Args:
+        partitions (dict): Mapping of table logical names to their records.
+        entity_sets (dict): Mapping of entity set names to the logical names of the loaded tables.
+            References to other tables, such as systemusers, are ignored.
+
+    Returns:
+        dict: Mapping of (table, referenced table) tuples to the bind properties holding the references.
+    """
+    dependencies = {}
+    for table, records in partitions.items():
+        for item in records:
+            for key, value in item.items():
+                if not key.endswith(BIND_SUFFIX) or not isinstance(value, str):
+                    continue
+                # "/crmk_plants(<id>)" or an absolute URL ending in it
+                referenced = entity_sets.get(value.rsplit('/', 1)[-1].split('(', 1)[0])
+                if referenced is not None:
+                    dependencies.setdefault((table, referenced), set()).add(key)
+    return dependencies
+
+
+def _strongly_connected(tables, graph):
+    # Tarjan's algorithm; components come out after every component they depend on
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    def visit(table):
+        index[table] = lowlink[table] = len(index)
+        stack.append(table)
+        on_stack.add(table)
+        for referenced in graph[table]:
+            if referenced not in index:
+                visit(referenced)
+                lowlink[table] = min(lowlink[table], lowlink[referenced])
+            elif referenced in on_stack:
+                lowlink[table] = min(lowlink[table], index[referenced])
+        if lowlink[table] == index[table]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == table:
+                    break
+            components.append(component)
+
+    for table in tables:
+        if table not in index:
+            visit(table)
+    return components
+
+
+def build_load_schedule(tables, dependencies):
+    """
+    Compute the topological load levels of tables.
+
+    Every table is placed one level after the last table it references. Tables that
+    reference themselves or each other in a cycle are placed in the same level, and
+    the bind properties of those references are deferred to a second pass.
+
+    Args:
+        tables (iterable): The logical names of the tables to load, in their preferred order.
+        dependencies (dict): Mapping of (table, referenced table) tuples to the bind properties
+            holding the references; an empty set for dependencies without a known property.
+
+    Returns:
+        LoadSchedule: The schedule.
+    """
+    tables = list(dict.fromkeys(tables))
+    graph = {table: set() for table in tables}
+    for table, referenced in dependencies:
+        if table in graph and referenced in graph:
+            graph[table].add(referenced)
+
+    components = _strongly_connected(tables, graph)
+    component_of = {table: number for number, component in enumerate(components) for table in component}
+    deferred = {}
+    for (table, referenced), properties in dependencies.items():
+        if table not in graph or referenced not in graph or component_of[table] != component_of[referenced]:
+            continue
+        if properties:
+            deferred.setdefault(table, set()).update(properties)
+        elif table != referenced:
+            logger.warning(f"The link between {table} and {referenced} closes a cycle without a known lookup; "
+                           f"both are loaded in the same level.")
+
+    component_levels = []
+    for number, component in enumerate(components):
+        referenced_levels = [component_levels[component_of[referenced]]
+                             for table in component for referenced in graph[table] if component_of[referenced] != number]
+        component_levels.append(max(referenced_levels, default=-1) + 1)
+
+    levels = [[] for _ in range(max(component_levels, default=-1) + 1)]
+    for table in tables:
+        levels[component_levels[component_of[table]]].append(table)
+    return LoadSchedule(levels, deferred)
+
+
+def plan_load_schedule(partitions, tables, fetchxml_queries, metadata, client):
+    """
+    Build the load schedule of the tables to load from the link-entity relationships of
+    the FetchXML queries and the @odata.bind references of the records.
+
+    Args:
+        partitions (dict): Mapping of table logical names to their records.
+        tables (iterable): The logical names of the tables to load.
+        fetchxml_queries (list): The FetchXML queries the records were extracted with.
+        metadata (MetadataCache): Entity definitions of the target instance.
+        client (DataverseClient): The client for the target instance.
+
+    Returns:
+        LoadSchedule: The schedule.
+    """
+    tables = list(tables)
+    metadata.prefetch(client, tables)
+    definitions = {table: metadata.entity(client, table) for table in tables}
+    entity_sets = {definition.entity_set: table for table, definition in definitions.items()}
+    dependencies = record_dependencies({table: partitions.get(table, []) for table in tables}, entity_sets)
+    primary_ids = {table: definition.primary_id for table, definition in definitions.items()}
+    for fetchxml_query in fetchxml_queries:
+        for dependency in link_entity_dependencies(fetchxml_query, primary_ids):
+            dependencies.setdefault(dependency, set())
+    schedule = build_load_schedule(tables, dependencies)
+    logger.info(f"Planned {schedule}.")
+    return schedule
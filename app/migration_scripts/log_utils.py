@@ -0,0 +1,177 @@
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Longest formatted log line, and longest record or response payload inside a line
+DEFAULT_MAX_MESSAGE_LENGTH = 4000
+DEFAULT_MAX_PAYLOAD_LENGTH = 500
+
+# Per-record log lines are emitted for the first record and then once every this many records
+DEFAULT_SAMPLE_EVERY = 1000
+
+_settings = {
+    'max_payload_length': DEFAULT_MAX_PAYLOAD_LENGTH,
+    'sample_every': DEFAULT_SAMPLE_EVERY,
+}
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _shorten(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more characters]"
+    return text
+
+
+class Payload:
+    """
+    Lazily formatted, truncated view of a record or response body for log arguments.
+
+    The value is only converted to text when a handler actually formats the log
+    line, so logger.debug("Sent %s", Payload(item)) costs nothing when DEBUG is off.
+
+    Args:
+        value: The record, response body or any other value to log.
+        limit (int): Maximum number of characters, None uses the configured cap.
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        limit = self.limit if self.limit is not None else _settings['max_payload_length']
+        return _shorten(str(self.value), limit)
+
+
+class RecordSampler:
+    """
+    Decide which records of a stage get a per-record log line.
+
+    The first record is always sampled, then one record out of every `every`.
+    Counting is thread-safe, so one sampler can be shared by concurrent loaders.
+
+    Args:
+        stage (str): The stage name, used in the sampled log lines.
+        every (int): Sampling interval, None uses the configured interval. 1 logs every record.
+    """
+
+    def __init__(self, stage, every=None):
+        self.stage = stage
+        self.every = max(1, every if every is not None else _settings['sample_every'])
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Count one record and tell whether it should be logged.
+
+        Returns:
+            bool: True for the sampled records.
+        """
+        with self._lock:
+            return next(self._counter) % self.every == 0
+
+
+class TruncatingFormatter(logging.Formatter):
+    """
+    Formatter that caps the length of every formatted log line.
+
+    Args:
+        fmt (str): The log format.
+        max_length (int): Maximum number of characters per line, 0 disables the cap.
+    """
+
+    def __init__(self, fmt=LOG_FORMAT, max_length=DEFAULT_MAX_MESSAGE_LENGTH):
+        super().__init__(fmt)
+        self.max_length = max_length
+
+    def format(self, record):
+        return _shorten(super().format(record), self.max_length)
+
+
+def configure_logging(level='INFO', log_file=None, max_message_length=DEFAULT_MAX_MESSAGE_LENGTH,
+                      max_payload_length=DEFAULT_MAX_PAYLOAD_LENGTH, sample_every=DEFAULT_SAMPLE_EVERY, use_queue=True, console=True):
+    """
+    Configure the root logger for migration runs.
+
+    With use_queue, log calls only format the line and put it on an in-memory
+    queue; a background listener thread writes it to the console and log file,
+    so slow terminals or disks never block the pipeline.
+
+    Args:
+        level (str or int): The root log level.
+        log_file (str): Optional file receiving the log lines in addition to the console.
+        max_message_length (int): Maximum number of characters per log line, 0 disables the cap.
+        max_payload_length (int): Maximum number of characters of a Payload, 0 disables the cap.
+        sample_every (int): Sampling interval of per-record log lines, see RecordSampler.
+        use_queue (bool): Whether to write log lines from a background thread.
+        console (bool): Whether to write log lines to the console.
+
+    Returns:
+        QueueListener or None: The running listener when use_queue is set.
+    """
+    global _listener
+    _settings['max_payload_length'] = max_payload_length
+    _settings['sample_every'] = sample_every
+
+    handlers = [logging.StreamHandler()] if console else []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    formatter = TruncatingFormatter(LOG_FORMAT, max_message_length)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    with _listener_lock:
+        for handler in list(root.handlers):
+            if getattr(handler, '_migration_handler', False):
+                root.removeHandler(handler)
+                handler.close()
+        _stop_listener()
+
+        if use_queue:
+            for handler in handlers:
+                handler.setFormatter(logging.Formatter('%(message)s'))
+            root_handler = QueueHandler(queue.SimpleQueue())
+            root_handler.setFormatter(formatter)
+            _listener = QueueListener(root_handler.queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            root_handlers = [root_handler]
+        else:
+            for handler in handlers:
+                handler.setFormatter(formatter)
+            root_handlers = handlers
+
+        for handler in root_handlers:
+            handler._migration_handler = True
+            root.addHandler(handler)
+        return _listener
+
+
+def stop_logging():
+    """
+    Flush queued log lines and stop the background listener.
+    """
+    with _listener_lock:
+        _stop_listener()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
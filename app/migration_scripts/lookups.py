@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+from .metadata import BIND_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached natural key index stays valid
+DEFAULT_LOOKUP_TTL = 3600
+
+# Rows requested per page when reading a natural key index
+LOOKUP_PAGE_SIZE = 5000
+
+
+def normalize_key(value):
+    """
+    Normalize a natural key or GUID so lookups ignore case and surrounding whitespace.
+
+    Args:
+        value: The key value.
+
+    Returns:
+        The normalized value, strings are stripped and case folded.
+    """
+    return value.strip().casefold() if isinstance(value, str) else value
+
+
+class KeyIndex:
+    """
+    Primary keys of every row of a table by the value of a natural key column.
+
+    Args:
+        entity_set (str): The entity set of the table, used in @odata.bind paths.
+        ids_by_key (dict): Mapping of normalized natural key values to primary keys.
+    """
+
+    def __init__(self, entity_set, ids_by_key):
+        self.entity_set = entity_set
+        self.ids_by_key = ids_by_key
+
+    def __len__(self):
+        return len(self.ids_by_key)
+
+    def bind(self, key_value):
+        """
+        Build the @odata.bind path of the row with a natural key value.
+
+        Args:
+            key_value: The natural key value.
+
+        Returns:
+            str or None: The path, e.g. "/systemusers(<id>)", or None for unknown values.
+        """
+        record_id = self.ids_by_key.get(normalize_key(key_value))
+        return None if record_id is None else f"/{self.entity_set}({record_id})"
+
+
+class LookupResolver:
+    """
+    Natural key indexes of reference tables in one Dataverse environment.
+
+    An index is read with a few paged $select queries returning only the primary
+    key and the natural key column of every row, and kept for ttl seconds in
+    memory and in a JSON file per table. Resolving any number of records then
+    costs no per-record requests.
+
+    Args:
+        client (DataverseClient): A client for the environment.
+        metadata (MetadataCache): Entity definitions of the environment.
+        cache_dir (str): Directory of the on-disk cache. None keeps indexes in memory only.
+        ttl (int): Seconds a cached index stays valid.
+        page_size (int): Rows requested per page.
+    """
+
+    def __init__(self, client, metadata, cache_dir=None, ttl=DEFAULT_LOOKUP_TTL, page_size=LOOKUP_PAGE_SIZE):
+        self.client = client
+        self.metadata = metadata
+        self.ttl = ttl
+        self.page_size = page_size
+        self.cache_dir = None
+        if cache_dir:
+            environment = re.sub(r'[^A-Za-z0-9_.-]', '_', urlparse(client.base_url).netloc or client.base_url)
+            self.cache_dir = os.path.join(cache_dir, environment)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index(self, entity, key):
+        """
+        Get the natural key index of a table, reading it when it is not cached.
+
+        Args:
+            entity (str): The logical name of the table, e.g. "systemuser".
+            key (str): The natural key column, e.g. "domainname".
+
+        Returns:
+            KeyIndex: The index.
+        """
+        with self._lock:
+            cached = self._indexes.get((entity, key)) or self._load(entity, key)
+            if cached is None or time.time() - cached[1] >= self.ttl:
+                cached = self._fetch(entity, key)
+                self._save(entity, key, *cached)
+            self._indexes[(entity, key)] = cached
+            return cached[0]
+
+    def _path(self, entity, key):
+        return os.path.join(self.cache_dir, f"{entity}.{key}.json")
+
+    def _load(self, entity, key):
+        if self.cache_dir is None or not os.path.exists(self._path(entity, key)):
+            return None
+        try:
+            with open(self._path(entity, key), 'r') as file:
+                cached = json.load(file)
+            return KeyIndex(cached['entity_set'], cached['ids_by_key']), cached['fetched_at']
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable lookup cache {self._path(entity, key)}: {e}")
+            return None
+
+    def _save(self, entity, key, index, fetched_at):
+        if self.cache_dir is None:
+            return
+        path = self._path(entity, key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'w') as file:
+                json.dump({'entity_set': index.entity_set, 'ids_by_key': index.ids_by_key, 'fetched_at': fetched_at}, file)
+            os.replace(path + '.tmp', path)
+        except IOError as e:
+            logger.error(f"Error saving lookup cache: {e}", exc_info=True)
+            raise
+
+    def _fetch(self, entity, key):
+        definition = self.metadata.entity(self.client, entity)
+        url = f"api/data/v9.1/{definition.entity_set}?$select={definition.primary_id},{key}"
+        headers = {"Prefer": f"odata.maxpagesize={self.page_size}"}
+        ids_by_key = {}
+        pages = 0
+        while url:
+            response = self.client.get(url, headers=headers)
+            response.raise_for_status()
+            payload = response.json()
+            for row in payload.get('value', []):
+                if row.get(key) is not None:
+                    ids_by_key[normalize_key(row[key])] = row[definition.primary_id]
+            url = payload.get('@odata.nextLink')
+            pages += 1
+        logger.info(f"Indexed {len(ids_by_key)} {entity} rows of {self.client.base_url} by {key} in {pages} pages.")
+        return KeyIndex(definition.entity_set, ids_by_key), time.time()
+
+
+class LookupRule:
+    """
+    How one source column is resolved to a reference in the target environment.
+
+    Args:
+        field (str): The source column holding the reference.
+        bind (str): The navigation property written as "<bind>@odata.bind", e.g. "ownerid".
+        targets (list): (entity, natural key column) pairs tried in order,
+            e.g. systemuser by domainname, then team by name.
+        match_source_ids (bool): Whether the source column holds source primary keys,
+            translated through the same tables in the source environment, rather than
+            natural key values.
+    """
+
+    def __init__(self, field, bind, targets, match_source_ids=False):
+        self.field = field
+        self.bind = bind
+        self.targets = [tuple(target) for target in targets]
+        self.match_source_ids = match_source_ids
+
+    @classmethod
+    def from_config(cls, field, config):
+        """
+        Build a rule from its entry in the "lookups" section of config.json, e.g.
+        {"bind": "ownerid", "targets": [{"entity": "systemuser", "key": "domainname"}]}.
+        """
+        targets = [(target['entity'], target['key']) for target in config['targets']]
+        return cls(field, config.get('bind', field), targets, config.get('match_source_ids', False))
+
+
+class ResolvedLookup:
+    """
+    The @odata.bind paths of every known reference of one source column.
+
+    Args:
+        field (str): The source column.
+        bind (str): The navigation property the references are bound to.
+        binds (dict): Mapping of normalized source values to @odata.bind paths.
+        entity_set (str): Entity set of the first target table, used for fallback references.
+    """
+
+    def __init__(self, field, bind, binds, entity_set):
+        self.field = field
+        self.target = f"{bind}{BIND_SUFFIX}"
+        self.binds = binds
+        self.entity_set = entity_set
+
+    def __len__(self):
+        return len(self.binds)
+
+    def get(self, value):
+        return self.binds.get(normalize_key(value))
+
+
+def resolve_lookups(rules, target, source=None):
+    """
+    Resolve the references of every lookup rule in bulk.
+
+    Args:
+        rules (list): The LookupRule objects.
+        target (LookupResolver): Resolver of the target environment.
+        source (LookupResolver): Resolver of the source environment, required by rules
+            matching source ids.
+
+    Returns:
+        list: One ResolvedLookup per rule.
+    """
+    resolved = []
+    for rule in rules:
+        binds = {}
+        entity_set = None
+        # Earlier targets win when several tables know the same value
+        for entity, key in reversed(rule.targets):
+            target_index = target.index(entity, key)
+            entity_set = target_index.entity_set
+            if rule.match_source_ids:
+                for key_value, source_id in source.index(entity, key).ids_by_key.items():
+                    bind = target_index.bind(key_value)
+                    if bind is not None:
+                        binds[normalize_key(source_id)] = bind
+            else:
+                binds.update((key_value, f"/{entity_set}({record_id})") for key_value, record_id in target_index.ids_by_key.items())
+        logger.info(f"Resolved {len(binds)} references for {rule.field}.")
+        resolved.append(ResolvedLookup(rule.field, rule.bind, binds, entity_set))
+    return resolved
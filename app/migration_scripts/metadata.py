@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from urllib.parse import quote, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached entity definition stays valid
+DEFAULT_METADATA_TTL = 24 * 3600
+
+# Number of entities requested per EntityDefinitions call, keeping the filter URL short
+METADATA_FILTER_SIZE = 20
+
+ENTITY_SELECT = "LogicalName,EntitySetName,PrimaryIdAttribute,PrimaryNameAttribute"
+ATTRIBUTE_EXPAND = "Attributes($select=LogicalName,AttributeType)"
+
+# Attribute queries read for validation, by metadata type cast; '' reads the properties of every attribute
+OPTION_SET_QUERY = "$select=LogicalName&$expand=OptionSet($select=Options),GlobalOptionSet($select=Options)"
+CONSTRAINT_QUERIES = {
+    "": "$select=LogicalName,RequiredLevel,IsValidForCreate,IsValidForUpdate",
+    "StringAttributeMetadata": "$select=LogicalName,MaxLength",
+    "MemoAttributeMetadata": "$select=LogicalName,MaxLength",
+    "IntegerAttributeMetadata": "$select=LogicalName,MinValue,MaxValue",
+    "DecimalAttributeMetadata": "$select=LogicalName,MinValue,MaxValue",
+    "DoubleAttributeMetadata": "$select=LogicalName,MinValue,MaxValue",
+    "MoneyAttributeMetadata": "$select=LogicalName,MinValue,MaxValue",
+    "PicklistAttributeMetadata": OPTION_SET_QUERY,
+    "MultiSelectPicklistAttributeMetadata": OPTION_SET_QUERY,
+    "StateAttributeMetadata": "$select=LogicalName&$expand=OptionSet($select=Options)",
+    "StatusAttributeMetadata": "$select=LogicalName&$expand=OptionSet($select=Options)",
+    "LookupAttributeMetadata": "$select=LogicalName,Targets",
+}
+
+# Required levels Dataverse rejects a missing or empty value for
+REQUIRED_LEVELS = ('SystemRequired', 'ApplicationRequired')
+
+# Attribute types referencing another row, written as "<navigation property>@odata.bind"
+LOOKUP_TYPES = ('Lookup', 'Customer', 'Owner')
+BIND_SUFFIX = '@odata.bind'
+
+_metadata_caches = {}
+_metadata_lock = threading.Lock()
+
+
+class EntityMetadata:
+    """
+    The parts of a Dataverse entity definition the pipeline needs.
+
+    Args:
+        logical_name (str): The logical name of the entity, e.g. "crmk_plant".
+        entity_set (str): The Web API entity set name, e.g. "crmk_plants".
+        primary_id (str): The primary key column.
+        primary_name (str): The primary name column.
+        attributes (dict): Mapping of column logical names to their AttributeType.
+        constraints (dict): Mapping of column logical names to their validation constraints,
+            see MetadataCache.constraints. None until they are fetched.
+    """
+
+    def __init__(self, logical_name, entity_set, primary_id, primary_name=None, attributes=None, constraints=None):
+        self.logical_name = logical_name
+        self.entity_set = entity_set
+        self.primary_id = primary_id
+        self.primary_name = primary_name
+        self.attributes = dict(attributes or {})
+        self.constraints = constraints
+
+    @classmethod
+    def from_definition(cls, definition):
+        """
+        Build the metadata from an EntityDefinitions response entry.
+        """
+        attributes = {attribute['LogicalName']: attribute.get('AttributeType') for attribute in definition.get('Attributes', [])}
+        return cls(definition['LogicalName'], definition['EntitySetName'], definition['PrimaryIdAttribute'],
+                   definition.get('PrimaryNameAttribute'), attributes)
+
+    def to_dict(self):
+        return {
+            'logical_name': self.logical_name,
+            'entity_set': self.entity_set,
+            'primary_id': self.primary_id,
+            'primary_name': self.primary_name,
+            'attributes': self.attributes,
+            'constraints': self.constraints,
+        }
+
+    def __repr__(self):
+        return f"EntityMetadata({self.logical_name!r}, {self.entity_set!r}, {self.primary_id!r}, {len(self.attributes)} attributes)"
+
+
+class MetadataCache:
+    """
+    Entity definitions of one Dataverse environment, cached in memory and on disk.
+
+    Definitions are read from the EntityDefinitions API the first time an entity
+    is needed and kept for ttl seconds in a JSON file per environment, so neither
+    a run nor the following runs fetch the same definition twice.
+
+    Args:
+        base_url (str): The base URL of the Dataverse instance.
+        cache_dir (str): Directory of the on-disk cache. None keeps definitions in memory only.
+        ttl (int): Seconds a cached definition stays valid.
+    """
+
+    def __init__(self, base_url, cache_dir=None, ttl=DEFAULT_METADATA_TTL):
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.path = None
+        if cache_dir:
+            environment = re.sub(r'[^A-Za-z0-9_.-]', '_', urlparse(self.base_url).netloc or self.base_url)
+            self.path = os.path.join(cache_dir, f"{environment}.json")
+        self._entities = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                cached = json.load(file)
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable metadata cache {self.path}: {e}")
+            return
+        now = time.time()
+        for logical_name, entry in cached.get('entities', {}).items():
+            if now - entry.get('fetched_at', 0) < self.ttl:
+                self._entities[logical_name] = (EntityMetadata(**entry['metadata']), entry['fetched_at'])
+        logger.info(f"Loaded {len(self._entities)} cached entity definitions from {self.path}.")
+
+    def _save(self):
+        if self.path is None:
+            return
+        entities = {
+            logical_name: {'metadata': metadata.to_dict(), 'fetched_at': fetched_at}
+            for logical_name, (metadata, fetched_at) in self._entities.items()
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump({'base_url': self.base_url, 'entities': entities}, file, indent=4)
+            os.replace(self.path + '.tmp', self.path)
+        except IOError as e:
+            logger.error(f"Error saving metadata cache: {e}", exc_info=True)
+            raise
+
+    def put(self, metadata):
+        """
+        Add an entity definition to the cache.
+
+        Args:
+            metadata (EntityMetadata): The entity definition.
+        """
+        with self._lock:
+            self._entities[metadata.logical_name] = (metadata, time.time())
+            self._save()
+
+    def _fresh(self, logical_name):
+        cached = self._entities.get(logical_name)
+        if cached is not None and time.time() - cached[1] < self.ttl:
+            return cached[0]
+        return None
+
+    def prefetch(self, client, logical_names):
+        """
+        Make sure the definitions of several entities are cached, fetching the
+        missing ones with as few EntityDefinitions requests as possible.
+
+        Args:
+            client (DataverseClient): A client for this environment.
+            logical_names (iterable): The logical names of the entities.
+
+        Raises:
+            KeyError: If an entity does not exist in the environment.
+        """
+        with self._lock:
+            missing = sorted({name for name in logical_names if name and self._fresh(name) is None})
+            if not missing:
+                return
+            fetched_at = time.time()
+            for start in range(0, len(missing), METADATA_FILTER_SIZE):
+                names = missing[start:start + METADATA_FILTER_SIZE]
+                for definition in self._fetch_definitions(client, names):
+                    metadata = EntityMetadata.from_definition(definition)
+                    self._entities[metadata.logical_name] = (metadata, fetched_at)
+            self._save()
+            unknown = [name for name in missing if self._fresh(name) is None]
+        if unknown:
+            raise KeyError(f"No entity definition found for {', '.join(unknown)} in {self.base_url}.")
+        logger.info(f"Fetched entity definitions for {', '.join(missing)} from {self.base_url}.")
+
+    def _fetch_definitions(self, client, names):
+        name_filter = ' or '.join(f"LogicalName eq '{name}'" for name in names)
+        path = (f"api/data/v9.1/EntityDefinitions?$select={ENTITY_SELECT}&$expand={ATTRIBUTE_EXPAND}"
+                f"&$filter={quote(name_filter, safe='=')}")
+        response = client.get(path)
+        response.raise_for_status()
+        return response.json().get('value', [])
+
+    def entity(self, client, logical_name):
+        """
+        Get the definition of an entity.
+
+        Args:
+            client (DataverseClient): A client for this environment, used when the definition is not cached.
+            logical_name (str): The logical name of the entity.
+
+        Returns:
+            EntityMetadata: The entity definition.
+        """
+        metadata = self._fresh(logical_name)
+        if metadata is None:
+            self.prefetch(client, [logical_name])
+            metadata = self._fresh(logical_name)
+        return metadata
+
+    def constraints(self, client, logical_name):
+        """
+        Get the validation constraints of the columns of an entity.
+
+        They take one attribute query per metadata type, so they are only fetched
+        when asked for and then cached with the entity definition.
+
+        Args:
+            client (DataverseClient): A client for this environment, used when the constraints are not cached.
+            logical_name (str): The logical name of the entity.
+
+        Returns:
+            dict: Mapping of column logical names to dicts with any of the keys "required",
+                "create", "update", "max_length", "min", "max", "options" and "targets".
+        """
+        metadata = self.entity(client, logical_name)
+        if metadata.constraints is None:
+            with self._lock:
+                if metadata.constraints is None:
+                    metadata.constraints = _fetch_constraints(client, logical_name)
+                    self._save()
+            logger.info(f"Fetched attribute constraints of {logical_name} from {self.base_url}.")
+        return metadata.constraints
+
+
+def _fetch_constraints(client, logical_name):
+    constraints = {}
+    for cast, query in CONSTRAINT_QUERIES.items():
+        path = f"api/data/v9.1/EntityDefinitions(LogicalName='{logical_name}')/Attributes"
+        if cast:
+            path += f"/Microsoft.Dynamics.CRM.{cast}"
+        response = client.get(f"{path}?{query}")
+        response.raise_for_status()
+        for attribute in response.json().get('value', []):
+            column = constraints.setdefault(attribute['LogicalName'], {})
+            if 'RequiredLevel' in attribute:
+                column['required'] = (attribute['RequiredLevel'] or {}).get('Value') in REQUIRED_LEVELS
+                column['create'] = attribute.get('IsValidForCreate', True)
+                column['update'] = attribute.get('IsValidForUpdate', True)
+            if attribute.get('MaxLength') is not None:
+                column['max_length'] = attribute['MaxLength']
+            for bound in ('MinValue', 'MaxValue'):
+                if attribute.get(bound) is not None:
+                    column[bound[:3].lower()] = attribute[bound]
+            option_set = attribute.get('OptionSet') or attribute.get('GlobalOptionSet')
+            if option_set:
+                column['options'] = [option['Value'] for option in option_set.get('Options', [])]
+            if attribute.get('Targets'):
+                column['targets'] = list(attribute['Targets'])
+    return constraints
+
+
+def get_metadata(base_url, cache_dir=None, ttl=DEFAULT_METADATA_TTL):
+    """
+    Return the shared metadata cache of a Dataverse environment, creating it on first use.
+
+    Args:
+        base_url (str): The base URL of the Dataverse instance.
+        cache_dir (str): Directory of the on-disk cache. None keeps definitions in memory only.
+        ttl (int): Seconds a cached definition stays valid.
+
+    Returns:
+        MetadataCache: The shared metadata cache.
+    """
+    with _metadata_lock:
+        key = (base_url.rstrip('/'), cache_dir)
+        if key not in _metadata_caches:
+            _metadata_caches[key] = MetadataCache(base_url, cache_dir, ttl)
+        return _metadata_caches[key]
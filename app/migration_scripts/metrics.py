@@ -0,0 +1,309 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds for Dataverse and token endpoint requests
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# HTTP statuses Dataverse uses to signal service protection limits
+THROTTLE_STATUSES = (429, 503)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Disabled metrics ignore updates, and callers may skip measuring what they record
+        self.enabled = True
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def value(self, **labels):
+        """
+        Return the current value of a label set, 0 if it was never recorded.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value per label set that can go up and down.
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Cumulative bucket counts, sum and count of observations per label set.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [bucket_count + (1 if value <= bound else 0) for bucket_count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Counter(
+    'migration_stage_seconds_total', 'Wall time spent in each pipeline stage.', ['stage']))
+STAGE_RUNS = REGISTRY.register(Counter(
+    'migration_stage_runs_total', 'Number of times each pipeline stage ran, by outcome.', ['stage', 'outcome']))
+STAGE_RECORDS = REGISTRY.register(Counter(
+    'migration_stage_records_total', 'Records processed by each pipeline stage.', ['stage']))
+STAGE_LAST_SECONDS = REGISTRY.register(Gauge(
+    'migration_stage_last_duration_seconds', 'Wall time of the last run of each pipeline stage.', ['stage']))
+STAGE_LAST_THROUGHPUT = REGISTRY.register(Gauge(
+    'migration_stage_last_records_per_second', 'Records per second of the last run of each pipeline stage.', ['stage']))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    'dataverse_http_request_duration_seconds', 'Latency of outgoing HTTP requests.', ['endpoint', 'method', 'status']))
+HTTP_BYTES = REGISTRY.register(Counter(
+    'dataverse_http_bytes_total', 'Bytes of request and response bodies transferred.', ['endpoint', 'direction']))
+HTTP_RETRIES = REGISTRY.register(Counter(
+    'dataverse_http_retries_total', 'Outgoing HTTP requests that were retried.', ['endpoint']))
+HTTP_THROTTLED = REGISTRY.register(Counter(
+    'dataverse_http_throttled_total', 'Outgoing HTTP requests rejected by service protection limits.', ['endpoint']))
+CIRCUIT_PAUSES = REGISTRY.register(Counter(
+    'dataverse_circuit_pauses_total', 'Times all requests to an instance were paused because it signalled overload.', ['instance']))
+CIRCUIT_PAUSED_SECONDS = REGISTRY.register(Counter(
+    'dataverse_circuit_paused_seconds_total', 'Seconds requests waited for a paused instance, summed over workers.', ['instance']))
+GOVERNOR_RATE = REGISTRY.register(Gauge(
+    'dataverse_governor_requests_per_second', 'Request rate the governor currently allows per instance.', ['instance']))
+GOVERNOR_CONCURRENCY = REGISTRY.register(Gauge(
+    'dataverse_governor_concurrent_requests', 'Requests in flight the governor currently allows per instance.', ['instance']))
+GOVERNOR_WAIT_SECONDS = REGISTRY.register(Counter(
+    'dataverse_governor_wait_seconds_total', 'Seconds requests waited for the governor, summed over workers.', ['instance']))
+DEAD_LETTERS = REGISTRY.register(Counter(
+    'migration_dead_letters_total', 'Records that failed to load and were written to the dead-letter file.', ['table']))
+
+EXTRACT_BYTES = REGISTRY.register(Counter(
+    'migration_extract_response_bytes_total', 'Response bytes of extract queries, as sent on the wire and after decoding.',
+    ['entity', 'encoding']))
+UNCHANGED_RECORDS = REGISTRY.register(Counter(
+    'migration_unchanged_records_total', 'Records skipped before the load because the target already holds them unchanged.',
+    ['table']))
+
+
+def endpoint_label(url):
+    """
+    Reduce a request URL to a low-cardinality endpoint label.
+
+    Args:
+        url (str): The request URL.
+
+    Returns:
+        str: "token" for the token endpoint, otherwise the Web API entity set or
+            operation, e.g. "crmk_plants" or "$batch".
+    """
+    parsed = urlparse(url)
+    if parsed.path.endswith('/oauth2/v2.0/token'):
+        return 'token'
+    marker = '/api/data/'
+    if marker not in parsed.path:
+        return parsed.path or '/'
+    remainder = parsed.path.split(marker, 1)[1]
+    segments = remainder.split('/')
+    resource = segments[1] if len(segments) > 1 else segments[0]
+    return resource.split('(')[0] or '/'
+
+
+class StageTracker:
+    """
+    Record count of a stage being tracked by track_stage().
+    """
+
+    def __init__(self):
+        self.records = 0
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Measure the wall time, outcome and throughput of a pipeline stage.
+
+    Set the `records` attribute of the yielded tracker to report the records processed.
+
+    Args:
+        stage (str): The stage name, e.g. "extract".
+
+    Yields:
+        StageTracker: The tracker of this stage run.
+    """
+    tracker = StageTracker()
+    started = time.perf_counter()
+    outcome = 'failure'
+    try:
+        yield tracker
+        outcome = 'success'
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.inc(elapsed, stage=stage)
+        STAGE_RUNS.inc(stage=stage, outcome=outcome)
+        STAGE_RECORDS.inc(tracker.records, stage=stage)
+        STAGE_LAST_SECONDS.set(round(elapsed, 6), stage=stage)
+        STAGE_LAST_THROUGHPUT.set(round(tracker.records / elapsed, 3) if elapsed > 0 else 0, stage=stage)
+
+
+def observe_request(method, url, status, duration, sent=0, received=0):
+    """
+    Record one outgoing HTTP request.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The request URL.
+        status (int or str): The response status, or "error" if no response was received.
+        duration (float): The request latency in seconds.
+        sent (int): Bytes in the request body.
+        received (int): Bytes in the response body.
+    """
+    endpoint = endpoint_label(url)
+    HTTP_DURATION.observe(duration, endpoint=endpoint, method=method, status=status)
+    HTTP_BYTES.inc(sent, endpoint=endpoint, direction='sent')
+    HTTP_BYTES.inc(received, endpoint=endpoint, direction='received')
+    if status in THROTTLE_STATUSES:
+        HTTP_THROTTLED.inc(endpoint=endpoint)
+
+
+def count_retry(url):
+    """
+    Record that a request to a URL is being retried.
+
+    Args:
+        url (str): The request URL.
+    """
+    HTTP_RETRIES.inc(endpoint=endpoint_label(url))
+
+
+def count_received(url, size):
+    """
+    Record response body bytes read after the request was timed, as for streamed responses.
+
+    Args:
+        url (str): The request URL.
+        size (int): Bytes in the response body.
+    """
+    HTTP_BYTES.inc(size, endpoint=endpoint_label(url), direction='received')
+
+
+def request_size(request):
+    """
+    Size in bytes of the body of a sent request, as encoded by requests.
+
+    Args:
+        request (requests.PreparedRequest): The request, None if it was never prepared.
+
+    Returns:
+        int: The body size, 0 while the bytes metric is disabled or for streamed bodies.
+    """
+    body = getattr(request, 'body', None)
+    if not HTTP_BYTES.enabled or body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return 0
+
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics text.
+    """
+    return REGISTRY.render()
@@ -0,0 +1,217 @@
+import logging
+from datetime import datetime, timezone
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+PARTITION_BY_GUID = 'guid'
+PARTITION_BY_DATE = 'date'
+
+# Column split by the date strategy unless another one is configured
+DEFAULT_DATE_FIELD = 'createdon'
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def sql_guid_key(value):
+    """
+    Sort key of a GUID in the order SQL Server compares uniqueidentifier values.
+
+    SQL Server compares the last group first and the first group last, so range
+    conditions on a primary key follow this order rather than the text order.
+
+    Args:
+        value (str): The GUID.
+
+    Returns:
+        tuple: The groups of the GUID, most significant first.
+    """
+    groups = value.lower().split('-')
+    return tuple(reversed(groups))
+
+
+def guid_boundaries(partitions):
+    """
+    Split the uniqueidentifier range into equally wide ranges.
+
+    Only the most significant group in SQL Server order is split, so the
+    boundaries are sorted the way the service compares them.
+
+    Args:
+        partitions (int): Number of ranges.
+
+    Returns:
+        list: The partitions - 1 inner boundaries, in ascending order.
+    """
+    return [f"00000000-0000-0000-0000-{(index << 48) // partitions:012x}" for index in range(1, partitions)]
+
+
+def date_boundaries(lowest, highest, partitions):
+    """
+    Split a date range into equally long ranges with second precision.
+
+    Args:
+        lowest (str): The earliest value, as an ISO 8601 UTC timestamp.
+        highest (str): The latest value, as an ISO 8601 UTC timestamp.
+        partitions (int): Number of ranges.
+
+    Returns:
+        list: The distinct inner boundaries, in ascending order.
+    """
+    start = _parse_timestamp(lowest)
+    end = _parse_timestamp(highest)
+    step = (end - start) / partitions
+    boundaries = []
+    for index in range(1, partitions):
+        boundary = (start + step * index).strftime(DATE_FORMAT)
+        if boundary > start.strftime(DATE_FORMAT) and boundary not in boundaries:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def _parse_timestamp(value):
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def add_range_filter(fetchxml_query, field, lower=None, upper=None, null=False):
+    """
+    Restrict a FetchXML query to one range of a column.
+
+    The conditions go into a separate filter of the root entity, which the
+    service combines with the existing filters using AND.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+        field (str): The column of the root entity.
+        lower (str): Inclusive lower bound, None for no lower bound.
+        upper (str): Exclusive upper bound, None for no upper bound.
+        null (bool): Select the rows where the column is empty instead of a range.
+
+    Returns:
+        str: The restricted FetchXML query.
+    """
+    root = ET.fromstring(fetchxml_query)
+    entity = root.find('entity')
+    if entity is None:
+        raise ValueError("FetchXML query has no root entity.")
+    range_filter = ET.SubElement(entity, 'filter', {'type': 'and'})
+    if null:
+        ET.SubElement(range_filter, 'condition', {'attribute': field, 'operator': 'null'})
+    if lower is not None:
+        ET.SubElement(range_filter, 'condition', {'attribute': field, 'operator': 'ge', 'value': lower})
+    if upper is not None:
+        ET.SubElement(range_filter, 'condition', {'attribute': field, 'operator': 'lt', 'value': upper})
+    return ET.tostring(root, encoding='unicode')
+
+
+def split_by_boundaries(fetchxml_query, field, boundaries, include_null=False):
+    """
+    Split a FetchXML query into disjoint queries that together return the same rows.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+        field (str): The column the boundaries apply to.
+        boundaries (list): The inner boundaries, in ascending order.
+        include_null (bool): Whether to add a query for rows where the column is empty.
+
+    Returns:
+        list: The partition queries, in ascending range order.
+    """
+    bounds = [None] + list(boundaries) + [None]
+    queries = [add_range_filter(fetchxml_query, field, lower, upper) for lower, upper in zip(bounds, bounds[1:])]
+    if include_null:
+        queries.append(add_range_filter(fetchxml_query, field, null=True))
+    return queries
+
+
+def bounds_query(fetchxml_query, field, descending=False):
+    """
+    Build a query returning the lowest or highest value of a column among the rows of a query.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+        field (str): The column of the root entity.
+        descending (bool): Whether to return the highest instead of the lowest value.
+
+    Returns:
+        str: A FetchXML query returning at most one row holding only the column.
+    """
+    root = ET.fromstring(fetchxml_query)
+    for attribute in ('count', 'page', 'paging-cookie'):
+        root.attrib.pop(attribute, None)
+    root.set('top', '1')
+    entity = root.find('entity')
+    for child in list(entity):
+        if child.tag in ('attribute', 'all-attributes', 'order'):
+            entity.remove(child)
+    ET.SubElement(entity, 'attribute', {'name': field})
+    ET.SubElement(entity, 'filter', {'type': 'and'}).append(ET.Element('condition', {'attribute': field, 'operator': 'not-null'}))
+    ET.SubElement(entity, 'order', {'attribute': field, 'descending': 'true' if descending else 'false'})
+    return ET.tostring(root, encoding='unicode')
+
+
+def can_partition(fetchxml_query):
+    """
+    Check whether a query returns the same rows when split into ranges.
+
+    Queries limited with top, aggregate queries and queries that already page
+    themselves cannot be split.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+
+    Returns:
+        bool: True if the query can be partitioned.
+    """
+    root = ET.fromstring(fetchxml_query)
+    if root.attrib.get('aggregate') == 'true':
+        return False
+    return not any(attribute in root.attrib for attribute in ('top', 'page', 'paging-cookie'))
+
+
+def partition_query(fetchxml_query, partitions, strategy=PARTITION_BY_GUID, field=None, fetch_bounds=None):
+    """
+    Split a FetchXML query into disjoint range partitions.
+
+    With the guid strategy the primary key range is split into equally wide
+    ranges in SQL Server uniqueidentifier order. Queries sorted by the primary
+    key, which is the service default, then return the same rows in the same order
+    when the partitions are read one after the other. The ranges are only balanced
+    for random GUIDs; for sequential GUIDs use the date strategy.
+
+    With the date strategy the range between the lowest and the highest value of
+    the column, read with fetch_bounds, is split into equally long ranges, and a
+    last partition holds the rows without a value.
+
+    Args:
+        fetchxml_query (str): The FetchXML query as a string.
+        partitions (int): Number of ranges.
+        strategy (str): PARTITION_BY_GUID or PARTITION_BY_DATE.
+        field (str): The column to split on, the primary key or createdon by default.
+        fetch_bounds (callable): Called with a bounds_query and returning the value
+            of its single row or None, required by the date strategy.
+
+    Returns:
+        list: The partition queries, in range order. The original query alone when it
+            cannot be partitioned.
+    """
+    if partitions < 2 or not can_partition(fetchxml_query):
+        return [fetchxml_query]
+    if strategy == PARTITION_BY_GUID:
+        if field is None:
+            raise ValueError("The guid partition strategy needs the primary key column.")
+        return split_by_boundaries(fetchxml_query, field, guid_boundaries(partitions))
+    if strategy == PARTITION_BY_DATE:
+        field = field or DEFAULT_DATE_FIELD
+        lowest = fetch_bounds(bounds_query(fetchxml_query, field))
+        highest = fetch_bounds(bounds_query(fetchxml_query, field, descending=True))
+        if lowest is None or highest is None:
+            logger.info(f"No values of {field} to partition on, fetching the query as a whole.")
+            return [fetchxml_query]
+        boundaries = date_boundaries(lowest, highest, partitions)
+        logger.debug(f"Partitioning on {field} between {lowest} and {highest} at {boundaries}.")
+        return split_by_boundaries(fetchxml_query, field, boundaries, include_null=True)
+    raise ValueError(f"Unknown partition strategy: {strategy}")
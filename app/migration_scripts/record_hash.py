@@ -0,0 +1,110 @@
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+from .compact_records import json_default
+from .metadata import BIND_SUFFIX, LOOKUP_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Bytes of the content hash digest
+HASH_SIZE = 16
+
+
+def normalize_value(value, attribute_type):
+    """
+    Bring a source value and the value the Web API returns for it to one representation.
+
+    Args:
+        value: The column value.
+        attribute_type (str): The AttributeType of the column, None when unknown.
+
+    Returns:
+        The normalized value.
+    """
+    if value is None:
+        return None
+    if attribute_type == 'DateTime' and isinstance(value, str) and len(value) > 10:
+        try:
+            parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        except ValueError:
+            return value
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if attribute_type in ('Decimal', 'Double', 'Money') and not isinstance(value, bool):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return value
+    if (attribute_type == 'Uniqueidentifier' or attribute_type in LOOKUP_TYPES) and isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def _bind_id(reference):
+    # "/crmk_plants(<guid>)" or an absolute URL ending in it; alternate key references are kept whole
+    if not isinstance(reference, str) or not reference.endswith(')') or '(' not in reference:
+        return reference
+    key = reference.rsplit('(', 1)[1][:-1]
+    return reference if '=' in key else key.lower()
+
+
+def lookup_columns(attributes):
+    """
+    Map the lowercased lookup columns of a table to their logical names, which navigation properties match.
+    """
+    return {attribute.lower(): attribute for attribute, attribute_type in attributes.items() if attribute_type in LOOKUP_TYPES}
+
+
+def comparable_values(record, attributes, lookups=None):
+    """
+    Reduce a record to the column values it writes, in a representation shared with target rows.
+
+    Lookups set with @odata.bind are keyed by their column, holding the id of the
+    referenced row. Instance annotations and logical_name are not written, so they
+    are left out.
+
+    Args:
+        record (dict): The record, as it will be written.
+        attributes (dict): Mapping of the column logical names of the table to their AttributeType.
+        lookups (dict): The lookup_columns of the attributes, computed when not given.
+
+    Returns:
+        dict: Mapping of columns to normalized values.
+    """
+    values = {}
+    if lookups is None:
+        lookups = lookup_columns(attributes)
+    for key, value in record.items():
+        if key.endswith(BIND_SUFFIX):
+            navigation = key[:-len(BIND_SUFFIX)]
+            values[lookups.get(navigation.lower(), navigation)] = _bind_id(value)
+        elif '@' not in key and key != 'logical_name':
+            values[key] = normalize_value(value, attributes.get(key))
+    return values
+
+
+def digest_values(values):
+    """
+    Hash comparable values, see comparable_values.
+    """
+    canonical = json.dumps(sorted(values.items()), separators=(',', ':'), default=json_default)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=HASH_SIZE).hexdigest()
+
+
+def content_hash(record, attributes=None):
+    """
+    Compute a stable hash of the content a record writes.
+
+    The hash does not depend on the order of the columns, and values are normalized
+    by their attribute type, so the same content always hashes the same.
+
+    Args:
+        record (dict): The record, as it will be written.
+        attributes (dict): Mapping of the column logical names of the table to their AttributeType.
+
+    Returns:
+        str: The hex digest.
+    """
+    return digest_values(comparable_values(record, attributes or {}))
@@ -0,0 +1,389 @@
+import os
+import gzip
+import json
+import mmap
+import bisect
+import logging
+import threading
+from array import array
+from itertools import islice
+from .compact_records import json_default
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+SEGMENT_PREFIX = 'segment-'
+
+
+# Marker for reading the records of every entity, since None tags untagged records
+ALL_ENTITIES = object()
+
+
+def encode_record(record):
+    """
+    Encode a record as one NDJSON line, the way RecordWriter stores it.
+
+    Args:
+        record (dict or CompactRecord): The record.
+
+    Returns:
+        bytes: The JSON line, ending in a newline.
+    """
+    return json.dumps(record, separators=(',', ':'), default=json_default).encode('utf-8') + b'\n'
+
+
+class RecordWriter:
+    """
+    Append records to a series of NDJSON segments belonging to one part of a RecordStore.
+
+    Segments are rolled over every `segment_records` records. A segment only becomes
+    visible to readers once it is closed and registered in the store index. Every
+    segment is tagged with the entity its records belong to. Writers of the same
+    part can split it into shards, which are read in shard order.
+    """
+
+    def __init__(self, store, part, entity=None, shard=0):
+        self.store = store
+        self.part = part
+        self.shard = shard
+        self.entity = entity
+        self.seq = 0
+        self.count = 0
+        self._file = None
+        self._offsets = None
+        self._segment_count = 0
+        self._position = 0
+
+    def _open_segment(self):
+        if self.shard:
+            name = f"{SEGMENT_PREFIX}{self.part:05d}-{self.shard:04d}-{self.seq:05d}.ndjson"
+        else:
+            name = f"{SEGMENT_PREFIX}{self.part:05d}-{self.seq:05d}.ndjson"
+        if self.store.compress:
+            name += '.gz'
+            self._file = gzip.open(os.path.join(self.store.path, name), 'wb')
+        else:
+            self._file = open(os.path.join(self.store.path, name), 'wb')
+        self._name = name
+        self._offsets = array('Q')
+        self._segment_count = 0
+        self._position = 0
+
+    def _close_segment(self):
+        self._file.close()
+        if not self.store.compress:
+            with open(os.path.join(self.store.path, self._name[:-len('.ndjson')] + '.idx'), 'wb') as file:
+                self._offsets.tofile(file)
+        self.store._register({
+            'name': self._name,
+            'part': self.part,
+            'shard': self.shard,
+            'seq': self.seq,
+            'entity': self.entity,
+            'count': self._segment_count,
+            'compressed': self.store.compress,
+        })
+        self._file = None
+        self.seq += 1
+
+    def write(self, record):
+        """
+        Append a single record.
+
+        Args:
+            record (dict or CompactRecord): The record to append.
+        """
+        self._write_line(encode_record(record))
+
+    def write_lines(self, data):
+        """
+        Append records already encoded with encode_record, e.g. by another process.
+
+        Args:
+            data (bytes): Concatenated NDJSON lines.
+        """
+        for line in data.splitlines(keepends=True):
+            self._write_line(line)
+
+    def _write_line(self, line):
+        if self._file is None:
+            self._open_segment()
+        self._offsets.append(self._position)
+        self._file.write(line)
+        self._position += len(line)
+        self._segment_count += 1
+        self.count += 1
+        if self._segment_count >= self.store.segment_records:
+            self._close_segment()
+
+    def write_many(self, records):
+        """
+        Append every record from an iterable.
+
+        Args:
+            records (iterable): The records to append.
+        """
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        """
+        Flush the open segment and register it in the store index.
+        """
+        if self._file is not None:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordStore:
+    """
+    Append-only record store made of NDJSON segments plus a small offset index.
+
+    Records are written through one or more RecordWriter parts. Reading returns the
+    records of part 0 first, then part 1 and so on, each in shard order and then in the
+    order they were written, so concurrent writers still produce a deterministic record order.
+
+    Args:
+        path (str): Directory holding the segments and the index.
+        compress (bool): Whether new segments are gzip compressed.
+        segment_records (int): Maximum number of records per segment.
+    """
+
+    def __init__(self, path, compress=False, segment_records=100000):
+        self.path = path
+        self.compress = compress
+        self.segment_records = segment_records
+        self.segments = []
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._offsets = {}
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                self.segments = json.load(file)['segments']
+
+    @classmethod
+    def create(cls, path, compress=False, segment_records=100000):
+        """
+        Create an empty store, removing the segments of any previous store at the same path.
+
+        Args:
+            path (str): Directory holding the segments and the index.
+            compress (bool): Whether new segments are gzip compressed.
+            segment_records (int): Maximum number of records per segment.
+
+        Returns:
+            RecordStore: The empty store.
+        """
+        os.makedirs(path, exist_ok=True)
+        for filename in os.listdir(path):
+            if filename == INDEX_FILE or filename.startswith(SEGMENT_PREFIX):
+                os.remove(os.path.join(path, filename))
+        store = cls(path, compress, segment_records)
+        store._save_index()
+        logger.info(f"Created record store at {path}.")
+        return store
+
+    def writer(self, part=0, entity=None, shard=0):
+        """
+        Open a writer for one part of the store.
+
+        Args:
+            part (int): Position of this writer's records in the read order.
+            entity (str): The logical name of the entity the records belong to.
+            shard (int): Position of this writer's records within the part.
+
+        Returns:
+            RecordWriter: The writer.
+        """
+        return RecordWriter(self, part, entity, shard)
+
+    def entities(self):
+        """
+        List the entities held in the store, in the order they are first read.
+
+        Returns:
+            list: The entity logical names. None stands for untagged records.
+        """
+        entities = []
+        for segment in self.segments:
+            if segment.get('entity') not in entities:
+                entities.append(segment.get('entity'))
+        return entities
+
+    def partition(self, entity):
+        """
+        Get a view of the records of a single entity.
+
+        Args:
+            entity (str): The logical name of the entity.
+
+        Returns:
+            RecordPartition: The records of the entity, in store order.
+        """
+        return RecordPartition(self, entity)
+
+    def partitions(self):
+        """
+        Get a view of the records of every entity.
+
+        Returns:
+            dict: Mapping of entity logical names to their RecordPartition.
+        """
+        return {entity: RecordPartition(self, entity) for entity in self.entities()}
+
+    def _register(self, segment):
+        with self._lock:
+            self.segments.append(segment)
+            self.segments.sort(key=lambda item: (item['part'], item.get('shard', 0), item['seq']))
+            self._save_index()
+
+    def _save_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump({'segments': self.segments}, file)
+        os.replace(index_path + '.tmp', index_path)
+
+    def __len__(self):
+        return sum(segment['count'] for segment in self.segments)
+
+    def __repr__(self):
+        return f"RecordStore({self.path!r}, {len(self)} records in {len(self.segments)} segments)"
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def _open_segment(self, segment):
+        segment_path = os.path.join(self.path, segment['name'])
+        if segment['compressed']:
+            return gzip.open(segment_path, 'rb')
+        return open(segment_path, 'rb')
+
+    def iter_records(self, part=None, entity=ALL_ENTITIES):
+        """
+        Yield every record in store order without loading the whole dataset.
+
+        Args:
+            part (int): Only yield the records written by this part.
+            entity (str): Only yield the records of this entity.
+
+        Yields:
+            dict: The next record.
+        """
+        for segment in list(self.segments):
+            if part is not None and segment['part'] != part:
+                continue
+            if entity is not ALL_ENTITIES and segment.get('entity') != entity:
+                continue
+            with self._open_segment(segment) as file:
+                for line in file:
+                    yield json.loads(line)
+
+    def iter_lines(self, segment, start=0, stop=None):
+        """
+        Yield the encoded records of one segment without decoding them.
+
+        Uncompressed segments seek straight to `start` using the offset index.
+
+        Args:
+            segment (dict): The segment, an entry of `segments`.
+            start (int): Position of the first record within the segment.
+            stop (int): Position after the last record. None reads to the end of the segment.
+
+        Yields:
+            bytes: The next NDJSON line.
+        """
+        with self._open_segment(segment) as file:
+            if start and not segment['compressed']:
+                with open(os.path.join(self.path, segment['name'][:-len('.ndjson')] + '.idx'), 'rb') as index:
+                    index.seek(start * array('Q').itemsize)
+                    file.seek(array('Q', index.read(array('Q').itemsize))[0])
+                yield from islice(file, None if stop is None else stop - start)
+            else:
+                yield from islice(file, start, stop)
+
+    def get(self, offset):
+        """
+        Fetch a single record by its position in the store.
+
+        Uncompressed segments are read through mmap using the offset index;
+        compressed segments are scanned from the start of the segment.
+
+        Args:
+            offset (int): The 0-based position of the record.
+
+        Returns:
+            dict: The record.
+        """
+        starts = []
+        total = 0
+        for segment in self.segments:
+            starts.append(total)
+            total += segment['count']
+        if offset < 0 or offset >= total:
+            raise IndexError(f"Record offset {offset} out of range for store with {total} records.")
+        position = bisect.bisect_right(starts, offset) - 1
+        segment = self.segments[position]
+        local = offset - starts[position]
+
+        if segment['compressed']:
+            with self._open_segment(segment) as file:
+                return json.loads(next(islice(file, local, None)))
+
+        name = segment['name']
+        with self._lock:
+            if name not in self._maps:
+                with open(os.path.join(self.path, name[:-len('.ndjson')] + '.idx'), 'rb') as file:
+                    offsets = array('Q')
+                    offsets.frombytes(file.read())
+                with open(os.path.join(self.path, name), 'rb') as file:
+                    self._maps[name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._offsets[name] = offsets
+        data = self._maps[name]
+        offsets = self._offsets[name]
+        end = offsets[local + 1] if local + 1 < len(offsets) else len(data)
+        return json.loads(data[offsets[local]:end])
+
+    def close(self):
+        """
+        Release any memory maps opened by get().
+        """
+        with self._lock:
+            for data in self._maps.values():
+                data.close()
+            self._maps.clear()
+            self._offsets.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordPartition:
+    """
+    Read-only view of the records of one entity in a RecordStore.
+
+    Args:
+        store (RecordStore): The store holding the records.
+        entity (str): The logical name of the entity.
+    """
+
+    def __init__(self, store, entity):
+        self.store = store
+        self.entity = entity
+
+    def __len__(self):
+        return sum(segment['count'] for segment in self.store.segments if segment.get('entity') == self.entity)
+
+    def __iter__(self):
+        return self.store.iter_records(entity=self.entity)
+
+    def __repr__(self):
+        return f"RecordPartition({self.entity!r}, {len(self)} records)"
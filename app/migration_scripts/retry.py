@@ -0,0 +1,133 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: service protection limits, overload and gateway errors
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Longest pause of a circuit breaker, whatever Retry-After asks for
+MAX_PAUSE = 300
+
+
+def parse_retry_after(value):
+    """
+    Read a Retry-After header.
+
+    Args:
+        value (str): The header value, in seconds or as an HTTP date. May be None.
+
+    Returns:
+        float or None: The seconds to wait, None when the header is missing or unreadable.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    How often and how long to wait before retrying a request.
+
+    Without Retry-After the wait grows exponentially with full jitter, so workers
+    retrying at the same time spread out. With Retry-After the wait is what the
+    service asked for, plus up to `jitter` of it.
+
+    Args:
+        max_attempts (int): Attempts per request, including the first one. 1 disables retries.
+        base_delay (float): Seconds of the first backoff step.
+        max_delay (float): Longest wait between two attempts in seconds.
+        jitter (float): Fraction of Retry-After added at random.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, jitter=0.1):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Compute the wait before the next attempt.
+
+        Args:
+            attempt (int): The 0-based number of the attempt that failed.
+            retry_after (float): The seconds the service asked to wait, if it did.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        if retry_after is not None:
+            return min(retry_after * (1 + random.uniform(0, self.jitter)), MAX_PAUSE)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def __repr__(self):
+        return f"RetryPolicy({self.max_attempts} attempts, {self.base_delay}s base delay, {self.max_delay}s max delay)"
+
+
+class CircuitBreaker:
+    """
+    Pause every request to a Dataverse instance while it signals overload.
+
+    A 429 or 503 response trips the breaker for the wait the service asked for, and
+    every worker sharing the instance's client waits in wait() before its next
+    request, instead of each worker hitting the limit on its own.
+
+    Args:
+        name (str): The instance the breaker protects, used in logs and metrics.
+        max_pause (float): Longest pause in seconds.
+    """
+
+    def __init__(self, name, max_pause=MAX_PAUSE):
+        self.name = name
+        self.max_pause = max_pause
+        self.trips = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self._resume_at
+
+    def trip(self, seconds):
+        """
+        Pause requests for a number of seconds, unless they are already paused for longer.
+
+        Args:
+            seconds (float): The pause.
+        """
+        seconds = min(seconds, self.max_pause)
+        with self._lock:
+            resume_at = time.monotonic() + seconds
+            if resume_at <= self._resume_at:
+                return
+            self._resume_at = resume_at
+            self.trips += 1
+        metrics.CIRCUIT_PAUSES.inc(instance=self.name)
+        logger.warning(f"{self.name} signals overload, pausing all requests for {seconds:.1f} seconds.")
+
+    def wait(self):
+        """
+        Block until requests may be sent again.
+        """
+        while True:
+            remaining = self._resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            metrics.CIRCUIT_PAUSED_SECONDS.inc(remaining, instance=self.name)
+            time.sleep(remaining)
@@ -1,105 +1,161 @@
+import json
 import logging
-from .utilities import load_from_temp_storage, save_to_temp_storage
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from . import metrics
+from .log_utils import Payload, RecordSampler
+from .record_store import RecordStore, encode_record
+from .transform_plan import compile_transform_plan
 
 logger = logging.getLogger(__name__)
 
-def transform_data(temp_storage_file, transformed_storage_file, user_mapping, date_field, date_value, target_db_type):
+# State of a transform worker process, set up once by _init_transform_worker
+_worker = {}
+
+def transform_data(temp_storage_file, transformed_storage_file, user_mapping, date_field, date_value, target_db_type,
+                   compress=False, segment_records=100000, transform_plan=None, chunk_size=10000, job=None, lookups=None,
+                   workers=0):
     """
     Transform the data by updating the owner and date fields based on target database type.
 
+    A transform plan is compiled once for the target database type and applied to
+    chunks of records streamed from the raw record store into the transformed record
+    store, so the full dataset is never held in memory. Records keep the entity
+    partition they were extracted into.
+
+    With more than one worker, the records are split into shards of `chunk_size`
+    records transformed in a process pool. Every worker opens the raw store and
+    compiles the plan once, reads its shards straight from the segments and returns
+    them encoded, and the shards are written back in source order.
+
     Args:
-        temp_storage_file (str): Path to the file with raw data.
-        transformed_storage_file (str): Path to the file where transformed data will be saved.
+        temp_storage_file (str): Path to the record store with raw data.
+        transformed_storage_file (str): Path to the record store where transformed data will be saved.
         user_mapping (dict): Mapping of old user IDs to new user IDs.
         date_field (str): The field name for date.
         date_value (str): The value to set for the date field.
         target_db_type (str): The type of the target database.
+        compress (bool): Whether the transformed record store segments are gzip compressed.
+        segment_records (int): Maximum number of records per record store segment.
+        transform_plan (dict): Overrides for the default transform plan, see transform_plan.DEFAULT_PLANS.
+        chunk_size (int): Number of records transformed per batch.
+        job (MigrationJob): Job receiving progress, checked for cancellation after every chunk.
+        lookups (list): Resolved lookups rewriting reference columns as @odata.bind, see lookups.resolve_lookups.
+        workers (int): Number of worker processes. 0 or 1 transforms in this process.
 
     Returns:
-        list: A list of dictionaries containing the transformed data.
+        RecordStore: The record store holding the transformed data.
     """
     try:
-        raw_data = load_from_temp_storage(temp_storage_file)  # Load raw data from temporary storage
-        logger.info(f"Raw data: {raw_data}")
-        
-        transformed_data = []
-        for item in raw_data:
-            try:
-                if target_db_type == "dynamics365":
-                    transformed_item = transform_for_dynamics365(item, user_mapping, date_field, date_value)
-                else:
-                    transformed_item = transform_for_other_db(item, user_mapping, date_field, date_value)
-                
-                transformed_data.append(transformed_item)  # Add transformed item to the list
-                logger.debug(f"Transformed item: {transformed_item}")
-            except Exception as e:
-                logger.error(f"Error transforming item: {item}, Error: {e}", exc_info=True)
+        raw_data = RecordStore(temp_storage_file)  # Open raw data from temporary storage
+        logger.info("Transforming %d records from %s.", len(raw_data), temp_storage_file)
+
+        plan_args = (transform_plan, user_mapping, date_field, date_value, target_db_type, lookups)
+        plan = compile_transform_plan(*plan_args)
+        transformed_data = RecordStore.create(transformed_storage_file, compress, segment_records)
+        error_sampler = RecordSampler('transform')
+        if job is not None:
+            job.start_stage('transform', len(raw_data))
+        with metrics.track_stage('transform') as stage:
+            if workers > 1:
+                unresolved = _transform_in_processes(raw_data, transformed_data, plan_args, workers, chunk_size, stage, job)
+            else:
+                for part, (entity, partition) in enumerate(raw_data.partitions().items()):
+                    records = iter(partition)
+                    with transformed_data.writer(part, entity) as writer:
+                        for chunk in iter(lambda: list(islice(records, chunk_size)), []):
+                            writer.write_many(_transform_chunk(plan, chunk, entity, error_sampler))  # Add transformed items to the store
+                            stage.records += len(chunk)
+                            if job is not None:
+                                job.advance(len(chunk))
+                                job.check_cancelled()
+                unresolved = plan.unresolved
 
-        save_to_temp_storage(transformed_data, transformed_storage_file)  # Save transformed data to temporary storage
-        logger.info(f"Transformed data: {transformed_data}")
+        for field, count in unresolved.items():
+            logger.warning(f"Dropped {count} {field} references without a match in the target environment.")
         logger.info(f"Transformed {len(transformed_data)} records.")
         return transformed_data
     except Exception as e:
         logger.error(f"Error transforming data: {e}", exc_info=True)
         raise
 
-# transform_data.py
-
-# transform_data.py
-
-def transform_for_dynamics365(item, user_mapping, date_field, date_value):
-    """
-    Transform data for Dynamics 365.
-
-    Args:
-        item (dict): The raw data item.
-        user_mapping (dict): Mapping of old user IDs to new user IDs.
-        date_field (str): The field name for date.
-        date_value (str): The value to set for the date field.
+def _transform_chunk(plan, chunk, entity=None, error_sampler=None):
+    try:
+        return plan.apply_batch(chunk, entity)
+    except Exception:
+        # Retry record by record so a single bad record only drops itself
+        transformed_items = []
+        for item in chunk:
+            try:
+                transformed_items.append(plan.apply(item, entity))
+            except Exception as e:
+                if error_sampler is None or error_sampler.sample():
+                    logger.error("Error transforming item: %s, Error: %s", Payload(item), e, exc_info=True)
+        return transformed_items
 
-    Returns:
-        dict: The transformed data item.
-    """
-    item = item.copy()
-    
-    logical_name = item.get('Item.crmk_itemid') and 'crmk_item' or \
-                   item.get('LandObject.crmk_denominationname') and 'crmk_landobject' or 'crmk_unknown'
-    
-    # Remove properties not applicable to Dynamics 365
-    item.pop('@odata.etag', None)
-    item.pop('Item.crmk_itemid@OData.Community.Display.V1.AttributeName', None)
-    item.pop('LandObject.crmk_denominationname@OData.Community.Display.V1.AttributeName', None)
-    
-    # Add or update necessary fields
-    item["OwnerId"] = user_mapping.get(item.get("owner_id"), user_mapping["default"])
-    
-    if logical_name == 'crmk_plant':
-        item[date_field] = date_value
-        item[date_field] = 'crmk_MigratedOn'
+def _transform_shards(raw_data, shard_size):
+    # (part, entity, segment, start, stop) in the order the records are read
+    for part, entity in enumerate(raw_data.entities()):
+        for segment in raw_data.segments:
+            if segment.get('entity') == entity:
+                for start in range(0, segment['count'], shard_size):
+                    yield part, entity, segment, start, min(start + shard_size, segment['count'])
 
-    # Remove invalid properties
-    item.pop('logical_name', None)
-    item.pop('address1_latitude', None)
-    item.pop('description', None)
-    item.pop('revenue', None)
+def _init_transform_worker(raw_storage_file, plan_args):
+    # Runs once per worker process, so the plan and its mapping tables are only shipped once
+    _worker['raw_data'] = RecordStore(raw_storage_file)
+    _worker['plan'] = compile_transform_plan(*plan_args)
+    _worker['error_sampler'] = RecordSampler('transform')
 
-    logger.debug(f"Transformed item for Dynamics 365: {item}")
-    return item
+def _transform_shard(entity, segment, start, stop):
+    plan = _worker['plan']
+    plan.unresolved.clear()
+    chunk = [json.loads(line) for line in _worker['raw_data'].iter_lines(segment, start, stop)]
+    transformed = _transform_chunk(plan, chunk, entity, _worker['error_sampler'])
+    return len(chunk), b''.join(map(encode_record, transformed)), Counter(plan.unresolved)
 
-def transform_for_other_db(item, user_mapping, date_field, date_value):
+def _transform_in_processes(raw_data, transformed_data, plan_args, workers, shard_size, stage, job=None):
     """
-    Transform data for other target database types.
-
-    Args:
-        item (dict): The raw data item.
-        user_mapping (dict): Mapping of old user IDs to new user IDs.
-        date_field (str): The field name for date.
-        date_value (str): The value to set for the date field.
+    Transform the shards of a raw record store in a process pool, writing them in source order.
 
     Returns:
-        dict: The transformed data item.
+        Counter: The unresolved references of all shards, by source field.
     """
-    transformed_item = item.copy()  # Create a copy of the raw data item
-    transformed_item["owner"] = user_mapping.get(item.get("owner_id"), user_mapping["default"])  # Add owner field
-    transformed_item[date_field] = date_value  # Add date field
-    return transformed_item
+    unresolved = Counter()
+    writer = None
+    pending = deque()
+    shards = _transform_shards(raw_data, shard_size)
+    # Spawned workers do not inherit the threads and locks of a running server
+    context = multiprocessing.get_context('spawn')
+    logger.info(f"Transforming in {workers} worker processes, {shard_size} records per shard.")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_transform_worker,
+                             initargs=(raw_data.path, plan_args)) as executor:
+        try:
+            while True:
+                # Keep every worker busy while results are written in submission order
+                for part, entity, segment, start, stop in islice(shards, workers * 2 - len(pending)):
+                    pending.append((part, entity, executor.submit(_transform_shard, entity, segment, start, stop)))
+                if not pending:
+                    break
+                part, entity, future = pending.popleft()
+                count, data, shard_unresolved = future.result()
+                if writer is None or writer.part != part:
+                    if writer is not None:
+                        writer.close()
+                    writer = transformed_data.writer(part, entity)
+                writer.write_lines(data)
+                unresolved.update(shard_unresolved)
+                stage.records += count
+                if job is not None:
+                    job.advance(count)
+                    job.check_cancelled()
+        except BaseException:
+            for _, _, future in pending:
+                future.cancel()
+            raise
+        finally:
+            if writer is not None:
+                writer.close()
+    return unresolved
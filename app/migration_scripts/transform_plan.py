@@ -0,0 +1,227 @@
+import logging
+from collections import Counter
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+# Plans reproducing the per-record transforms in benchmarks.transform_benchmark. Dates are
+# only stamped on the entities a configured plan enables "stamp_date" for
+DEFAULT_PLANS = {
+    "dynamics365": {
+        "entity_rules": [
+            ["Item.crmk_itemid", "crmk_item"],
+            ["LandObject.crmk_denominationname", "crmk_landobject"],
+        ],
+        "default_entity": "crmk_unknown",
+        "drop_fields": [
+            "@odata.etag",
+            "Item.crmk_itemid@OData.Community.Display.V1.AttributeName",
+            "LandObject.crmk_denominationname@OData.Community.Display.V1.AttributeName",
+            "logical_name",
+            "address1_latitude",
+            "description",
+            "revenue",
+            "modifiedon",
+        ],
+        "rename_fields": {},
+        "annotations": [],
+        "owner_field": "OwnerId",
+        "stamp_date": False,
+        "entities": {},
+    },
+    "other": {
+        "entity_rules": [],
+        "default_entity": None,
+        "drop_fields": [],
+        "rename_fields": {},
+        "annotations": [],
+        "owner_field": "owner",
+        "stamp_date": True,
+        "entities": {},
+    },
+}
+
+# Number of distinct column layouts cached before the cache is reset
+MAX_CACHED_SCHEMAS = 1024
+
+
+class TransformPlan:
+    """
+    Transform plan compiled once from config and applied to every record.
+
+    For every distinct set of columns the plan resolves the entity, the kept
+    columns and their output names once, and then builds each output dict
+    directly from the source values instead of copying and popping.
+
+    Columns with a resolved lookup are replaced by their @odata.bind reference.
+    When the owner column has one, owners missing from it fall back to
+    user_mapping and its "default" within the lookup's first target table.
+
+    Args:
+        plan (dict): The plan configuration, see DEFAULT_PLANS.
+        user_mapping (dict): Mapping of old user IDs to new user IDs, including "default".
+        date_field (str): The field name for date.
+        date_value (str): The value to set for the date field.
+        lookups (list): ResolvedLookup objects of the columns to bind, see lookups.resolve_lookups.
+    """
+
+    def __init__(self, plan, user_mapping, date_field, date_value, lookups=None):
+        self.entity_rules = [tuple(rule) for rule in plan.get("entity_rules", [])]
+        self.default_entity = plan.get("default_entity")
+        self.owner_field = plan.get("owner_field", "OwnerId")
+        self.owner_source_field = plan.get("owner_source_field", "owner_id")
+        self.date_field = date_field
+        self.date_value = date_value
+        self._drop_fields = set(plan.get("drop_fields", []))
+        self._rename_fields = dict(plan.get("rename_fields", {}))
+        self._stamp_date = plan.get("stamp_date", False)
+        self._annotations = list(plan.get("annotations", []))
+        self._entities = plan.get("entities", {})
+        self._owner_lookup = user_mapping.get
+        self._default_owner = user_mapping["default"]
+        self._lookups = list(lookups or [])
+        self._lookup_fields = {lookup.field for lookup in self._lookups}
+        self._bind_owner = self.owner_source_field in self._lookup_fields
+        self.unresolved = Counter()
+        self._schemas = {}
+
+    def entity_settings(self, entity):
+        """
+        Resolve the drops, renames and date stamping that apply to one entity.
+
+        Args:
+            entity (str): The logical name of the entity.
+
+        Returns:
+            tuple: The dropped columns, the column renames and whether to stamp the date field.
+        """
+        settings = self._entities.get(entity, {})
+        drop_fields = self._drop_fields | set(settings.get("drop_fields", []))
+        rename_fields = dict(self._rename_fields, **settings.get("rename_fields", {}))
+        return drop_fields, rename_fields, settings.get("stamp_date", self._stamp_date)
+
+    def required_annotations(self):
+        """
+        List the OData annotations the plan reads from the source records.
+
+        These are the annotations listed under "annotations" in the plan, plus the
+        annotations of columns the plan renames or reads the entity or owner from,
+        e.g. "OData.Community.Display.V1.FormattedValue" for a rename of
+        "statuscode@OData.Community.Display.V1.FormattedValue".
+
+        Returns:
+            list: The annotation names, sorted.
+        """
+        fields = [field for field, _ in self.entity_rules] + [self.owner_source_field] + list(self._rename_fields)
+        for settings in self._entities.values():
+            fields.extend(settings.get("rename_fields", {}))
+        annotations = set(self._annotations)
+        annotations.update(field.split("@", 1)[1] for field in fields if "@" in field)
+        return sorted(annotation for annotation in annotations if annotation)
+
+    def resolve_entity(self, keys):
+        """
+        Resolve the entity of a record from its columns using the entity rules.
+
+        Args:
+            keys (iterable): The columns of the record.
+
+        Returns:
+            str: The logical name of the entity.
+        """
+        for field, entity in self.entity_rules:
+            if field in keys:
+                return entity
+        return self.default_entity
+
+    def _compile_schema(self, cache_key, entity, keys):
+        if entity is None:
+            entity = self.resolve_entity(keys)
+        drop_fields, rename_fields, stamp_date = self.entity_settings(entity)
+        drop_fields |= self._lookup_fields
+        source_keys = [key for key in keys if key not in drop_fields]
+        target_keys = tuple(rename_fields.get(key, key) for key in source_keys)
+        if not source_keys:
+            getter = lambda item: ()
+        elif len(source_keys) == 1:
+            single = source_keys[0]
+            getter = lambda item: (item[single],)
+        else:
+            getter = itemgetter(*source_keys)
+        if len(self._schemas) >= MAX_CACHED_SCHEMAS:
+            self._schemas.clear()
+        compiled = (getter, target_keys, stamp_date)
+        self._schemas[cache_key] = compiled
+        logger.debug(f"Compiled transform schema for entity {entity} with {len(source_keys)} columns.")
+        return compiled
+
+    def apply(self, item, entity=None):
+        """
+        Transform a single record.
+
+        Args:
+            item (dict): The raw data item.
+            entity (str): The source entity of the record. None resolves it from the entity rules.
+
+        Returns:
+            dict: The transformed data item.
+        """
+        keys = tuple(item)
+        cache_key = (entity, keys)
+        compiled = self._schemas.get(cache_key)
+        if compiled is None:
+            compiled = self._compile_schema(cache_key, entity, keys)
+        getter, target_keys, stamp_date = compiled
+        transformed_item = dict(zip(target_keys, getter(item)))
+        if self._lookups:
+            self._bind_lookups(item, transformed_item)
+        if not self._bind_owner:
+            transformed_item[self.owner_field] = self._owner_lookup(item.get(self.owner_source_field), self._default_owner)
+        if stamp_date:
+            transformed_item[self.date_field] = self.date_value
+        return transformed_item
+
+    def _bind_lookups(self, item, transformed_item):
+        for lookup in self._lookups:
+            value = item.get(lookup.field)
+            bind = None if value is None else lookup.get(value)
+            if bind is None and lookup.field == self.owner_source_field:
+                bind = f"/{lookup.entity_set}({self._owner_lookup(value, self._default_owner)})"
+            if bind is not None:
+                transformed_item[lookup.target] = bind
+            elif value is not None:
+                self.unresolved[lookup.field] += 1
+
+    def apply_batch(self, items, entity=None):
+        """
+        Transform a chunk of records.
+
+        Args:
+            items (list): The raw data items.
+            entity (str): The source entity of the records. None resolves it per column layout.
+
+        Returns:
+            list: The transformed data items, in the same order.
+        """
+        apply = self.apply
+        return [apply(item, entity) for item in items]
+
+
+def compile_transform_plan(plan_config, user_mapping, date_field, date_value, target_db_type, lookups=None):
+    """
+    Compile the transform plan for a target database type.
+
+    Args:
+        plan_config (dict): Overrides for the default plan of the target type, or None.
+        user_mapping (dict): Mapping of old user IDs to new user IDs, including "default".
+        date_field (str): The field name for date.
+        date_value (str): The value to set for the date field.
+        target_db_type (str): The type of the target database.
+        lookups (list): ResolvedLookup objects of the columns to bind, or None.
+
+    Returns:
+        TransformPlan: The compiled plan.
+    """
+    plan = dict(DEFAULT_PLANS["dynamics365" if target_db_type == "dynamics365" else "other"])
+    plan.update(plan_config or {})
+    return TransformPlan(plan, user_mapping, date_field, date_value, lookups)
@@ -1,6 +1,9 @@
 import os
 import json
 import logging
+from itertools import islice
+from .record_store import RecordStore
+from .log_utils import Payload, configure_logging
 
 # Create a logger object for this module
 logger = logging.getLogger(__name__)
@@ -33,9 +36,10 @@ def load_from_temp_storage(filename):
         raise
 
 # Function to set up logging configuration
-def setup_logging():
-    # Configure the logging level and format
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+def setup_logging(settings=None):
+    # Configure size-bounded logging written from a background queue listener;
+    # settings is the "logging" section of the configuration, see log_utils.configure_logging
+    configure_logging(**(settings or {}))
     # Log a message indicating successful setup
     logger.info("Logging is set up.")
 
@@ -53,15 +57,16 @@ def load_config(config_file):
         logger.error(f"Error loading configuration file: {e}", exc_info=True)
         raise
 
-# Function to inspect data from a temporary storage file
-def inspect_temp_data(temp_storage_file):
+# Function to inspect data from a temporary record store
+def inspect_temp_data(temp_storage_file, sample_size=5):
     try:
-        # Open the file in read mode and load the data as JSON
-        with open(temp_storage_file, 'r') as file:
-            data = json.load(file)
+        # Open the record store and stream a sample of its records
+        store = RecordStore(temp_storage_file)
         # Log a message indicating the inspection of the data
-        logger.info(f"Inspection of temp data: {data}")
-        return data
+        logger.info(f"Inspection of temp data: {store}")
+        for record in islice(store, sample_size):
+            logger.info("Sample record: %s", Payload(record))
+        return store
     except IOError as e:
         # Log an error message if there's an issue loading the temporary data
         logger.error(f"Error loading temporary data for inspection: {e}", exc_info=True)
@@ -0,0 +1,312 @@
+import re
+import json
+import uuid
+import logging
+from collections import Counter
+from datetime import date, datetime
+from itertools import islice
+from . import metrics
+from .compact_records import json_default
+from .load_data import record_request
+from .metadata import BIND_SUFFIX, LOOKUP_TYPES
+from .record_store import RecordStore
+from .transform_plan import MAX_CACHED_SCHEMAS
+
+logger = logging.getLogger(__name__)
+
+# Columns Dataverse fills itself when a record is created without them
+PLATFORM_FILLED_TYPES = ('Uniqueidentifier', 'Owner', 'State', 'Status', 'Virtual', 'EntityName')
+
+INTEGER_BOUNDS = {'Integer': (-2 ** 31, 2 ** 31 - 1), 'BigInt': (-2 ** 63, 2 ** 63 - 1)}
+
+# "/crmk_plants(<guid>)", "/crmk_plants(crmk_code='A1')" or an absolute URL ending in either
+BIND_PATTERN = re.compile(r"^(?:https?://[^\s]+)?/?[A-Za-z_][A-Za-z0-9_]*\((?:[0-9A-Fa-f]{8}(?:-[0-9A-Fa-f]{4}){3}-[0-9A-Fa-f]{12}"
+                          r"|[A-Za-z_][A-Za-z0-9_]*=[^()]+(?:,[A-Za-z_][A-Za-z0-9_]*=[^()]+)*)\)$")
+
+# Errors listed per table in the validation summary
+SUMMARY_ERRORS = 5
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_uuid(value):
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return 'is not a GUID'
+    return None
+
+
+def _check_datetime(value):
+    if not isinstance(value, str):
+        return 'is not an ISO 8601 date'
+    try:
+        if len(value) == 10:
+            date.fromisoformat(value)
+        else:
+            datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return 'is not an ISO 8601 date'
+    return None
+
+
+def _column_check(attribute_type, constraints):
+    """
+    Build the function checking a non-null value of a column.
+
+    Args:
+        attribute_type (str): The AttributeType of the column.
+        constraints (dict): The constraints of the column, see MetadataCache.constraints.
+
+    Returns:
+        function: Returns the error of a value, or None when it is valid.
+    """
+    max_length = constraints.get('max_length')
+    options = set(constraints.get('options') or ())
+    low, high = constraints.get('min'), constraints.get('max')
+    if attribute_type in INTEGER_BOUNDS:
+        default_low, default_high = INTEGER_BOUNDS[attribute_type]
+        low = default_low if low is None else low
+        high = default_high if high is None else high
+
+    def check_bounds(value):
+        if low is not None and value < low:
+            return f'is below the minimum {low}'
+        if high is not None and value > high:
+            return f'is above the maximum {high}'
+        return None
+
+    if attribute_type in ('String', 'Memo'):
+        def check(value):
+            if not isinstance(value, str):
+                return 'is not a string'
+            if max_length is not None and len(value) > max_length:
+                return f'exceeds the maximum length {max_length}'
+            return None
+    elif attribute_type in INTEGER_BOUNDS:
+        def check(value):
+            if not isinstance(value, int) or isinstance(value, bool):
+                return 'is not an integer'
+            return check_bounds(value)
+    elif attribute_type in ('Decimal', 'Double', 'Money'):
+        def check(value):
+            if not _is_number(value):
+                return 'is not a number'
+            return check_bounds(value)
+    elif attribute_type == 'Boolean':
+        def check(value):
+            return None if isinstance(value, bool) else 'is not a boolean'
+    elif attribute_type == 'DateTime':
+        check = _check_datetime
+    elif attribute_type == 'Uniqueidentifier':
+        check = _check_uuid
+    elif attribute_type in ('Picklist', 'State', 'Status'):
+        def check(value):
+            if not isinstance(value, int) or isinstance(value, bool):
+                return 'is not an option value'
+            if options and value not in options:
+                return 'is not a valid option'
+            return None
+    elif attribute_type == 'MultiSelectPicklist':
+        def check(value):
+            try:
+                values = [int(part) for part in str(value).split(',')]
+            except ValueError:
+                return 'is not a list of option values'
+            if options and not options.issuperset(values):
+                return 'is not a valid option'
+            return None
+    elif attribute_type in LOOKUP_TYPES:
+        def check(value):
+            return f'must be set with {BIND_SUFFIX}'
+    else:
+        def check(value):
+            return None
+    return check
+
+
+def _check_bind(value):
+    if not isinstance(value, str) or not BIND_PATTERN.match(value):
+        return 'is not an entity reference like /<entity set>(<id>)'
+    return None
+
+
+class RecordValidator:
+    """
+    Checks the records of one table against the attribute definitions of the target.
+
+    Columns are checked for their type, maximum length, numeric bounds, option set
+    values and required level, and @odata.bind references for their format and for
+    naming a lookup of the table. The checks of every distinct set of columns are
+    compiled once and reused for the following records with the same columns.
+
+    Args:
+        entity (EntityMetadata): The definition of the target table.
+        constraints (dict): The column constraints, see MetadataCache.constraints.
+        upsert (bool): Whether records are upserted, see load_data.record_request.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+    """
+
+    def __init__(self, entity, constraints, upsert=False, upsert_keys=None):
+        self.entity = entity
+        self.constraints = constraints
+        self.upsert = upsert
+        self.upsert_keys = upsert_keys
+        self._checks = {attribute: _column_check(attribute_type, constraints.get(attribute, {}))
+                        for attribute, attribute_type in entity.attributes.items()}
+        # Lookups by navigation property, which differs from the column name in case only
+        self._lookups = {attribute.lower(): attribute for attribute, attribute_type in entity.attributes.items()
+                         if attribute_type in LOOKUP_TYPES}
+        self._required = [attribute for attribute, attribute_type in entity.attributes.items()
+                          if constraints.get(attribute, {}).get('required') and constraints[attribute].get('create', True)
+                          and attribute_type not in PLATFORM_FILLED_TYPES and attribute != entity.primary_id]
+        self._schemas = {}
+
+    def _compile_schema(self, keys):
+        errors = []
+        checks = []
+        lookups = set()
+        for key in keys:
+            if key == 'logical_name':
+                continue
+            if key.endswith(BIND_SUFFIX):
+                lookup = self._lookups.get(key[:-len(BIND_SUFFIX)].lower())
+                if lookup is None:
+                    errors.append(f'{key}: is not a lookup of {self.entity.logical_name}')
+                else:
+                    lookups.add(lookup)
+                    checks.append((key, _check_bind, {}))
+            elif '@' in key:
+                continue  # Instance annotations such as @odata.etag are not columns
+            elif key not in self._checks:
+                errors.append(f'{key}: is not a column of {self.entity.logical_name}')
+            else:
+                checks.append((key, self._checks[key], self.constraints.get(key, {})))
+        missing = [attribute for attribute in self._required if attribute not in keys and attribute not in lookups]
+        return errors, checks, missing
+
+    def validate(self, record):
+        """
+        Check one record.
+
+        Args:
+            record (dict): The record, as it will be written.
+
+        Returns:
+            list: The errors of the record, empty when it is valid.
+        """
+        keys = tuple(record)
+        schema = self._schemas.get(keys)
+        if schema is None:
+            if len(self._schemas) >= MAX_CACHED_SCHEMAS:
+                self._schemas.clear()
+            schema = self._schemas[keys] = self._compile_schema(keys)
+        static_errors, checks, missing = schema
+        errors = list(static_errors)
+        creates = record_request(self.entity, record, self.upsert, self.upsert_keys)[0] == 'POST'
+        for key, check, constraints in checks:
+            value = record[key]
+            if value is None and check is _check_bind:
+                errors.append(f'{key}: cannot be null, the reference is removed with a disassociate request')
+                continue
+            if value is None:
+                if constraints.get('required'):
+                    errors.append(f'{key}: is required')
+                continue
+            error = check(value)
+            if error is not None:
+                errors.append(f'{key}: {error}')
+            elif not constraints.get('create', True) and (creates or not constraints.get('update', True)):
+                errors.append(f'{key}: cannot be set when the record is {"created" if creates else "updated"}')
+        if creates:
+            errors.extend(f'{attribute}: is required' for attribute in missing)
+        return errors
+
+    def validate_batch(self, records):
+        """
+        Check a batch of records.
+
+        Args:
+            records (list): The records.
+
+        Returns:
+            tuple: The valid records, and (position, record, errors) tuples of the invalid ones.
+        """
+        valid = []
+        rejects = []
+        for position, record in enumerate(records):
+            errors = self.validate(record)
+            if errors:
+                rejects.append((position, record, errors))
+            else:
+                valid.append(record)
+        return valid, rejects
+
+
+def validate_data(transformed_storage_file, validated_storage_file, client, metadata, tables, rejects_file,
+                  upsert=False, upsert_keys=None, compress=False, segment_records=100000, chunk_size=10000, job=None):
+    """
+    Check the transformed records against the target attribute definitions before they are loaded.
+
+    Records are validated in batches of `chunk_size` against cached metadata, so no
+    request is sent for them. Valid records are written to a new record store, and
+    invalid ones to an NDJSON rejects file with their errors, so they never reach the
+    target. Records of tables that are not loaded are left out.
+
+    Args:
+        transformed_storage_file (str): Path to the record store with transformed data.
+        validated_storage_file (str): Path to the record store where the valid records will be saved.
+        client (DataverseClient): The client for the target instance, used for metadata not cached yet.
+        metadata (MetadataCache): Entity definitions of the target instance.
+        tables (iterable): The logical names of the tables to load.
+        rejects_file (str): Path of the NDJSON file receiving the invalid records.
+        upsert (bool): Whether records are upserted, which does not require every required column.
+        upsert_keys (dict): Mapping of table logical names to alternate key columns.
+        compress (bool): Whether the validated record store segments are gzip compressed.
+        segment_records (int): Maximum number of records per record store segment.
+        chunk_size (int): Number of records validated per batch.
+        job (MigrationJob): Job receiving progress, checked for cancellation after every batch.
+
+    Returns:
+        RecordStore: The record store holding the valid records.
+    """
+    transformed_data = RecordStore(transformed_storage_file)
+    partitions = transformed_data.partitions()
+    tables = [table for table in tables if table in partitions]
+    metadata.prefetch(client, tables)
+    validated_data = RecordStore.create(validated_storage_file, compress, segment_records)
+    if job is not None:
+        job.start_stage('validate', sum(len(partitions[table]) for table in tables))
+    rejected = 0
+    with metrics.track_stage('validate') as stage, open(rejects_file, 'w', encoding='utf-8') as rejects_out:
+        for part, table in enumerate(tables):
+            validator = RecordValidator(metadata.entity(client, table), metadata.constraints(client, table), upsert, upsert_keys)
+            errors_seen = Counter()
+            records = iter(partitions[table])
+            offset = 0
+            with validated_data.writer(part, table) as writer:
+                for chunk in iter(lambda: list(islice(records, chunk_size)), []):
+                    valid, rejects = validator.validate_batch(chunk)
+                    writer.write_many(valid)
+                    for position, record, errors in rejects:
+                        rejects_out.write(json.dumps({'entity': table, 'index': offset + position, 'errors': errors,
+                                                      'record': record}, default=json_default) + '\n')
+                        errors_seen.update(errors)
+                    offset += len(chunk)
+                    stage.records += len(chunk)
+                    if job is not None:
+                        job.advance(len(chunk))
+                        job.check_cancelled()
+            table_rejected = offset - writer.count
+            rejected += table_rejected
+            if table_rejected:
+                summary = '; '.join(f"{error} ({count})" for error, count in errors_seen.most_common(SUMMARY_ERRORS))
+                logger.warning(f"Rejected {table_rejected} of {offset} {table} records before the load: {summary}")
+
+    skipped = [entity for entity in partitions if entity not in tables]
+    if skipped:
+        logger.info(f"Skipped validation of {', '.join(map(str, skipped))}, which are not loaded.")
+    logger.info(f"Validated {len(validated_data)} records, rejected {rejected} to {rejects_file}.")
+    return validated_data
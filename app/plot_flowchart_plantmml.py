@@ -8,8 +8,8 @@ steps = [
     ("AuthSource", "Authenticate to Source Dataverse\n(Functions: get_access_token)"),
     ("AuthTarget", "Authenticate to Target Dataverse\n(Functions: get_access_token)"),
     ("ReadFetchXML", "Read FetchXML Queries\n(Functions: load_fetchxml_queries, read_fetchxml)"),
-    ("ExtractData", "Extract Data from Source\n(Functions: execute_fetchxml_query, extract_entity_name, pluralize_entity_name)"),
-    ("TransformData", "Transform Data\n(Functions: transform_data, transform_for_dynamics365, transform_for_other_db)"),
+    ("ExtractData", "Extract Data from Source\n(Functions: execute_fetchxml_query, extract_entity_name, MetadataCache.entity)"),
+    ("TransformData", "Transform Data\n(Functions: transform_data, compile_transform_plan)"),
     ("InspectData", "Inspect Transformed Data\n(Functions: inspect_temp_data)"),
     ("LoadData", "Load Data to Target\n(Functions: load_data_to_target)"),
     ("CompleteMigration", "Complete Migration Process\n(Confirmation provided)")
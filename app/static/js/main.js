@@ -29,3 +29,71 @@ document.addEventListener('DOMContentLoaded', function () {
         console.error('Failed to load data from /api/queries:', error);
     });
 });
+
+// Run migrations as background jobs and show their progress live
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.getElementById('migrateForm');
+    const panel = document.getElementById('jobProgress');
+    const cancelButton = document.getElementById('cancelJob');
+    if (!form || !panel) {
+        return;
+    }
+    let currentJobId = null;
+
+    function render(job) {
+        const stage = job.stage ? job.stages[job.stage] : null;
+        document.getElementById('jobId').textContent = job.id;
+        document.getElementById('jobStatus').textContent = job.status;
+        document.getElementById('jobStage').textContent = job.stage ? `(${job.stage})` : '';
+        const bar = document.getElementById('jobBar');
+        if (stage && stage.total) {
+            bar.value = Math.min(100, 100 * stage.processed / stage.total);
+        } else {
+            bar.removeAttribute('value');  // Indeterminate while the total is unknown
+        }
+        let details = stage ? `${stage.processed}${stage.total ? ' / ' + stage.total : ''} records, ${stage.throughput} records/s` : '';
+        if (stage && stage.eta !== null) {
+            details += `, ETA ${Math.round(stage.eta)} s`;
+        }
+        if (job.error) {
+            details = `Error: ${job.error}`;
+        }
+        document.getElementById('jobDetails').textContent = details;
+        cancelButton.disabled = job.status !== 'running';
+        if (job.status === 'completed') {
+            bar.value = 100;
+        }
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        fetch(form.action, { method: 'POST', body: new FormData(form) })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            currentJobId = data.job_id;
+            panel.hidden = false;
+            const events = new EventSource(`/jobs/${currentJobId}/events`);
+            events.onmessage = function (message) {
+                const job = JSON.parse(message.data);
+                render(job);
+                if (job.status !== 'running') {
+                    events.close();
+                }
+            };
+        })
+        .catch(error => {
+            console.error('Failed to start migration:', error);
+        });
+    });
+
+    cancelButton.addEventListener('click', function () {
+        if (currentJobId) {
+            fetch(`/jobs/${currentJobId}/cancel`, { method: 'POST' });
+        }
+    });
+});
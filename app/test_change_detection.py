@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from benchmarks.mock_dataverse import MockDataverse, make_record
+from migration_scripts import get_client, load_data_to_target
+from migration_scripts.change_detection import CHANGES_FROM_JOURNAL, CHANGES_FROM_TARGET, detect_changes
+from migration_scripts.load_journal import LoadJournal
+from migration_scripts.load_schedule import plan_load_schedule
+from migration_scripts.metadata import MetadataCache
+from migration_scripts.record_hash import content_hash
+from migration_scripts.record_store import RecordStore
+
+ATTRIBUTES = {'crmk_plantid': 'Uniqueidentifier', 'createdon': 'DateTime', 'ownerid': 'Owner', 'revenue': 'Money'}
+COLUMNS = ('crmk_plantid', 'crmk_primaryname', 'crmk_projectshortname', 'createdon')
+
+
+def plant(index, **changes):
+    record = {column: value for column, value in make_record('crmk_plant', index).items() if column in COLUMNS}
+    record.update(changes)
+    return record
+
+
+class TestContentHash(unittest.TestCase):
+
+    def test_hash_ignores_column_order_and_representation(self):
+        record = {'crmk_plantid': 'ABC', 'createdon': '2024-01-01T02:00:00+02:00', 'revenue': 10,
+                  'ownerid@odata.bind': '/systemusers(AAAA)', '@odata.etag': 'W/"1"', 'logical_name': 'crmk_plant'}
+        same = {'ownerid': 'aaaa', 'revenue': 10.0, 'createdon': '2024-01-01T00:00:00Z', 'crmk_plantid': 'abc'}
+
+        self.assertEqual(content_hash(record, ATTRIBUTES), content_hash(same, ATTRIBUTES))
+        self.assertNotEqual(content_hash(record, ATTRIBUTES), content_hash(dict(same, revenue=11), ATTRIBUTES))
+        self.assertEqual(len(content_hash(record)), 32)
+
+
+class TestChangeDetection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=5).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataCache(self.mock.base_url)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def store(self, records):
+        with RecordStore.create(self.path('transformed')).writer(0, 'crmk_plant') as writer:
+            writer.write_many(records)
+        return self.path('transformed')
+
+    def test_records_committed_unchanged_are_skipped(self):
+        records = [plant(index) for index in range(4)]
+        with LoadJournal(self.path('journal.db')) as journal:
+            load_data_to_target({'crmk_plant': records}, self.mock.base_url, {'crmk_plant': 1}, self.client, batch_size=2,
+                                journal=journal, metadata=self.metadata)
+            rerun = [dict(reversed(list(records[0].items()))), plant(1, crmk_primaryname='Renamed'), records[2], records[3], plant(7)]
+
+            changed = detect_changes(self.store(rerun), self.path('changed'), self.client, self.metadata, ['crmk_plant'],
+                                     CHANGES_FROM_JOURNAL, journal, chunk_size=2)
+
+        self.assertEqual(list(changed), [rerun[1], rerun[4]])
+
+    def test_records_with_deferred_lookups_are_hashed_whole(self):
+        records = [plant(index, **{'crmk_ParentId@odata.bind': f'/crmk_plants({plant(index + 1)["crmk_plantid"]})'}) for index in range(3)]
+        with LoadJournal(self.path('journal.db')) as journal:
+            schedule = plan_load_schedule({'crmk_plant': records}, ['crmk_plant'], [], self.metadata, self.client)
+            load_data_to_target({'crmk_plant': records}, self.mock.base_url, {'crmk_plant': 1}, self.client, batch_size=2,
+                                journal=journal, metadata=self.metadata, schedule=schedule)
+
+            changed = detect_changes(self.store(records), self.path('changed'), self.client, self.metadata, ['crmk_plant'],
+                                     CHANGES_FROM_JOURNAL, journal)
+
+        self.assertEqual(schedule.deferred, {'crmk_plant': {'crmk_ParentId@odata.bind'}})
+        self.assertEqual(list(changed), [])
+
+    def test_records_are_compared_with_a_target_projection(self):
+        pages = self.mock.stats['pages']
+        rerun = [plant(0), plant(1, crmk_projectshortname='999'), plant(2, createdon='2024-01-01T02:00:02+02:00'),
+                 plant(3, OwnerId='new_user'), plant(4), plant(7)]
+
+        changed = detect_changes(self.store(rerun), self.path('changed'), self.client, self.metadata, ['crmk_plant'],
+                                 CHANGES_FROM_TARGET, page_size=2)
+
+        self.assertEqual(self.mock.stats['pages'] - pages, 3)
+        self.assertEqual(list(changed), [rerun[1], rerun[3], rerun[5]])
+
+    def test_journal_source_requires_a_journal(self):
+        with self.assertRaises(ValueError):
+            detect_changes(self.store([]), self.path('changed'), self.client, self.metadata, ['crmk_plant'])
+
+    def test_journals_without_hashes_are_upgraded(self):
+        connection = sqlite3.connect(self.path('old.db'))
+        connection.execute("CREATE TABLE load_journal (target_table TEXT NOT NULL, source_id TEXT, status TEXT NOT NULL,"
+                           " status_code INTEGER, response TEXT, updated_at TEXT NOT NULL, UNIQUE (target_table, source_id))")
+        connection.execute("INSERT INTO load_journal VALUES ('crmk_plant', 'p1', 'committed', 204, '', '2024-01-01')")
+        connection.commit()
+        connection.close()
+
+        with LoadJournal(self.path('old.db')) as journal:
+            journal.record('crmk_plant', 'p2', 'committed', 204, content_hash='hash')
+            self.assertEqual(journal.committed_ids('crmk_plant'), {'p1', 'p2'})
+            self.assertEqual(journal.committed_hashes('crmk_plant'), {'p2': 'hash'})
+
+
+if __name__ == '__main__':
+    unittest.main()
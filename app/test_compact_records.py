@@ -0,0 +1,116 @@
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import get_client, load_data_to_target
+from migration_scripts.compact_records import CompactRecord, RecordTable, json_default
+from migration_scripts import load_data
+from migration_scripts.load_data import DeferredLookups
+from migration_scripts.metadata import MetadataCache
+from migration_scripts.record_store import RecordStore
+
+RECORDS = [
+    json.loads('{"crmk_itemid": "1", "crmk_name": "First", "statecode": 0}'),
+    json.loads('{"crmk_itemid": "2", "crmk_name": "Second", "statecode": 1}'),
+    json.loads('{"crmk_itemid": "3", "crmk_name": null}'),
+]
+
+
+class TestRecordTable(unittest.TestCase):
+
+    def test_records_with_the_same_columns_share_one_schema(self):
+        table = RecordTable(RECORDS, 'crmk_item')
+
+        self.assertEqual(len(table.schemas), 2)
+        self.assertIs(table[0].schema, table[1].schema)
+        first, second = (next(iter(record)) for record in table[:2])
+        self.assertIs(first, second)
+
+    def test_records_read_like_dicts(self):
+        table = RecordTable(RECORDS)
+        record = table[0]
+
+        self.assertIsInstance(record, CompactRecord)
+        self.assertEqual(record, RECORDS[0])
+        self.assertEqual(record['crmk_name'], 'First')
+        self.assertEqual(record.get('missing', 'default'), 'default')
+        self.assertIn('statecode', record)
+        self.assertNotIn('statecode', table[2])
+        self.assertEqual(dict(record.items()), RECORDS[0])
+        self.assertEqual(list(record.values()), list(RECORDS[0].values()))
+        self.assertEqual(table, RECORDS)
+        self.assertEqual(list(table.to_dicts()), RECORDS)
+
+    def test_slices_and_appends(self):
+        table = RecordTable(entity='crmk_item')
+        table.extend(RECORDS[:2])
+        table.append(RECORDS[2])
+        table.append(table[0])
+
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table[1:3], RECORDS[1:3])
+        self.assertIsInstance(table[1:3], list)
+        self.assertEqual(len(table.schemas), 2)
+
+    def test_records_serialize_like_dicts(self):
+        table = RecordTable(RECORDS)
+
+        self.assertEqual(json.dumps(list(table), default=json_default), json.dumps(RECORDS))
+        with self.assertRaises(TypeError):
+            json.dumps({'value': object()}, default=json_default)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = RecordStore.create(temp_dir)
+            with store.writer(0, 'crmk_item') as writer:
+                writer.write_many(table)
+            self.assertEqual(list(store.iter_records(entity='crmk_item')), RECORDS)
+
+    def test_deferred_lookups_are_held_compactly(self):
+        deferred = DeferredLookups('crmk_item', {'a@odata.bind'}, ['id'])
+        records = [{'id': index, 'name': str(index), 'a@odata.bind': f'/as({index})'} for index in range(3)] + [{'id': 3}]
+
+        self.assertEqual([deferred.strip(record) for record in records],
+                         [{'id': index, 'name': str(index)} for index in range(3)] + [{'id': 3}])
+        self.assertEqual(deferred.records, [{'id': index, 'a@odata.bind': f'/as({index})'} for index in range(3)])
+        self.assertEqual(len(deferred.records.schemas), 1)
+
+
+class TestCompactLoad(unittest.TestCase):
+
+    def test_load_compact_records(self):
+        data = {'crmk_item': RecordTable([dict(record, logical_name='crmk_item') for record in RECORDS], 'crmk_item')}
+        with MockDataverse(rows=1) as dataverse:
+            client = get_client('client', 'secret', 'tenant', dataverse.base_url, authority_host=dataverse.base_url)
+            load_data_to_target(data, dataverse.base_url, {'crmk_item': 1}, client, batch_size=2,
+                                metadata=MetadataCache(dataverse.base_url))
+            stats = dict(dataverse.stats)
+
+        self.assertEqual(stats['writes'], 3)
+        self.assertEqual(stats['batches'], 2)
+        self.assertIn('logical_name', data['crmk_item'][0])
+
+    def test_tables_are_read_one_batch_at_a_time(self):
+        read = []
+        sent = []
+
+        def records():
+            for index, record in enumerate(RECORDS):
+                read.append(index)
+                yield record
+
+        def post_batch(*args, **kwargs):
+            sent.append(list(read))
+            return original_post_batch(*args, **kwargs)
+
+        original_post_batch = load_data.post_batch
+        with MockDataverse(rows=1) as dataverse, mock.patch.object(load_data, 'post_batch', side_effect=post_batch):
+            client = get_client('client', 'secret', 'tenant', dataverse.base_url, authority_host=dataverse.base_url)
+            load_data.load_table(client, 'crmk_item', records(), batch_size=2, metadata=MetadataCache(dataverse.base_url))
+
+        self.assertEqual(sent, [[0, 1], [0, 1, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
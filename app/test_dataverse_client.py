@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from migration_scripts import dataverse_client
+from migration_scripts.dataverse_client import DataverseClient, TokenCache, get_client
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = b''
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def test_tokens_are_cached_per_resource_until_refresh_margin(self):
+        responses = iter([
+            {'access_token': 'a1', 'expires_in': 3600},
+            {'access_token': 'b1', 'expires_in': 3600},
+            {'access_token': 'a2', 'expires_in': 3600},
+        ])
+        cache = TokenCache('client', 'secret', 'tenant', refresh_margin=300)
+
+        with mock.patch.object(dataverse_client, 'request_access_token', side_effect=lambda *args: next(responses)) as request, \
+                mock.patch.object(dataverse_client.time, 'monotonic', return_value=1000):
+            self.assertEqual(cache.get_token('https://a'), 'a1')
+            self.assertEqual(cache.get_token('https://a'), 'a1')
+            self.assertEqual(cache.get_token('https://b'), 'b1')
+            self.assertEqual(request.call_count, 2)
+
+        with mock.patch.object(dataverse_client, 'request_access_token', side_effect=lambda *args: next(responses)), \
+                mock.patch.object(dataverse_client.time, 'monotonic', return_value=1000 + 3600 - 299):
+            self.assertEqual(cache.get_token('https://a'), 'a2')
+
+
+class TestDataverseClient(unittest.TestCase):
+
+    def test_rejected_token_is_refreshed_once(self):
+        cache = TokenCache('client', 'secret', 'tenant')
+        tokens = iter(['old', 'new'])
+        sent = []
+
+        def fake_request(method, url, headers=None, **kwargs):
+            sent.append(headers['Authorization'])
+            return FakeResponse(401 if headers['Authorization'] == 'Bearer old' else 200)
+
+        with mock.patch.object(dataverse_client, 'request_access_token', side_effect=lambda *args: {'access_token': next(tokens)}), \
+                mock.patch.object(requests.Session, 'request', side_effect=fake_request):
+            response = DataverseClient('https://org/', cache).get('api/data/v9.1/accounts')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sent, ['Bearer old', 'Bearer new'])
+
+    def test_requests_time_out_unless_overridden(self):
+        client = DataverseClient('https://org', access_token='token', timeout=(5, 60))
+
+        with mock.patch.object(requests.Session, 'request', return_value=FakeResponse(200)) as request:
+            client.get('api/data/v9.1/accounts')
+            client.post('api/data/v9.1/$batch', data=b'', timeout=300)
+
+        self.assertEqual([call.kwargs['timeout'] for call in request.call_args_list], [(5, 60), 300])
+        self.assertEqual(DataverseClient('https://org', access_token='token').timeout, dataverse_client.DEFAULT_TIMEOUT)
+
+    def test_streamed_responses_hold_their_slot_until_closed(self):
+        governor = mock.Mock()
+        client = DataverseClient('https://org', access_token='token', governor=governor)
+
+        with mock.patch.object(requests.Session, 'request', side_effect=lambda *args, **kwargs: FakeResponse(200)):
+            client.get('api/data/v9.1/accounts')
+            self.assertEqual(governor.release.call_count, 1)
+            response = client.get('api/data/v9.1/accounts', stream=True)
+
+        self.assertEqual(governor.release.call_count, 1)
+        response.close()
+        response.close()
+        self.assertEqual(governor.release.call_count, 2)
+        governor.release.assert_called_with(response)
+
+    def test_shared_client_pool_is_resized(self):
+        client = get_client('client', 'secret', 'tenant', 'https://pooled-org', pool_maxsize=4)
+        self.assertIs(get_client('client', 'secret', 'tenant', 'https://pooled-org', pool_maxsize=8), client)
+
+        adapter = client.session.get_adapter('https://pooled-org')
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 8)
+        self.assertEqual(client.pool_size, (10, 8))
+
+    def test_session_sends_default_odata_headers(self):
+        client = DataverseClient('https://org', access_token='token')
+        self.assertEqual(client.session.headers['OData-Version'], '4.0')
+        self.assertEqual(client.url('api/data/v9.1/accounts'), 'https://org/api/data/v9.1/accounts')
+        self.assertEqual(client.get_token(), 'token')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from urllib.parse import unquote
+
+import requests
+
+from migration_scripts.extract_data_logic import execute_fetchxml_query, get_fetchxml_page_size, set_fetchxml_page
+from migration_scripts.metadata import EntityMetadata, MetadataCache
+from migration_scripts.record_store import RecordStore
+
+
+PLANT_QUERY = '<fetch><entity name="crmk_plant"><attribute name="crmk_plantid" /></entity></fetch>'
+ITEM_QUERY = '<fetch><entity name="crmk_item"><attribute name="crmk_itemid" /></entity></fetch>'
+PAGED_QUERY = '<fetch count="2"><entity name="crmk_item"><attribute name="crmk_itemid" /></entity></fetch>'
+
+
+class FakeResponse:
+
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.content = json.dumps(payload).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def table_metadata(*tables):
+    metadata = MetadataCache('https://org')
+    for table in tables:
+        metadata.put(EntityMetadata(table, f'{table}s', f'{table}id'))
+    return metadata
+
+
+class TestExecuteFetchXmlQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_file = os.path.join(self.temp_dir.name, 'temp_data')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_records_are_grouped_in_query_order(self):
+        pages = {
+            'crmk_plants': [{'value': [{'id': 'p1'}], '@odata.nextLink': 'https://org/next-plants'}],
+            'next-plants': [{'value': [{'id': 'p2'}]}],
+            'crmk_items': [{'value': [{'id': 'i1'}]}],
+        }
+
+        def fake_get(method, url, headers=None, **kwargs):
+            key = url.split('/')[-1] if '/next-' in url else url.split('/api/data/v9.1/')[1].split('?')[0]
+            return FakeResponse(pages[key].pop(0))
+
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_get):
+            data = execute_fetchxml_query('token', [PLANT_QUERY, ITEM_QUERY], 'https://org', self.temp_file, max_workers=2,
+                                          metadata=table_metadata('crmk_plant', 'crmk_item'))
+
+        self.assertEqual([item['id'] for item in data], ['p1', 'p2', 'i1'])
+        self.assertEqual(list(RecordStore(self.temp_file)), list(data))
+        self.assertEqual([record['id'] for record in data.partition('crmk_item')], ['i1'])
+
+    def test_prefetch_pages_by_number(self):
+        requested_pages = []
+
+        def fake_get(method, url, headers=None, **kwargs):
+            page = int(unquote(url).split('page="')[1].split('"')[0])
+            requested_pages.append(page)
+            records = [{'id': f'{page}-{index}'} for index in range(2 if page < 3 else 1)] if page <= 3 else []
+            return FakeResponse({'value': records})
+
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_get):
+            data = execute_fetchxml_query('token', [PAGED_QUERY], 'https://org', self.temp_file, prefetch_pages=2,
+                                          metadata=table_metadata('crmk_item'))
+
+        self.assertEqual([item['id'] for item in data], ['1-0', '1-1', '2-0', '2-1', '3-0'])
+        self.assertEqual(sorted(requested_pages), [1, 2, 3, 4])
+
+    def test_page_size_requires_count_without_paging_cookie(self):
+        self.assertEqual(get_fetchxml_page_size(PAGED_QUERY), 2)
+        self.assertIsNone(get_fetchxml_page_size(PLANT_QUERY))
+        self.assertIsNone(get_fetchxml_page_size(set_fetchxml_page(PAGED_QUERY, 2).replace('<fetch ', '<fetch paging-cookie="x" ')))
+
+
+if __name__ == '__main__':
+    unittest.main()
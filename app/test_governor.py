@@ -0,0 +1,106 @@
+import time
+import threading
+import unittest
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import get_client
+from migration_scripts.governor import CONCURRENCY_LIMIT_CODE, RequestGovernor
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None, code=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.code = code
+
+    def json(self):
+        return {'error': {'code': self.code}}
+
+
+class TestRequestGovernor(unittest.TestCase):
+
+    def test_token_bucket_limits_the_rate(self):
+        governor = RequestGovernor('https://org.crm4.dynamics.com', max_rate=20, max_concurrency=4)
+        started = time.monotonic()
+        for _ in range(30):
+            governor.acquire()
+            governor.release()
+
+        # 20 requests go out at once, the next 10 at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+    def test_concurrency_is_limited(self):
+        governor = RequestGovernor('https://org.crm4.dynamics.com', max_rate=1000, max_concurrency=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def request():
+            governor.acquire()
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.pop()
+            governor.release(FakeResponse(204))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(peak), 2)
+
+    def test_rate_halves_on_throttling_and_grows_back(self):
+        governor = RequestGovernor('https://org.crm4.dynamics.com', max_rate=20, max_concurrency=8)
+        for _ in range(3):
+            governor.acquire()
+            governor.release(FakeResponse(429))
+        self.assertEqual(governor.rate, 10)
+        self.assertEqual(governor.throttled, 3)
+
+        for _ in range(10):
+            governor.acquire()
+            governor.release(FakeResponse(204))
+        rate = governor.rate
+        self.assertTrue(10.9 < rate < 11)
+
+        governor.acquire()
+        governor._decreased_at = 0
+        governor.release(FakeResponse(429, code=CONCURRENCY_LIMIT_CODE))
+        self.assertEqual((governor.rate, governor.concurrency), (rate, 4))
+
+    def test_remaining_limits_cap_the_rate(self):
+        governor = RequestGovernor('https://org.crm4.dynamics.com', max_rate=20, max_concurrency=8)
+        for remaining in ('6,000', '3,000', '600'):
+            governor.acquire()
+            governor.release(FakeResponse(204, {'x-ms-ratelimit-burst-remaining-xrm-requests': remaining}))
+            self.assertEqual(governor.ceiling, None if remaining != '600' else 10)
+        self.assertEqual(governor.current_rate, 10)
+
+        governor.acquire()
+        governor.release(FakeResponse(429))
+        governor.acquire()
+        governor.release(FakeResponse(204, {'x-ms-ratelimit-time-remaining-xrm-requests': '1,200',
+                                            'x-ms-ratelimit-burst-remaining-xrm-requests': '5,000'}))
+        self.assertIsNone(governor.ceiling)
+        self.assertEqual(governor.rate, 20)
+
+    def test_clients_of_an_instance_share_one_governor(self):
+        with MockDataverse(rows=5, request_limit=100, limit_window=60) as limited:
+            source = get_client('client', 'secret', 'tenant', limited.base_url, authority_host=limited.base_url, rate_limit=50)
+            target = get_client('client', 'secret', 'tenant', limited.base_url, authority_host=limited.base_url, rate_limit=40,
+                                concurrency_limit=8)
+            response = target.get('api/data/v9.1/crmk_plants?$select=crmk_plantid')
+
+        self.assertIs(source.governor, target.governor)
+        self.assertEqual((target.governor.max_rate, target.governor.max_concurrency), (40, 8))
+        self.assertEqual(response.headers['x-ms-ratelimit-burst-remaining-xrm-requests'], '99')
+        self.assertEqual(target.governor._limits, {'x-ms-ratelimit-burst-remaining-xrm-requests': 99})
+
+
+if __name__ == '__main__':
+    unittest.main()
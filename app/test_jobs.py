@@ -0,0 +1,116 @@
+import json
+import threading
+import unittest
+from unittest import mock
+
+import app as migration_app
+from migration_scripts import jobs
+from migration_scripts.jobs import STATUS_CANCELLED, STATUS_COMPLETED, JobAlreadyRunning, MigrationJob, get_job, start_job
+
+if not hasattr(migration_app, 'run_migration'):
+    # pytest imports the app directory as a package, so app.py is app.app
+    from app import app as migration_app
+
+
+class TestMigrationJob(unittest.TestCase):
+
+    def test_snapshot_reports_throughput_and_eta(self):
+        job = MigrationJob()
+        with mock.patch('migration_scripts.jobs.time.time', return_value=100.0):
+            job.start_stage('transform', total=1000)
+        job.advance(250)
+        with mock.patch('migration_scripts.jobs.time.time', return_value=105.0):
+            stage = job.snapshot()['stages']['transform']
+        self.assertEqual(stage['processed'], 250)
+        self.assertEqual(stage['throughput'], 50.0)
+        self.assertEqual(stage['eta'], 15.0)
+
+    def test_cancel_stops_job_at_next_check(self):
+        started = threading.Event()
+
+        def migration(job):
+            job.start_stage('load', total=10)
+            started.set()
+            while True:
+                job.check_cancelled()
+                job.wait_for_change(job.snapshot()['version'], 0.05)
+
+        job = start_job(migration)
+        started.wait(5)
+        job.cancel()
+        job.wait_for_change(job.snapshot()['version'], 5)
+        for _ in range(100):
+            if job.done:
+                break
+            job.wait_for_change(job.snapshot()['version'], 0.05)
+        self.assertEqual(job.status, STATUS_CANCELLED)
+
+    def test_one_job_runs_at_a_time(self):
+        release = threading.Event()
+        job = start_job(lambda job: release.wait(5))
+        try:
+            with self.assertRaises(JobAlreadyRunning) as raised:
+                start_job(lambda job: None)
+            self.assertIs(raised.exception.job, job)
+        finally:
+            release.set()
+        job.wait_for_change(0, 5)
+        self.assertEqual(job.status, STATUS_COMPLETED)
+
+    def test_finished_jobs_are_pruned(self):
+        old, recent = MigrationJob(), MigrationJob()
+        old.finish(STATUS_COMPLETED)
+        recent.finish(STATUS_COMPLETED)
+        old.finished -= jobs.FINISHED_JOB_TTL + 1
+        with mock.patch.dict(jobs._jobs, {old.id: old, recent.id: recent}, clear=True), \
+                mock.patch.object(jobs, 'MAX_FINISHED_JOBS', 1):
+            newest = start_job(lambda job: None)
+            self.assertIsNone(get_job(old.id))
+            self.assertIs(get_job(recent.id), recent)
+            newest.wait_for_change(0, 5)
+
+
+class TestJobEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.client = migration_app.app.test_client()
+
+    def test_migrate_returns_job_and_streams_progress(self):
+        def fake_run_migration(config, job=None):
+            job.start_stage('extract')
+            job.advance(3)
+            return {'extracted': 3, 'transformed': 3}
+
+        with mock.patch.object(migration_app, 'load_config', return_value={}), \
+                mock.patch.object(migration_app, 'run_migration', side_effect=fake_run_migration):
+            response = self.client.post('/migrate')
+            self.assertEqual(response.status_code, 202)
+            job_id = response.get_json()['job_id']
+
+            events = self.client.get(f'/jobs/{job_id}/events').get_data(as_text=True)
+
+        final = json.loads(events.strip().split('\n\n')[-1][len('data: '):])
+        self.assertEqual(final['status'], STATUS_COMPLETED)
+        self.assertEqual(final['stages']['extract']['processed'], 3)
+        self.assertEqual(self.client.get(f'/jobs/{job_id}').get_json()['result'], {'extracted': 3, 'transformed': 3})
+
+    def test_migrate_is_refused_while_a_job_runs(self):
+        release = threading.Event()
+        running = start_job(lambda job: release.wait(5))
+        try:
+            with mock.patch.object(migration_app, 'load_config', return_value={}):
+                response = self.client.post('/migrate')
+        finally:
+            release.set()
+            running.wait_for_change(0, 5)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['job_id'], running.id)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/jobs/missing').status_code, 404)
+        self.assertEqual(self.client.post('/jobs/missing/cancel').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import json
+import tempfile
+import unittest
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import execute_fetchxml_query, get_client
+from migration_scripts.extract_data_logic import prefer_page_size, set_fetchxml_page_size
+from migration_scripts.json_stream import PageStream
+
+PAGE = {
+    '@odata.context': 'https://org.crm4.dynamics.com/api/data/v9.1/$metadata#crmk_plants',
+    'value': [
+        {'crmk_plantid': '1', 'crmk_primaryname': 'Växjö ☃', 'capacity': 12345, 'active': True, 'parent': None},
+        {'crmk_plantid': '2', 'crmk_primaryname': 'Plant "2"', 'capacity': -1.5e3, 'tags': [1, {'a': []}]},
+    ],
+    '@Microsoft.Dynamics.CRM.morerecords': True,
+    '@odata.nextLink': 'https://org.crm4.dynamics.com/api/data/v9.1/crmk_plants?page=2',
+    'count': 2,
+}
+QUERY = '<fetch><entity name="crmk_plant"><attribute name="crmk_plantid" /></entity></fetch>'
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class TestPageStream(unittest.TestCase):
+
+    def test_records_and_annotations_survive_any_chunk_boundary(self):
+        body = json.dumps(PAGE, ensure_ascii=False, indent=1).encode('utf-8')
+        for size in (1, 2, 3, 7, 64, len(body)):
+            page = PageStream(chunked(body, size))
+
+            self.assertEqual(list(page), PAGE['value'])
+            self.assertEqual(page.count, 2)
+            self.assertEqual(page.next_link, PAGE['@odata.nextLink'])
+            self.assertEqual(page.properties['count'], 2)
+            self.assertIs(page.properties['@Microsoft.Dynamics.CRM.morerecords'], True)
+            self.assertEqual(page.bytes_read, len(body))
+            self.assertTrue(page.finished)
+
+    def test_records_are_decoded_before_the_body_is_complete(self):
+        body = json.dumps(PAGE).encode('utf-8')
+        chunks = iter(chunked(body, 16))
+        page = iter(PageStream(chunks))
+
+        self.assertEqual(next(page), PAGE['value'][0])
+        self.assertGreater(len(list(chunks)), 0)
+
+    def test_empty_pages(self):
+        for body in (b'{}', b'{"value": []}', b' { "value" : [ ] } '):
+            page = PageStream([body])
+            self.assertEqual(list(page), [])
+            self.assertIsNone(page.next_link)
+
+    def test_truncated_response_raises(self):
+        body = json.dumps(PAGE).encode('utf-8')
+        with self.assertRaises(ValueError):
+            list(PageStream(chunked(body[:-40], 10)))
+
+    def test_page_can_only_be_read_once(self):
+        page = PageStream([b'{"value": []}'])
+        list(page)
+        with self.assertRaises(RuntimeError):
+            list(page)
+
+
+class TestPageSize(unittest.TestCase):
+
+    def test_page_size_sets_count_unless_the_query_pages_itself(self):
+        self.assertIn('count="50"', set_fetchxml_page_size(QUERY, 50))
+        for query in ('<fetch count="10"><entity name="crmk_plant" /></fetch>',
+                      '<fetch top="10"><entity name="crmk_plant" /></fetch>'):
+            self.assertEqual(set_fetchxml_page_size(query, 50), query)
+
+    def test_page_size_is_added_to_the_prefer_header(self):
+        headers = prefer_page_size({'Prefer': 'odata.include-annotations="*"'}, 50)
+
+        self.assertEqual(headers['Prefer'], 'odata.include-annotations="*",odata.maxpagesize=50')
+        self.assertEqual(prefer_page_size(None, 50), {'Prefer': 'odata.maxpagesize=50'})
+
+
+class TestStreamedExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=25).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def extract(self, name, **options):
+        return list(execute_fetchxml_query(self.client, [QUERY], self.mock.base_url,
+                                           os.path.join(self.temp_dir.name, name), **options))
+
+    def test_streamed_extract_returns_the_same_records(self):
+        pages = self.mock.stats['pages']
+        expected = self.extract('buffered', page_size=10)
+        self.assertEqual(self.mock.stats['pages'] - pages, 3)
+
+        self.assertEqual(self.extract('streamed', stream=True, page_size=10), expected)
+        self.assertEqual(self.mock.stats['pages'] - pages, 6)
+        self.assertEqual(self.extract('default', stream=True), expected)
+        self.assertEqual(len(expected), 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
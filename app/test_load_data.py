@@ -0,0 +1,167 @@
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from migration_scripts import load_data
+from migration_scripts.dataverse_client import DataverseClient
+from migration_scripts.jobs import MigrationJob
+from migration_scripts.load_data import (build_batch_request, group_batch_tiers, load_data_to_target, parse_batch_response,
+                                         patch_deferred_lookups)
+from migration_scripts.metadata import EntityMetadata, MetadataCache
+
+
+def http_part(content_id, status_line, body=''):
+    return (
+        "Content-Type: application/http\r\n"
+        "Content-Transfer-Encoding: binary\r\n"
+        f"Content-ID: {content_id}\r\n\r\n"
+        f"HTTP/1.1 {status_line}\r\n"
+        "OData-Version: 4.0\r\n\r\n"
+        f"{body}\r\n"
+    )
+
+
+def batch_response(parts, boundary='batchresponse_1'):
+    body = ''.join(f"--{boundary}\r\n{part}" for part in parts) + f"--{boundary}--\r\n"
+    return body, f"multipart/mixed; boundary={boundary}"
+
+
+def changeset_response(parts, boundary='changesetresponse_1'):
+    body = ''.join(f"--{boundary}\r\n{part}" for part in parts) + f"--{boundary}--"
+    return f"Content-Type: multipart/mixed; boundary={boundary}\r\n\r\n{body}\r\n"
+
+
+def table_metadata(*tables):
+    metadata = MetadataCache('https://org')
+    for table in tables:
+        metadata.put(EntityMetadata(table, f'{table}s', f'{table}id'))
+    return metadata
+
+
+class FakeResponse:
+
+    status_code = 200
+
+    def __init__(self, text, content_type):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.headers = {'Content-Type': content_type}
+
+    def raise_for_status(self):
+        pass
+
+
+class TestBatchLoading(unittest.TestCase):
+
+    def test_build_batch_request_groups_changesets(self):
+        url = 'https://org/api/data/v9.1/crmk_items'
+        boundary, body = build_batch_request([('POST', url, {'a': 1}), ('POST', url, {'a': 2}), ('PATCH', url + '(3)', {'a': 3})], changeset_size=2)
+        text = body.decode('utf-8')
+        self.assertTrue(text.endswith(f"--{boundary}--\r\n"))
+        self.assertEqual(text.count('Content-Type: multipart/mixed; boundary=changeset_'), 2)
+        self.assertEqual(text.count('POST https://org/api/data/v9.1/crmk_items HTTP/1.1'), 2)
+        self.assertIn('PATCH https://org/api/data/v9.1/crmk_items(3) HTTP/1.1', text)
+        self.assertIn('Content-ID: 3', text)
+
+    def test_parse_batch_response(self):
+        body, content_type = batch_response([
+            http_part(1, '204 No Content'),
+            http_part(2, '400 Bad Request', '{"error":{"message":"bad"}}'),
+        ])
+        groups = parse_batch_response(body, content_type)
+        self.assertEqual([[response['status'] for response in group] for group in groups], [[204], [400]])
+        self.assertEqual(groups[1][0]['body'], '{"error":{"message":"bad"}}')
+
+    def test_failed_changeset_is_reported_for_each_record(self):
+        body, content_type = batch_response([
+            changeset_response([http_part(1, '204 No Content'), http_part(2, '204 No Content')]),
+            http_part(4, '400 Bad Request', 'invalid'),
+        ])
+        data = [{'logical_name': 'crmk_item', 'id': index} for index in range(4)]
+
+        with mock.patch.object(requests.Session, 'request', return_value=FakeResponse(body, content_type)) as post, \
+                self.assertLogs(load_data.logger, 'ERROR') as logs:
+            load_data_to_target(data, 'https://org', {'crmk_item': 1}, 'token', batch_size=10, changeset_size=2,
+                                metadata=table_metadata('crmk_item'))
+
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args[0][:2], ('POST', 'https://org/api/data/v9.1/$batch'))
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('ID 2', logs.output[0])
+        self.assertIn('Changeset rolled back', logs.output[0])
+        self.assertIn('ID 3', logs.output[1])
+        self.assertIn('invalid', logs.output[1])
+
+    def test_deferred_lookups_only_update_existing_records(self):
+        client = DataverseClient('https://org', access_token='token')
+        entity = EntityMetadata('crmk_item', 'crmk_items', 'crmk_itemid')
+        deferred = [({'crmk_itemid': 'i1'}, {'crmk_plantid@odata.bind': '/crmk_plants(p1)'})]
+        body, content_type = batch_response([http_part(1, '404 Not Found', '{"error":{"message":"Does Not Exist"}}')])
+
+        with mock.patch.object(requests.Session, 'request', return_value=FakeResponse(body, content_type)) as request, \
+                self.assertLogs(load_data.logger, 'ERROR'):
+            self.assertEqual(patch_deferred_lookups(client, entity, deferred, batch_size=10), 1)
+            patch_deferred_lookups(client, entity, deferred)
+
+        batch, single = request.call_args_list
+        self.assertIn(b'PATCH https://org/api/data/v9.1/crmk_items(i1) HTTP/1.1\r\nContent-Type: application/json; type=entry\r\n'
+                      b'If-Match: *\r\n', batch.kwargs['data'])
+        self.assertEqual(single.args[:2], ('PATCH', 'https://org/api/data/v9.1/crmk_items(i1)'))
+        self.assertEqual(single.kwargs['headers']['If-Match'], '*')
+
+    def test_failed_batches_advance_the_job(self):
+        job = MigrationJob()
+        job.start_stage('load', total=3)
+        data = [{'crmk_itemid': f'i{index}'} for index in range(3)]
+
+        with mock.patch.object(load_data, 'post_batch', side_effect=requests.ConnectionError('refused')), \
+                self.assertLogs(load_data.logger, 'ERROR'):
+            failed = load_data.load_table('token', 'crmk_item', data, batch_size=2, job=job, metadata=table_metadata('crmk_item'))
+
+        self.assertEqual(failed, 3)
+        self.assertEqual(job.snapshot()['stages']['load']['processed'], 3)
+
+
+class TestTieredLoading(unittest.TestCase):
+
+    def test_group_batch_tiers(self):
+        tiers = group_batch_tiers({'crmk_item': 2, 'crmk_plant': 1, 'crmk_landobject': 2})
+        self.assertEqual(tiers, [(1, ['crmk_plant']), (2, ['crmk_item', 'crmk_landobject'])])
+
+    def test_tables_of_a_tier_load_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def fake_load_table(client, table, table_data, *args):
+            calls.append(table)
+            if table != 'crmk_plant':
+                barrier.wait()
+            return 0
+
+        data = [{'logical_name': table} for table in ('crmk_plant', 'crmk_item', 'crmk_landobject')]
+        with mock.patch.object(load_data, 'load_table', side_effect=fake_load_table):
+            load_data_to_target(data, 'https://org', {'crmk_plant': 1, 'crmk_item': 2, 'crmk_landobject': 2}, 'token', max_workers=2,
+                                metadata=table_metadata('crmk_plant', 'crmk_item', 'crmk_landobject'))
+
+        self.assertEqual(calls[0], 'crmk_plant')
+        self.assertEqual(sorted(calls[1:]), ['crmk_item', 'crmk_landobject'])
+
+    def test_partitioned_data_is_loaded_per_table(self):
+        loaded = {}
+
+        def fake_load_table(client, table, table_data, *args):
+            loaded[table] = table_data
+            return 0
+
+        data = {'crmk_plant': [{'crmk_plantid': 'p1'}], 'crmk_item': [{'crmk_itemid': 'i1'}, {'crmk_itemid': 'i2'}]}
+        with mock.patch.object(load_data, 'load_table', side_effect=fake_load_table):
+            load_data_to_target(data, 'https://org', {'crmk_plant': 1, 'crmk_item': 2, 'crmk_landobject': 2}, 'token',
+                                metadata=table_metadata('crmk_plant', 'crmk_item', 'crmk_landobject'))
+
+        self.assertEqual(loaded, {'crmk_plant': [{'crmk_plantid': 'p1'}], 'crmk_item': [{'crmk_itemid': 'i1'}, {'crmk_itemid': 'i2'}], 'crmk_landobject': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from migration_scripts.load_data import load_data_to_target, record_request
+from migration_scripts.load_journal import LoadJournal, STATUS_COMMITTED, STATUS_FAILED
+from migration_scripts.metadata import EntityMetadata, MetadataCache
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = '' if status_code < 400 else 'error'
+        self.content = self.text.encode('utf-8')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+
+def table_metadata(*tables):
+    metadata = MetadataCache('https://org')
+    for table in tables:
+        metadata.put(EntityMetadata(table, f'{table}s', f'{table}id'))
+    return metadata
+
+
+class TestLoadJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal = LoadJournal(os.path.join(self.temp_dir.name, 'journal.db'))
+
+    def tearDown(self):
+        self.journal.close()
+        self.temp_dir.cleanup()
+
+    def test_latest_outcome_replaces_earlier_attempts(self):
+        self.journal.record('crmk_plant', 'p1', STATUS_FAILED, 500, 'boom')
+        self.journal.record('crmk_plant', 'p1', STATUS_COMMITTED, 204)
+        self.journal.record('crmk_plant', 'p2', STATUS_FAILED, 400, 'bad')
+        self.assertEqual(self.journal.committed_ids('crmk_plant'), {'p1'})
+        self.assertEqual(self.journal.summary(), {('crmk_plant', STATUS_COMMITTED): 1, ('crmk_plant', STATUS_FAILED): 1})
+
+    def test_upsert_request_uses_primary_or_alternate_key(self):
+        plant = EntityMetadata('crmk_plant', 'crmk_plants', 'crmk_plantid')
+        item = EntityMetadata('crmk_item', 'crmk_items', 'crmk_itemid')
+        self.assertEqual(record_request(plant, {'crmk_plantid': 'abc'}, upsert=True), ('PATCH', 'api/data/v9.1/crmk_plants(abc)'))
+        self.assertEqual(
+            record_request(item, {'crmk_code': "O'Neil", 'crmk_number': 7}, upsert=True, upsert_keys={'crmk_item': ['crmk_code', 'crmk_number']}),
+            ('PATCH', "api/data/v9.1/crmk_items(crmk_code='O''Neil',crmk_number=7)"),
+        )
+        self.assertEqual(record_request(plant, {'crmk_plantid': 'abc'}), ('POST', 'api/data/v9.1/crmk_plants'))
+        self.assertEqual(record_request(plant, {}, upsert=True), ('POST', 'api/data/v9.1/crmk_plants'))
+
+    def test_entity_set_and_primary_key_come_from_metadata(self):
+        category = EntityMetadata('crmk_category', 'crmk_categories', 'crmk_categorycode')
+        self.assertEqual(record_request(category, {'crmk_categorycode': 'c1'}, upsert=True), ('PATCH', 'api/data/v9.1/crmk_categories(c1)'))
+
+    def test_resume_skips_committed_records(self):
+        def data():
+            return [{'logical_name': 'crmk_plant', 'crmk_plantid': plant_id} for plant_id in ('p1', 'p2', 'p3')]
+
+        metadata = table_metadata('crmk_plant')
+        statuses = iter([204, 500, 204])
+        with mock.patch.object(requests.Session, 'request', side_effect=lambda *args, **kwargs: FakeResponse(next(statuses))):
+            load_data_to_target(data(), 'https://org', {'crmk_plant': 1}, 'token', journal=self.journal, upsert=True, metadata=metadata)
+        self.assertEqual(self.journal.committed_ids('crmk_plant'), {'p1', 'p3'})
+
+        with mock.patch.object(requests.Session, 'request', return_value=FakeResponse(204)) as request:
+            load_data_to_target(data(), 'https://org', {'crmk_plant': 1}, 'token', journal=self.journal, upsert=True, resume=True,
+                                metadata=metadata)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(request.call_args[0], ('PATCH', 'https://org/api/data/v9.1/crmk_plants(p2)'))
+        self.assertEqual(self.journal.committed_ids('crmk_plant'), {'p1', 'p2', 'p3'})
+
+
+if __name__ == '__main__':
+    unittest.main()
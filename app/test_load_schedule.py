@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import get_client, load_data, load_data_to_target, read_fetchxml
+from migration_scripts.dead_letters import DeadLetterFile
+from migration_scripts.load_data import DeferredLookups
+from migration_scripts.load_schedule import build_load_schedule, link_entity_dependencies, plan_load_schedule, record_dependencies
+from migration_scripts.metadata import MetadataCache
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestLoadSchedule(unittest.TestCase):
+
+    def test_link_entities_of_the_shipped_queries(self):
+        dependencies = set()
+        for name in ('configurationdata.xml', 'plants.xml'):
+            dependencies |= link_entity_dependencies(read_fetchxml(os.path.join(APP_DIR, 'xml_queries', name)))
+
+        self.assertEqual(dependencies, {
+            ('crmk_item', 'crmk_plant'),
+            ('crmk_plant_landobject', 'crmk_plant'),
+            ('crmk_plant_landobject', 'crmk_landobject'),
+        })
+
+    def test_record_dependencies_follow_bind_references(self):
+        partitions = {
+            'crmk_item': [{'crmk_PlantId@odata.bind': '/crmk_plants(1)', 'ownerid@odata.bind': '/systemusers(2)'}],
+            'crmk_plant': [{'crmk_ParentId@odata.bind': 'https://org/api/data/v9.1/crmk_plants(3)'}],
+        }
+
+        dependencies = record_dependencies(partitions, {'crmk_plants': 'crmk_plant', 'crmk_items': 'crmk_item'})
+
+        self.assertEqual(dependencies, {
+            ('crmk_item', 'crmk_plant'): {'crmk_PlantId@odata.bind'},
+            ('crmk_plant', 'crmk_plant'): {'crmk_ParentId@odata.bind'},
+        })
+
+    def test_levels_are_topological(self):
+        schedule = build_load_schedule(['crmk_plant_landobject', 'crmk_item', 'crmk_plant', 'crmk_landobject', 'crmk_note'], {
+            ('crmk_item', 'crmk_plant'): set(),
+            ('crmk_plant_landobject', 'crmk_plant'): set(),
+            ('crmk_plant_landobject', 'crmk_landobject'): set(),
+            ('crmk_note', 'crmk_item'): set(),
+            ('crmk_item', 'crmk_unknown'): set(),
+        })
+
+        self.assertEqual(schedule.levels, [['crmk_plant', 'crmk_landobject'], ['crmk_plant_landobject', 'crmk_item'], ['crmk_note']])
+        self.assertEqual(schedule.deferred, {})
+
+    def test_cycles_and_self_references_are_deferred(self):
+        schedule = build_load_schedule(['crmk_item', 'crmk_plant', 'crmk_area'], {
+            ('crmk_plant', 'crmk_area'): {'crmk_AreaId@odata.bind'},
+            ('crmk_area', 'crmk_plant'): {'crmk_MainPlantId@odata.bind'},
+            ('crmk_item', 'crmk_plant'): {'crmk_PlantId@odata.bind'},
+            ('crmk_item', 'crmk_item'): {'crmk_ParentId@odata.bind'},
+        })
+
+        self.assertEqual(schedule.levels, [['crmk_plant', 'crmk_area'], ['crmk_item']])
+        self.assertEqual(schedule.deferred, {
+            'crmk_plant': {'crmk_AreaId@odata.bind'},
+            'crmk_area': {'crmk_MainPlantId@odata.bind'},
+            'crmk_item': {'crmk_ParentId@odata.bind'},
+        })
+
+    def test_deferred_lookups_are_taken_off_the_records(self):
+        deferred = DeferredLookups('crmk_item', {'a@odata.bind'}, ['id'])
+        records = [deferred.strip(record) for record in [{'id': 1, 'a@odata.bind': '/as(2)', 'b': 3}, {'id': 2}]]
+
+        self.assertEqual(records, [{'id': 1, 'b': 3}, {'id': 2}])
+        self.assertEqual(list(deferred), [({'id': 1}, {'a@odata.bind': '/as(2)'})])
+
+
+class TestScheduledLoad(unittest.TestCase):
+
+    def test_self_references_are_patched_after_the_load(self):
+        data = {
+            'crmk_plant': [{'crmk_plantid': f'p{index}', 'crmk_ParentId@odata.bind': f'/crmk_plants(p{index + 1})'} for index in range(3)],
+            'crmk_item': [{'crmk_itemid': 'i1', 'crmk_PlantId@odata.bind': '/crmk_plants(p0)'}],
+        }
+        with MockDataverse(rows=1) as dataverse:
+            client = get_client('client', 'secret', 'tenant', dataverse.base_url, authority_host=dataverse.base_url)
+            metadata = MetadataCache(dataverse.base_url)
+            schedule = plan_load_schedule(data, ['crmk_item', 'crmk_plant'], [], metadata, client)
+            load_data_to_target(data, dataverse.base_url, {'crmk_item': 1, 'crmk_plant': 1}, client, batch_size=10,
+                                metadata=metadata, schedule=schedule)
+            stats = dict(dataverse.stats)
+
+        self.assertEqual(schedule.levels, [['crmk_plant'], ['crmk_item']])
+        self.assertEqual(schedule.deferred, {'crmk_plant': {'crmk_ParentId@odata.bind'}})
+        self.assertEqual(stats['writes'], 4 + 3)
+        self.assertEqual(stats['batches'], 3)
+
+    def test_lookups_of_records_that_failed_to_load_are_not_patched(self):
+        data = {'crmk_plant': [{'crmk_plantid': f'p{index}', 'crmk_name': f'Plant {index}',
+                                'crmk_ParentId@odata.bind': f'/crmk_plants(p{index + 1})'} for index in range(3)]}
+        patched = []
+
+        def post_batch(client, items, *args):
+            return [(400, 'bad') if item['crmk_plantid'] == 'p1' else (204, '') for item in items]
+
+        def send_batch(client, operations, *args):
+            patched.extend((url.rsplit('/', 1)[-1], lookups) for _, url, lookups in operations)
+            return [(204, '')] * len(operations)
+
+        with MockDataverse(rows=1) as dataverse, tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(load_data, 'post_batch', side_effect=post_batch), \
+                mock.patch.object(load_data, 'send_batch', side_effect=send_batch), \
+                self.assertLogs(load_data.logger, 'WARNING'):
+            client = get_client('client', 'secret', 'tenant', dataverse.base_url, authority_host=dataverse.base_url)
+            metadata = MetadataCache(dataverse.base_url)
+            schedule = plan_load_schedule(data, ['crmk_plant'], [], metadata, client)
+            with DeadLetterFile(os.path.join(temp_dir, 'dead_letters.ndjson')) as dead_letters:
+                failed = load_data_to_target(data, dataverse.base_url, {'crmk_plant': 1}, client, batch_size=10, metadata=metadata,
+                                             schedule=schedule, dead_letters=dead_letters)
+                entries = dead_letters.entries()
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(patched, [('crmk_plants(p0)', {'crmk_ParentId@odata.bind': '/crmk_plants(p1)'}),
+                                   ('crmk_plants(p2)', {'crmk_ParentId@odata.bind': '/crmk_plants(p3)'})])
+        self.assertEqual([(entry['record'], entry.get('lookups')) for entry in entries], [
+            ({'crmk_plantid': 'p1', 'crmk_name': 'Plant 1'}, None),
+            ({'crmk_plantid': 'p1'}, {'crmk_ParentId@odata.bind': '/crmk_plants(p2)'}),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
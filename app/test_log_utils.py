@@ -0,0 +1,56 @@
+import io
+import logging
+import unittest
+from unittest import mock
+
+from migration_scripts import log_utils
+from migration_scripts.log_utils import Payload, RecordSampler, TruncatingFormatter
+
+
+class ExplodingRepr:
+
+    def __str__(self):
+        raise AssertionError("Payload was formatted although the level is disabled.")
+
+
+class TestLogUtils(unittest.TestCase):
+
+    def tearDown(self):
+        log_utils.stop_logging()
+        log_utils._settings.update(max_payload_length=log_utils.DEFAULT_MAX_PAYLOAD_LENGTH, sample_every=log_utils.DEFAULT_SAMPLE_EVERY)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if getattr(handler, '_migration_handler', False):
+                root.removeHandler(handler)
+
+    def test_payload_is_truncated_and_lazy(self):
+        self.assertEqual(str(Payload('x' * 20, limit=5)), 'xxxxx... [15 more characters]')
+        self.assertEqual(str(Payload({'a': 1}, limit=50)), "{'a': 1}")
+
+        quiet = logging.getLogger('test_log_utils.quiet')
+        quiet.setLevel(logging.INFO)
+        quiet.debug("Payload: %s", Payload(ExplodingRepr()))
+
+    def test_sampler_logs_first_and_every_nth_record(self):
+        sampler = RecordSampler('load', every=3)
+        self.assertEqual([sampler.sample() for _ in range(7)], [True, False, False, True, False, False, True])
+
+    def test_formatter_caps_line_length(self):
+        formatter = TruncatingFormatter('%(message)s', max_length=10)
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 'a' * 25, None, None)
+        self.assertEqual(formatter.format(record), 'aaaaaaaaaa... [15 more characters]')
+
+    def test_queue_listener_writes_truncated_lines(self):
+        stream = io.StringIO()
+        with mock.patch('logging.StreamHandler', return_value=logging.StreamHandler(stream)):
+            log_utils.configure_logging(level='INFO', max_message_length=120, max_payload_length=10, sample_every=5)
+        logging.getLogger('test_log_utils').info("Record: %s", Payload('y' * 50))
+        log_utils.stop_logging()
+
+        line = stream.getvalue().strip()
+        self.assertIn("Record: yyyyyyyyyy... [40 more characters]", line)
+        self.assertEqual(RecordSampler('load').every, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
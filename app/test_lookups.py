@@ -0,0 +1,93 @@
+import os
+import uuid
+import tempfile
+import unittest
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import get_client
+from migration_scripts.lookups import LookupResolver, LookupRule, resolve_lookups
+from migration_scripts.metadata import MetadataCache
+from migration_scripts.record_store import RecordStore
+from migration_scripts.transform_data import transform_data
+
+USER_MAPPING = {'old_user_id_1': 'new_user_1', 'default': 'new_generic_user_id'}
+OWNER_RULE = LookupRule.from_config('owner_id', {
+    'bind': 'ownerid',
+    'targets': [{'entity': 'systemuser', 'key': 'domainname'}, {'entity': 'team', 'key': 'name'}],
+})
+
+
+def user_id(index):
+    return str(uuid.UUID(int=index + 1))
+
+
+class TestLookups(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=12).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataCache(self.mock.base_url)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def resolver(self, **options):
+        return LookupResolver(self.client, self.metadata, os.path.join(self.temp_dir.name, 'lookups'), page_size=5, **options)
+
+    def test_index_is_read_in_pages_and_cached_on_disk(self):
+        pages = self.mock.stats['pages']
+        index = self.resolver().index('systemuser', 'domainname')
+
+        self.assertEqual(self.mock.stats['pages'] - pages, 3)
+        self.assertEqual(len(index), 12)
+        self.assertEqual(index.bind(' User7@Contoso.com'), f'/systemusers({user_id(7)})')
+        self.assertIsNone(index.bind('nobody@contoso.com'))
+
+        cached = self.resolver().index('systemuser', 'domainname')
+        self.assertEqual(self.mock.stats['pages'] - pages, 3)
+        self.assertEqual(cached.ids_by_key, index.ids_by_key)
+
+        self.resolver(ttl=0).index('systemuser', 'domainname')
+        self.assertEqual(self.mock.stats['pages'] - pages, 6)
+
+    def test_resolve_natural_keys_and_source_ids(self):
+        by_key, = resolve_lookups([OWNER_RULE], self.resolver())
+        self.assertEqual(by_key.target, 'ownerid@odata.bind')
+        self.assertEqual(by_key.get('user3@contoso.com'), f'/systemusers({user_id(3)})')
+        self.assertEqual(by_key.get('Team 3'), f'/teams({user_id(3)})')
+
+        rule = LookupRule('owner_id', 'ownerid', [('systemuser', 'domainname')], match_source_ids=True)
+        by_id, = resolve_lookups([rule], self.resolver(), self.resolver())
+        self.assertEqual(by_id.get(user_id(3).upper()), f'/systemusers({user_id(3)})')
+
+    def test_transform_binds_owners_and_references(self):
+        reference_rule = LookupRule('crmk_plant_code', 'crmk_PlantId', [('team', 'name')])
+        lookups = resolve_lookups([OWNER_RULE, reference_rule], self.resolver())
+        raw_path = os.path.join(self.temp_dir.name, 'raw')
+        with RecordStore.create(raw_path).writer(0, 'crmk_item') as writer:
+            writer.write_many([
+                {'crmk_itemid': '1', 'owner_id': 'user2@contoso.com', 'crmk_plant_code': 'Team 5'},
+                {'crmk_itemid': '2', 'owner_id': 'old_user_id_1', 'crmk_plant_code': 'Unknown'},
+                {'crmk_itemid': '3'},
+            ])
+
+        transformed = list(transform_data(raw_path, os.path.join(self.temp_dir.name, 'transformed'), USER_MAPPING,
+                                          'last_updated', '2024-01-01', 'dynamics365', lookups=lookups))
+
+        self.assertEqual(transformed, [
+            {'crmk_itemid': '1', 'ownerid@odata.bind': f'/systemusers({user_id(2)})', 'crmk_PlantId@odata.bind': f'/teams({user_id(5)})'},
+            {'crmk_itemid': '2', 'ownerid@odata.bind': '/systemusers(new_user_1)'},
+            {'crmk_itemid': '3', 'ownerid@odata.bind': '/systemusers(new_generic_user_id)'},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
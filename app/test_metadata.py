@@ -0,0 +1,82 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+from urllib.parse import unquote
+
+import requests
+
+from benchmarks.mock_dataverse import entity_definition
+from migration_scripts import metadata as metadata_module
+from migration_scripts.dataverse_client import DataverseClient
+from migration_scripts.metadata import MetadataCache
+
+
+class FakeResponse:
+
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.content = json.dumps(payload).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def fake_definitions(requested):
+    def fake_get(method, url, headers=None, **kwargs):
+        names = [part.split("'")[1] for part in unquote(url).split('LogicalName eq ')[1:]]
+        requested.append(names)
+        return FakeResponse({'value': [entity_definition(name) for name in names if name != 'crmk_missing']})
+    return fake_get
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.client = DataverseClient('https://org.crm4.dynamics.com', access_token='token')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_definitions_are_fetched_once_per_run(self):
+        requested = []
+        metadata = MetadataCache(self.client.base_url)
+
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_definitions(requested)):
+            metadata.prefetch(self.client, ['crmk_plant', 'crmk_item', 'crmk_plant'])
+            plant = metadata.entity(self.client, 'crmk_plant')
+            metadata.entity(self.client, 'crmk_item')
+
+        self.assertEqual(requested, [['crmk_item', 'crmk_plant']])
+        self.assertEqual(plant.entity_set, 'crmk_plants')
+        self.assertEqual(plant.primary_id, 'crmk_plantid')
+        self.assertEqual(plant.attributes['modifiedon'], 'DateTime')
+
+    def test_disk_cache_is_reused_until_the_ttl_expires(self):
+        requested = []
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_definitions(requested)):
+            MetadataCache(self.client.base_url, self.temp_dir.name, ttl=60).entity(self.client, 'crmk_plant')
+            self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, 'org.crm4.dynamics.com.json')))
+
+            MetadataCache(self.client.base_url, self.temp_dir.name, ttl=60).entity(self.client, 'crmk_plant')
+            self.assertEqual(len(requested), 1)
+
+            with mock.patch.object(metadata_module.time, 'time', return_value=metadata_module.time.time() + 61):
+                MetadataCache(self.client.base_url, self.temp_dir.name, ttl=60).entity(self.client, 'crmk_plant')
+            self.assertEqual(len(requested), 2)
+
+    def test_unknown_entity_raises(self):
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_definitions([])):
+            with self.assertRaises(KeyError):
+                MetadataCache(self.client.base_url).entity(self.client, 'crmk_missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
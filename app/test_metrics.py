@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from migration_scripts import metrics
+from migration_scripts.dataverse_client import DataverseClient
+from migration_scripts.retry import RetryPolicy
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+def fake_request(responses):
+    def request(method, url, headers=None, **kwargs):
+        response = next(responses)
+        response.request = requests.Request(method, url, data=kwargs.get('data'), json=kwargs.get('json')).prepare()
+        return response
+    return request
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_endpoint_label_reduces_urls_to_entity_sets(self):
+        self.assertEqual(metrics.endpoint_label('https://org.crm4.dynamics.com/api/data/v9.1/crmk_plants?fetchXml=x'), 'crmk_plants')
+        self.assertEqual(metrics.endpoint_label('https://org.crm4.dynamics.com/api/data/v9.1/accounts(00000000-0000-0000-0000-000000000001)'), 'accounts')
+        self.assertEqual(metrics.endpoint_label('https://org.crm4.dynamics.com/api/data/v9.1/$batch'), '$batch')
+        self.assertEqual(metrics.endpoint_label('https://login.microsoftonline.com/tenant/oauth2/v2.0/token'), 'token')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ['endpoint'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, endpoint='a')
+        histogram.observe(0.5, endpoint='a')
+        histogram.observe(5, endpoint='a')
+
+        lines = histogram.render()
+
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{endpoint="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{endpoint="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{endpoint="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{endpoint="a"} 3', lines)
+
+    def test_track_stage_records_outcome_and_records(self):
+        with metrics.track_stage('test_stage') as stage:
+            stage.records = 5
+        with self.assertRaises(RuntimeError), metrics.track_stage('test_stage'):
+            raise RuntimeError("boom")
+
+        text = metrics.render_metrics()
+
+        self.assertIn('migration_stage_runs_total{stage="test_stage",outcome="success"} 1', text)
+        self.assertIn('migration_stage_runs_total{stage="test_stage",outcome="failure"} 1', text)
+        self.assertIn('migration_stage_records_total{stage="test_stage"} 5', text)
+
+    def test_client_requests_record_latency_bytes_and_throttling(self):
+        client = DataverseClient('https://metrics.crm4.dynamics.com', access_token='token', retry_policy=RetryPolicy(max_attempts=1, base_delay=0))
+        responses = iter([FakeResponse(429), FakeResponse(200, b'{"value": []}')])
+
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_request(responses)):
+            client.get('api/data/v9.1/crmk_meters')
+            client.post('api/data/v9.1/crmk_meters', json={'n': 1})
+
+        text = metrics.render_metrics()
+
+        self.assertIn('dataverse_http_request_duration_seconds_count{endpoint="crmk_meters",method="GET",status="429"} 1', text)
+        self.assertIn('dataverse_http_request_duration_seconds_count{endpoint="crmk_meters",method="POST",status="200"} 1', text)
+        self.assertIn('dataverse_http_throttled_total{endpoint="crmk_meters"} 1', text)
+        self.assertIn('dataverse_http_bytes_total{endpoint="crmk_meters",direction="sent"} 8', text)
+        self.assertIn('dataverse_http_bytes_total{endpoint="crmk_meters",direction="received"} 13', text)
+
+    def test_disabled_bytes_metric_is_not_measured(self):
+        client = DataverseClient('https://unmetered.crm4.dynamics.com', access_token='token')
+        responses = iter([FakeResponse(200, b'{}')])
+
+        with mock.patch.object(requests.Session, 'request', side_effect=fake_request(responses)), \
+                mock.patch.object(metrics.HTTP_BYTES, 'enabled', False):
+            response = client.post('api/data/v9.1/crmk_gauges', json={'n': 1})
+            self.assertEqual(metrics.request_size(response.request), 0)
+
+        self.assertEqual(metrics.request_size(response.request), 8)
+        self.assertEqual(metrics.HTTP_BYTES.value(endpoint='crmk_gauges', direction='sent'), 0)
+        self.assertEqual(metrics.HTTP_BYTES.value(endpoint='crmk_gauges', direction='received'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
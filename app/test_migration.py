@@ -1,82 +1,168 @@
+import os
+import tempfile
 import unittest
-import logging
-import app
-from migration_scripts.authenticate import authenticate_to_dataverse
-from migration_scripts.extract_data_logic import fetch_all_data
-from migration_scripts.transform_data import transform_data
-from migration_scripts.load_data import load_data_into_target
+from unittest import mock
+
+import requests
+
+import app as migration_app
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import execute_fetchxml_query, get_access_token, get_client, load_config, load_data_to_target, read_fetchxml, transform_data
+from migration_scripts import metrics
+from migration_scripts.record_store import RecordStore
+from migration_scripts.retry import RetryPolicy
+
+if not hasattr(migration_app, 'run_migration'):
+    # pytest imports the app directory as a package, so app.py is app.app
+    from app import app as migration_app
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERY = '<fetch count="10"><entity name="crmk_plant"><attribute name="crmk_plantid" /></entity></fetch>'
+USER_MAPPING = {'old_user_id_1': 'new_generic_user_id', 'default': 'new_generic_user_id'}
+
 
 class TestMigrationScripts(unittest.TestCase):
+    """
+    Runs the pipeline offline against the local mock Dataverse in benchmarks.mock_dataverse.
+    """
 
     @classmethod
     def setUpClass(cls):
-        logging.basicConfig(filename='application.log', level=logging.DEBUG)
-        logging.debug('Starting a new test suite')
-        cls.config = app.load_config()
-        logging.debug(f"Configuration for tests: {cls.config}")
+        cls.mock = MockDataverse(rows=25).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
 
     def setUp(self):
-        logging.debug('Starting a new test case')
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
 
     def test_load_config(self):
+        config = load_config(os.path.join(APP_DIR, 'config.json'))
+        self.assertIn('batch_config', config)
+
+    def test_read_fetchxml(self):
+        xml_string = read_fetchxml(os.path.join(APP_DIR, 'xml_queries', 'plants.xml'))
+        self.assertTrue(xml_string.startswith('<fetch'))
+
+    def test_get_access_token(self):
+        access_token = get_access_token('client', 'secret', 'tenant', self.mock.base_url, authority_host=self.mock.base_url)
+        self.assertEqual(access_token, 'mock-access-token')
+
+    def test_extract_follows_next_link(self):
+        store = execute_fetchxml_query(self.client, [QUERY], self.mock.base_url, self.path('raw'))
+
+        records = list(store)
+        self.assertEqual(len(records), 25)
+        self.assertEqual(records[-1]['crmk_primaryname'], 'crmk_plant 24')
+
+    def test_transform_and_load(self):
+        execute_fetchxml_query(self.client, [QUERY], self.mock.base_url, self.path('raw'))
+        transformed = transform_data(self.path('raw'), self.path('transformed'), USER_MAPPING, 'last_updated', '2024-01-01', 'dynamics365')
+        self.assertEqual(len(transformed), 25)
+        self.assertNotIn('modifiedon', next(iter(transformed)))
+
+        writes, batches = self.mock.stats['writes'], self.mock.stats['batches']
+        load_data_to_target(RecordStore(self.path('transformed')), self.mock.base_url, {'crmk_plant': 1}, self.client, batch_size=10)
+        self.assertEqual(self.mock.stats['writes'] - writes, 25)
+        self.assertEqual(self.mock.stats['batches'] - batches, 3)
+
+    def test_throttled_requests_raise(self):
+        with MockDataverse(rows=5, throttle_rate=1.0, retry_after=0) as throttled:
+            client = get_client('client', 'secret', 'tenant', throttled.base_url, authority_host=throttled.base_url,
+                                retry_policy=RetryPolicy(max_attempts=3, base_delay=0))
+            with self.assertRaises(requests.HTTPError) as raised:
+                execute_fetchxml_query(client, [QUERY], throttled.base_url, self.path('raw'))
+        self.assertEqual(raised.exception.response.status_code, 429)
+        self.assertEqual(raised.exception.response.headers['Retry-After'], '0')
+        self.assertEqual(throttled.stats['throttled'], 3)
+
+    def test_lean_extract_reads_fewer_bytes(self):
+        wire = lambda: metrics.EXTRACT_BYTES.value(entity='crmk_plant', encoding='wire')
+        decoded = lambda: metrics.EXTRACT_BYTES.value(entity='crmk_plant', encoding='decoded')
+        with MockDataverse(rows=25, compress=True) as compressed:
+            client = get_client('client', 'secret', 'tenant', compressed.base_url, authority_host=compressed.base_url)
+            sizes = []
+            for name, annotations in (('full', None), ('lean', [])):
+                before = wire(), decoded()
+                records = list(execute_fetchxml_query(client, [QUERY], compressed.base_url, self.path(name), annotations=annotations))
+                sizes.append((wire() - before[0], decoded() - before[1], records))
+
+        (full_wire, full_decoded, full_records), (lean_wire, lean_decoded, lean_records) = sizes
+        self.assertIn('owner_id@OData.Community.Display.V1.FormattedValue', full_records[0])
+        self.assertEqual(lean_records, [{key: value for key, value in record.items() if '@' not in key or key == '@odata.etag'}
+                                        for record in full_records])
+        self.assertLess(full_wire, full_decoded)
+        self.assertLess(lean_decoded, full_decoded)
+        self.assertLess(lean_wire, full_wire)
+
+    def run_migration(self, **options):
+        query_file = self.path('plants.xml')
+        with open(query_file, 'w') as file:
+            file.write(QUERY)
+        config = load_config(os.path.join(APP_DIR, 'config.json'))
+        config.update({
+            'source_base_url': self.mock.base_url,
+            'target_base_url': self.mock.base_url,
+            'authority_host': self.mock.base_url,
+            'fetchxml_files': [query_file],
+            'watermark_file': self.path('watermarks.json'),
+            'load_journal_file': self.path('load_journal.db'),
+        }, **options)
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir.name)
         try:
-            config = app.load_config()
-            self.assertIsNotNone(config)
-            logging.debug(f"Test load_config passed with config: {config}")
-        except Exception as e:
-            logging.error(f"Test load_config failed: {e}")
-            self.fail(f"load_config raised an exception: {e}")
-
-    def test_load_fetchxml(self):
-        try:
-            filename = self.config.get('fetchxml_filename', 'sample_fetch.xml')  # Ensure this file exists
-            xml_string = app.load_fetchxml(filename)
-            self.assertTrue(xml_string.startswith('<fetch'))
-            logging.debug(f"Test load_fetchxml passed with XML: {xml_string}")
-        except Exception as e:
-            logging.error(f"Test load_fetchxml failed: {e}")
-            self.fail(f"load_fetchxml raised an exception: {e}")
-
-    def test_authenticate_to_dataverse(self):
-        try:
-            access_token = authenticate_to_dataverse(self.config['tenant_id'], self.config['client_id'], self.config['client_secret'])
-            self.assertIsNotNone(access_token)
-            logging.debug(f"Test authenticate_to_dataverse passed with token: {access_token}")
-        except Exception as e:
-            logging.error(f"Test authenticate_to_dataverse failed: {e}")
-            self.fail(f"authenticate_to_dataverse raised an exception: {e}")
-
-    def test_fetch_all_data(self):
-        try:
-            access_token = authenticate_to_dataverse(self.config['tenant_id'], self.config['client_id'], self.config['client_secret'])
-            fetchxml_query = app.load_fetchxml(self.config.get('fetchxml_filename', 'sample_fetch.xml'))  # Ensure this file exists
-            data = fetch_all_data(access_token, self.config['source_base_url'], fetchxml_query)
-            self.assertIsInstance(data, list)
-            logging.debug(f"Test fetch_all_data passed with data: {data}")
-        except Exception as e:
-            logging.error(f"Test fetch_all_data failed: {e}")
-            self.fail(f"fetch_all_data raised an exception: {e}")
-
-    def test_transform_data(self):
-        try:
-            sample_data = [{'sample_key': 'sample_value'}]  # Use actual sample data structure
-            transformed_data = transform_data(sample_data, self.config['user_mapping'], self.config['masking_fields'], self.config['batch_config'])
-            self.assertIsInstance(transformed_data, dict)  # Assuming the transformed data is returned as a dict
-            logging.debug(f"Test transform_data passed with transformed data: {transformed_data}")
-        except Exception as e:
-            logging.error(f"Test transform_data failed: {e}")
-            self.fail(f"transform_data raised an exception: {e}")
-
-    def test_load_data_into_target(self):
-        try:
-            sample_transformed_data = {'sample_entity': [{'sample_key': 'sample_value'}]}  # Use actual sample transformed data structure
-            access_token = authenticate_to_dataverse(self.config['tenant_id'], self.config['client_id'], self.config['client_secret'])
-            load_results = load_data_into_target(sample_transformed_data, access_token, self.config['target_base_url'])
-            self.assertIsInstance(load_results, dict)
-            logging.debug(f"Test load_data_into_target passed with load results: {load_results}")
-        except Exception as e:
-            logging.error(f"Test load_data_into_target failed: {e}")
-            self.fail(f"load_data_into_target raised an exception: {e}")
+            return migration_app.run_migration(config)
+        finally:
+            os.chdir(cwd)
+
+    def test_run_migration(self):
+        result = self.run_migration()
+        self.assertEqual(result, {'extracted': 25, 'transformed': 25})
+
+    def test_rerun_skips_unchanged_records(self):
+        self.run_migration(change_detection='journal')
+        writes = self.mock.stats['writes']
+
+        result = self.run_migration(change_detection='journal')
+
+        self.assertEqual(result, {'extracted': 25, 'transformed': 25, 'changed': 0})
+        self.assertEqual(self.mock.stats['writes'], writes)
+
+    def test_validation_rejects_a_bad_mapping_before_the_load(self):
+        writes = self.mock.stats['writes']
+
+        # The default plan writes the owner to OwnerId, which is not a column of the target
+        result = self.run_migration(validate_records=True)
+
+        self.assertEqual(result, {'extracted': 25, 'transformed': 25, 'validated': 0})
+        self.assertEqual(self.mock.stats['writes'], writes)
+        with open(self.path('rejects.ndjson')) as file:
+            self.assertEqual(len(file.readlines()), 25)
+
+    def test_watermarks_are_kept_when_records_fail_to_load(self):
+        with mock.patch.object(migration_app, 'load_data_to_target', return_value=3):
+            result = self.run_migration(incremental=True)
+        self.assertEqual(result, {'extracted': 25, 'transformed': 25, 'failed': 3})
+        self.assertFalse(os.path.exists(self.path('watermarks.json')))
+
+        self.run_migration(incremental=True)
+        self.assertTrue(os.path.exists(self.path('watermarks.json')))
+
+    def test_watermarks_are_kept_when_records_are_rejected(self):
+        result = self.run_migration(incremental=True, validate_records=True)
+
+        self.assertEqual(result['validated'], 0)
+        self.assertFalse(os.path.exists(self.path('watermarks.json')))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import execute_fetchxml_query, get_client
+from migration_scripts.query_partitions import (bounds_query, date_boundaries, guid_boundaries, partition_query,
+                                                sql_guid_key)
+
+QUERY = '<fetch count="10"><entity name="crmk_plant"><attribute name="crmk_plantid" /></entity></fetch>'
+
+
+def range_conditions(fetchxml_query):
+    filters = ET.fromstring(fetchxml_query).findall('entity/filter')
+    return [(c.attrib['attribute'], c.attrib['operator'], c.attrib.get('value')) for c in filters[-1]]
+
+
+class TestQueryPartitions(unittest.TestCase):
+
+    def test_guid_boundaries_follow_sql_order(self):
+        boundaries = guid_boundaries(4)
+
+        self.assertEqual(len(boundaries), 3)
+        self.assertEqual(boundaries[0], '00000000-0000-0000-0000-400000000000')
+        self.assertEqual(sorted(boundaries, key=sql_guid_key), boundaries)
+
+    def test_guid_partitions_cover_the_key_range(self):
+        queries = partition_query(QUERY, 3, field='crmk_plantid')
+
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(range_conditions(queries[0]), [('crmk_plantid', 'lt', guid_boundaries(3)[0])])
+        self.assertEqual(range_conditions(queries[1]), [('crmk_plantid', 'ge', guid_boundaries(3)[0]),
+                                                        ('crmk_plantid', 'lt', guid_boundaries(3)[1])])
+        self.assertEqual(range_conditions(queries[2]), [('crmk_plantid', 'ge', guid_boundaries(3)[1])])
+
+    def test_date_partitions_read_bounds_and_add_null_partition(self):
+        requested = []
+
+        def fetch_bounds(query):
+            requested.append(query)
+            descending = ET.fromstring(query).find('entity/order').attrib['descending'] == 'true'
+            return '2024-01-05T00:00:00Z' if descending else '2024-01-01T00:00:00Z'
+
+        queries = partition_query(QUERY, 4, 'date', fetch_bounds=fetch_bounds)
+
+        self.assertEqual(requested, [bounds_query(QUERY, 'createdon'), bounds_query(QUERY, 'createdon', descending=True)])
+        self.assertEqual(len(queries), 5)
+        self.assertEqual(range_conditions(queries[1]), [('createdon', 'ge', '2024-01-02T00:00:00Z'),
+                                                        ('createdon', 'lt', '2024-01-03T00:00:00Z')])
+        self.assertEqual(range_conditions(queries[4]), [('createdon', 'null', None)])
+
+    def test_date_boundaries_skip_duplicates(self):
+        self.assertEqual(date_boundaries('2024-01-01T00:00:00Z', '2024-01-01T00:00:01Z', 4), [])
+
+    def test_queries_that_cannot_be_split_are_kept(self):
+        for query in ('<fetch top="5"><entity name="crmk_plant" /></fetch>',
+                      '<fetch aggregate="true"><entity name="crmk_plant" /></fetch>'):
+            self.assertEqual(partition_query(query, 4, field='crmk_plantid'), [query])
+
+
+class TestPartitionedExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=47).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def extract(self, name, **options):
+        return list(execute_fetchxml_query(self.client, [QUERY], self.mock.base_url,
+                                           os.path.join(self.temp_dir.name, name), **options))
+
+    def test_partitioned_extract_returns_the_same_records(self):
+        expected = self.extract('whole')
+        self.assertEqual(len(expected), 47)
+
+        self.assertEqual(self.extract('guid', partitions=4), expected)
+        self.assertEqual(self.extract('date', partitions=4, partition_strategy='date'), expected)
+
+    def test_date_partitions_are_fetched_separately(self):
+        pages = self.mock.stats['pages']
+
+        records = self.extract('date', partitions=3, partition_strategy='date', partition_field='createdon')
+
+        self.assertEqual(len(records), 47)
+        # two bounds queries, then three ranges of 15 to 17 rows in two pages each and an empty null partition
+        self.assertEqual(self.mock.stats['pages'] - pages, 2 + 3 * 2 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
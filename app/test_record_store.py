@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+from migration_scripts.record_store import RecordStore
+from migration_scripts.transform_data import transform_data
+from migration_scripts.utilities import inspect_temp_data
+
+
+class TestRecordStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'store')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parts_are_read_in_part_order(self):
+        store = RecordStore.create(self.path, segment_records=2)
+        second = store.writer(1)
+        first = store.writer(0)
+        with second:
+            second.write_many({'id': f'b{index}'} for index in range(3))
+        with first:
+            first.write_many({'id': f'a{index}'} for index in range(3))
+
+        reopened = RecordStore(self.path)
+        self.assertEqual(len(reopened), 6)
+        self.assertEqual(len(reopened.segments), 4)
+        self.assertEqual([record['id'] for record in reopened], ['a0', 'a1', 'a2', 'b0', 'b1', 'b2'])
+
+    def test_get_by_offset(self):
+        for compress in (False, True):
+            with RecordStore.create(self.path, compress=compress, segment_records=3) as store:
+                with store.writer() as writer:
+                    writer.write_many({'id': index, 'name': 'x' * index} for index in range(10))
+                self.assertEqual([store.get(offset)['id'] for offset in (0, 2, 3, 9)], [0, 2, 3, 9])
+                self.assertEqual(store.get(7)['name'], 'x' * 7)
+                with self.assertRaises(IndexError):
+                    store.get(10)
+
+    def test_iter_lines_of_a_segment(self):
+        for compress in (False, True):
+            store = RecordStore.create(self.path, compress=compress, segment_records=5)
+            with store.writer() as writer:
+                writer.write_many({'id': index} for index in range(8))
+            second = store.segments[1]
+
+            self.assertEqual(list(store.iter_lines(store.segments[0], 1, 3)), [b'{"id":1}\n', b'{"id":2}\n'])
+            self.assertEqual(list(store.iter_lines(second, 2)), [b'{"id":7}\n'])
+            with store.writer(1) as writer:
+                writer.write_lines(b''.join(store.iter_lines(second)))
+            self.assertEqual([record['id'] for record in store.iter_records(part=1)], [5, 6, 7])
+
+    def test_create_replaces_previous_store(self):
+        with RecordStore.create(self.path).writer() as writer:
+            writer.write({'id': 1})
+        self.assertEqual(len(RecordStore.create(self.path)), 0)
+        self.assertEqual(len(RecordStore(self.path)), 0)
+
+    def test_partitions_by_entity(self):
+        store = RecordStore.create(self.path)
+        with store.writer(0, 'crmk_plant') as writer:
+            writer.write({'id': 'p1'})
+        with store.writer(1, 'crmk_item') as writer:
+            writer.write_many([{'id': 'i1'}, {'id': 'i2'}])
+        with store.writer(2, 'crmk_plant') as writer:
+            writer.write({'id': 'p2'})
+
+        partitions = RecordStore(self.path).partitions()
+        self.assertEqual(list(partitions), ['crmk_plant', 'crmk_item'])
+        self.assertEqual([record['id'] for record in partitions['crmk_plant']], ['p1', 'p2'])
+        self.assertEqual(len(partitions['crmk_item']), 2)
+
+    def test_transform_streams_between_stores(self):
+        with RecordStore.create(self.path).writer(0, 'crmk_plant') as writer:
+            writer.write_many([{'@odata.etag': 'W/"1"', 'crmk_plantid': 'p1'}, {'crmk_plantid': 'p2'}])
+        output = os.path.join(self.temp_dir.name, 'transformed')
+
+        # The date stamp is opt-in per entity
+        transformed = transform_data(self.path, output, {'default': 'owner'}, 'last_updated', '2024-01-01', 'dynamics365',
+                                     transform_plan={'entities': {'crmk_plant': {'stamp_date': True}}})
+
+        self.assertEqual(list(transformed), [
+            {'crmk_plantid': 'p1', 'OwnerId': 'owner', 'last_updated': '2024-01-01'},
+            {'crmk_plantid': 'p2', 'OwnerId': 'owner', 'last_updated': '2024-01-01'},
+        ])
+        self.assertEqual(transformed.entities(), ['crmk_plant'])
+        self.assertEqual(len(inspect_temp_data(output)), 2)
+
+    def test_transform_in_processes_keeps_source_order(self):
+        store = RecordStore.create(self.path, segment_records=7)
+        for part, entity in enumerate(['crmk_plant', 'crmk_item', 'crmk_plant']):
+            with store.writer(part, entity) as writer:
+                writer.write_many({f'{entity}id': f'{part}-{index}', 'owner_id': 'old', 'revenue': index} for index in range(10))
+        serial = list(transform_data(self.path, os.path.join(self.temp_dir.name, 'serial'), {'default': 'owner'},
+                                     'last_updated', '2024-01-01', 'dynamics365', chunk_size=3))
+
+        transformed = transform_data(self.path, os.path.join(self.temp_dir.name, 'parallel'), {'default': 'owner'},
+                                     'last_updated', '2024-01-01', 'dynamics365', chunk_size=3, workers=2)
+
+        self.assertEqual(len(serial), 30)
+        self.assertEqual(list(transformed), serial)
+        self.assertEqual(transformed.entities(), ['crmk_plant', 'crmk_item'])
+        self.assertEqual([len(partition) for partition in transformed.partitions().values()], [20, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
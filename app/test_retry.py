@@ -0,0 +1,128 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from benchmarks.mock_dataverse import MockDataverse, make_record
+from migration_scripts import get_client, load_data_to_target
+from migration_scripts.dataverse_client import DataverseClient
+from migration_scripts.dead_letters import DeadLetterFile, replay_dead_letters
+from migration_scripts.load_data import patch_deferred_lookups
+from migration_scripts.metadata import MetadataCache
+from migration_scripts.retry import CircuitBreaker, RetryPolicy, parse_retry_after
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff_grows_with_jitter_and_honours_retry_after(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.1)
+
+        for attempt, ceiling in ((0, 1.0), (2, 4.0), (6, 5.0)):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= ceiling for delay in delays))
+            self.assertGreater(len(set(delays)), 1)
+        self.assertTrue(all(2.0 <= policy.delay(0, retry_after=2) <= 2.2 for _ in range(50)))
+
+    def test_retry_after_header(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_breaker_pauses_until_the_longest_trip(self):
+        breaker = CircuitBreaker('https://org.crm4.dynamics.com')
+        breaker.trip(0.2)
+        breaker.trip(0.05)
+
+        started = time.monotonic()
+        breaker.wait()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+        self.assertEqual(breaker.trips, 1)
+        self.assertFalse(breaker.is_open)
+
+
+class TestClientRetries(unittest.TestCase):
+
+    def test_throttled_requests_are_retried(self):
+        with MockDataverse(rows=5, throttle_rate=0.5, retry_after=0) as throttled:
+            client = get_client('client', 'secret', 'tenant', throttled.base_url, authority_host=throttled.base_url,
+                                retry_policy=RetryPolicy(max_attempts=20, base_delay=0))
+            statuses = [client.get('api/data/v9.1/crmk_plants?$select=crmk_plantid').status_code for _ in range(10)]
+
+        self.assertEqual(statuses, [200] * 10)
+        self.assertGreater(throttled.stats['throttled'], 0)
+        self.assertGreater(client.breaker.trips, 0)
+
+    def test_broken_connections_are_retried_for_idempotent_methods(self):
+        client = DataverseClient('https://retry.crm4.dynamics.com', access_token='token', retry_policy=RetryPolicy(max_attempts=3, base_delay=0))
+
+        with mock.patch.object(requests.Session, 'request', side_effect=requests.ConnectionError('reset')) as send:
+            with self.assertRaises(requests.ConnectionError):
+                client.get('api/data/v9.1/crmk_plants')
+            self.assertEqual(send.call_count, 3)
+            with self.assertRaises(requests.ConnectionError):
+                client.post('api/data/v9.1/crmk_plants', json={})
+            self.assertEqual(send.call_count, 4)
+
+
+class TestDeadLetters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=5).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'dead_letters.ndjson')
+        self.metadata = MetadataCache(self.mock.base_url)
+        self.metadata.entity(self.client, 'crmk_plant')
+
+    def tearDown(self):
+        self.mock.error_rate = 0.0
+        self.temp_dir.cleanup()
+
+    def test_failed_records_are_replayed(self):
+        records = [make_record('crmk_plant', index) for index in range(5)]
+        self.mock.error_rate = 1.0
+        with DeadLetterFile(self.path) as dead_letters:
+            load_data_to_target({'crmk_plant': records}, self.mock.base_url, {'crmk_plant': 1}, self.client, batch_size=2,
+                                metadata=self.metadata, dead_letters=dead_letters)
+        self.assertEqual(len(dead_letters), 5)
+        self.assertEqual([entry['status'] for entry in dead_letters.entries()], [500] * 5)
+        self.assertEqual(dead_letters.entries()[0]['record'], records[0])
+
+        self.mock.error_rate = 0.0
+        writes = self.mock.stats['writes']
+        result = replay_dead_letters(self.path, self.client, self.metadata, {'crmk_plant': 1}, batch_size=2)
+
+        self.assertEqual(result, {'replayed': 5, 'recovered': 5, 'failed': 0})
+        self.assertEqual(self.mock.stats['writes'] - writes, 5)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_records_failing_again_stay_dead_lettered(self):
+        entity = self.metadata.entity(self.client, 'crmk_plant')
+        keyed = make_record('crmk_plant', 0)
+        unkeyed = {'crmk_primaryname': 'Plant without key'}
+        lookups = {'crmk_parentid@odata.bind': '/crmk_plants(00000000-0000-0000-0000-000000000001)'}
+        with DeadLetterFile(self.path) as dead_letters:
+            self.assertEqual(patch_deferred_lookups(self.client, entity, [(keyed, lookups), (unkeyed, lookups)],
+                                                    dead_letters=dead_letters), 1)
+
+        result = replay_dead_letters(self.path, self.client, self.metadata)
+
+        self.assertEqual(result, {'replayed': 1, 'recovered': 0, 'failed': 1})
+        entries = DeadLetterFile(self.path).entries()
+        self.assertEqual([(entry['record'], entry['lookups']) for entry in entries], [(unkeyed, lookups)])
+
+
+if __name__ == '__main__':
+    unittest.main()
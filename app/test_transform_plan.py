@@ -0,0 +1,53 @@
+import unittest
+
+from benchmarks.transform_benchmark import synthetic_rows, transform_for_dynamics365, transform_for_other_db
+from migration_scripts.transform_plan import compile_transform_plan
+
+
+USER_MAPPING = {'old_user_id_1': 'new_user_1', 'default': 'new_generic_user_id'}
+
+
+class TestTransformPlan(unittest.TestCase):
+
+    def test_default_plans_match_per_record_transforms(self):
+        rows = list(synthetic_rows(20))
+        rows[3]['owner_id'] = 'old_user_id_1'
+        rows[4]['description'] = 'dropped'
+
+        dynamics = compile_transform_plan(None, USER_MAPPING, 'last_updated', '2024-01-01', 'dynamics365')
+        expected = [transform_for_dynamics365(row, USER_MAPPING, 'last_updated', '2024-01-01') for row in rows]
+        self.assertEqual(dynamics.apply_batch(rows), expected)
+
+        self.assertNotIn('last_updated', dynamics.apply(rows[0], 'crmk_plant'))
+
+        other = compile_transform_plan(None, USER_MAPPING, 'last_updated', '2024-01-01', 'sql')
+        expected = [transform_for_other_db(row, USER_MAPPING, 'last_updated', '2024-01-01') for row in rows]
+        self.assertEqual(other.apply_batch(rows), expected)
+
+    def test_entity_settings_add_drops_renames_and_date_stamp(self):
+        plan = compile_transform_plan({
+            'entities': {'crmk_item': {'drop_fields': ['crmk_plantid'], 'rename_fields': {'Item.crmk_itemid': 'crmk_itemid'}, 'stamp_date': True}},
+        }, USER_MAPPING, 'last_updated', '2024-01-01', 'dynamics365')
+
+        item = plan.apply({'Item.crmk_itemid': 'i1', 'crmk_plantid': 'p1', 'description': 'x'})
+        plant = plan.apply({'LandObject.crmk_denominationname': 'LAND', 'crmk_plantid': 'p1'})
+
+        self.assertEqual(item, {'crmk_itemid': 'i1', 'OwnerId': 'new_generic_user_id', 'last_updated': '2024-01-01'})
+        self.assertEqual(plant, {'LandObject.crmk_denominationname': 'LAND', 'crmk_plantid': 'p1', 'OwnerId': 'new_generic_user_id'})
+
+    def test_required_annotations(self):
+        self.assertEqual(compile_transform_plan(None, USER_MAPPING, 'last_updated', '2024-01-01', 'dynamics365').required_annotations(), [])
+
+        plan = compile_transform_plan({
+            'annotations': ['Microsoft.Dynamics.CRM.lookuplogicalname'],
+            'entities': {'crmk_plant': {'rename_fields': {'statuscode@OData.Community.Display.V1.FormattedValue': 'status_label'}}},
+        }, USER_MAPPING, 'last_updated', '2024-01-01', 'dynamics365')
+        self.assertEqual(plan.required_annotations(), ['Microsoft.Dynamics.CRM.lookuplogicalname', 'OData.Community.Display.V1.FormattedValue'])
+
+    def test_missing_default_owner_fails_at_compile_time(self):
+        with self.assertRaises(KeyError):
+            compile_transform_plan(None, {}, 'last_updated', '2024-01-01', 'dynamics365')
+
+
+if __name__ == '__main__':
+    unittest.main()
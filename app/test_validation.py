@@ -0,0 +1,113 @@
+import os
+import json
+import tempfile
+import unittest
+
+from benchmarks.mock_dataverse import MockDataverse
+from migration_scripts import get_client
+from migration_scripts.metadata import MetadataCache
+from migration_scripts.record_store import RecordStore
+from migration_scripts.validation import RecordValidator, validate_data
+
+PLANT_ID = '00000000-0000-0000-0000-000000000001'
+VALID = {'crmk_plantid': PLANT_ID, 'crmk_primaryname': 'Plant 1', 'statecode': 0,
+         'ownerid@odata.bind': f'/systemusers({PLANT_ID})', '@odata.etag': 'W/"1"', 'logical_name': 'crmk_plant'}
+
+
+class TestValidation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockDataverse(rows=1).start()
+        cls.client = get_client('client', 'secret', 'tenant', cls.mock.base_url, authority_host=cls.mock.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataCache(self.mock.base_url, os.path.join(self.temp_dir.name, 'metadata'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def validator(self, **options):
+        return RecordValidator(self.metadata.entity(self.client, 'crmk_plant'),
+                               self.metadata.constraints(self.client, 'crmk_plant'), **options)
+
+    def test_constraints_are_cached_with_the_definition(self):
+        constraints = self.metadata.constraints(self.client, 'crmk_plant')
+        requests = self.mock.stats['metadata']
+
+        self.assertEqual(constraints['crmk_projectshortname']['max_length'], 10)
+        self.assertEqual(constraints['statecode']['options'], [0, 1])
+        self.assertEqual(constraints['ownerid']['targets'], ['systemuser', 'team'])
+        self.assertTrue(constraints['crmk_primaryname']['required'])
+        self.assertFalse(constraints['createdon']['create'])
+
+        reloaded = MetadataCache(self.mock.base_url, self.path('metadata'))
+        self.assertEqual(reloaded.constraints(self.client, 'crmk_plant'), constraints)
+        self.assertEqual(self.mock.stats['metadata'], requests)
+
+    def test_record_errors(self):
+        validator = self.validator()
+
+        self.assertEqual(validator.validate(VALID), [])
+        self.assertEqual(validator.validate(dict(VALID, crmk_plantid='p1', statecode=2, crmk_projectshortname='x' * 11,
+                                                 createdon='2024-13-01', OwnerId='user')), [
+            'OwnerId: is not a column of crmk_plant',
+            'crmk_plantid: is not a GUID',
+            'statecode: is not a valid option',
+            'crmk_projectshortname: exceeds the maximum length 10',
+            'createdon: is not an ISO 8601 date',
+        ])
+        self.assertEqual(validator.validate({'crmk_plantid': PLANT_ID, 'ownerid': PLANT_ID, 'crmk_PlantId@odata.bind': '/crmk_plants(1)',
+                                             'createdon': '2024-01-01T00:00:00Z'}), [
+            'crmk_PlantId@odata.bind: is not a lookup of crmk_plant',
+            'ownerid: must be set with @odata.bind',
+            'createdon: cannot be set when the record is created',
+            'crmk_primaryname: is required',
+        ])
+        self.assertEqual(validator.validate(dict(VALID, crmk_primaryname=None, **{'ownerid@odata.bind': 'user1'})), [
+            'crmk_primaryname: is required',
+            'ownerid@odata.bind: is not an entity reference like /<entity set>(<id>)',
+        ])
+
+    def test_upserts_do_not_require_every_column(self):
+        record = {'crmk_plantid': PLANT_ID, 'crmk_projectshortname': '001'}
+
+        self.assertEqual(self.validator().validate(record), ['crmk_primaryname: is required'])
+        self.assertEqual(self.validator(upsert=True).validate(record), [])
+
+    def test_invalid_records_are_rejected_without_a_request(self):
+        records = [dict(VALID, crmk_primaryname=f'Plant {index}') for index in range(5)]
+        records[1]['statecode'] = 5
+        records[3]['crmk_primaryname'] = 'x' * 101
+        with RecordStore.create(self.path('transformed')).writer(0, 'crmk_plant') as writer:
+            writer.write_many(records)
+        with RecordStore(self.path('transformed')).writer(1, 'crmk_unknown') as writer:
+            writer.write({'id': 1})
+        self.metadata.constraints(self.client, 'crmk_plant')
+        requests = dict(self.mock.stats)
+
+        validated = validate_data(self.path('transformed'), self.path('validated'), self.client, self.metadata,
+                                  ['crmk_plant', 'crmk_item'], self.path('rejects.ndjson'), chunk_size=2)
+
+        self.assertEqual(dict(self.mock.stats), requests)
+        self.assertEqual(list(validated), [records[0], records[2], records[4]])
+        self.assertEqual(validated.entities(), ['crmk_plant'])
+        with open(self.path('rejects.ndjson')) as file:
+            rejects = [json.loads(line) for line in file]
+        self.assertEqual([(reject['entity'], reject['index'], reject['errors']) for reject in rejects], [
+            ('crmk_plant', 1, ['statecode: is not a valid option']),
+            ('crmk_plant', 3, ['crmk_primaryname: exceeds the maximum length 100']),
+        ])
+        self.assertEqual(rejects[0]['record'], records[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from migration_scripts.record_store import RecordStore
+from migration_scripts.watermarks import apply_watermark, collect_watermarks, load_watermarks, save_watermarks
+
+
+QUERY = '<fetch><entity name="crmk_plant"><attribute name="crmk_plantid" /><filter><condition attribute="statecode" operator="eq" value="0" /></filter></entity></fetch>'
+
+
+class TestWatermarks(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_apply_watermark_adds_condition_and_column(self):
+        entity = ET.fromstring(apply_watermark(QUERY, '2024-05-01T10:00:00Z')).find('entity')
+        self.assertIn('modifiedon', [attribute.get('name') for attribute in entity.findall('attribute')])
+        conditions = [condition.attrib for condition in entity.findall('filter/condition')]
+        self.assertIn({'attribute': 'modifiedon', 'operator': 'ge', 'value': '2024-05-01T10:00:00Z'}, conditions)
+        self.assertEqual(len(conditions), 2)
+
+    def test_first_run_only_selects_the_watermark_column(self):
+        entity = ET.fromstring(apply_watermark(QUERY)).find('entity')
+        self.assertEqual(len(entity.findall('filter')), 1)
+        self.assertEqual(len(entity.findall("attribute[@name='modifiedon']")), 1)
+
+    def test_collect_and_persist_watermarks(self):
+        store = RecordStore.create(os.path.join(self.temp_dir.name, 'store'))
+        with store.writer(0) as writer:
+            writer.write_many([{'modifiedon': '2024-05-02T00:00:00Z'}, {'modifiedon': '2024-05-03T00:00:00Z'}])
+        with store.writer(1):
+            pass
+
+        previous = {'plants.xml': '2024-01-01T00:00:00Z', 'items.xml': '2024-02-01T00:00:00Z'}
+        watermarks = collect_watermarks(store, ['plants.xml', 'items.xml'], previous)
+        self.assertEqual(watermarks, {'plants.xml': '2024-05-03T00:00:00Z', 'items.xml': '2024-02-01T00:00:00Z'})
+
+        watermark_file = os.path.join(self.temp_dir.name, 'watermarks.json')
+        self.assertEqual(load_watermarks(watermark_file), {})
+        save_watermarks(watermarks, watermark_file)
+        self.assertEqual(load_watermarks(watermark_file), watermarks)
+
+
+if __name__ == '__main__':
+    unittest.main()